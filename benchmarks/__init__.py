@@ -0,0 +1 @@
+"""Benchmarks for listweb, run with ``flask bench``; see benchmarks/runner.py."""
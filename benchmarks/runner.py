@@ -0,0 +1,243 @@
+import http.cookiejar
+import math
+import os
+import platform
+import shutil
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from listweb import db
+from listweb.cache import SimpleCache
+from listweb.fakedata import PASSWORD, forge_bulk
+
+# 每个规模的数据量：(用户数, 电影数, 书籍数, 待办数)，电影等随机分给各个用户
+SIZES = {
+    'small': (10, 1000, 300, 100),
+    'medium': (100, 100000, 30000, 10000),
+    'large': (1000, 1000000, 300000, 100000),
+}
+USERNAME = 'user1'  # 压测时登录的用户
+
+
+def percentile(samples, p):
+    """samples 须已排序，按最近秩法取第 p 百分位。"""
+    if not samples:
+        return None
+    rank = max(math.ceil(p / 100.0 * len(samples)), 1)
+    return samples[min(rank, len(samples)) - 1]
+
+
+def summarize(latencies, elapsed, errors=0):
+    samples = sorted(latencies)
+    return {
+        'requests': len(samples),
+        'errors': errors,
+        'p50_ms': round(percentile(samples, 50) * 1000, 3) if samples else None,
+        'p95_ms': round(percentile(samples, 95) * 1000, 3) if samples else None,
+        'p99_ms': round(percentile(samples, 99) * 1000, 3) if samples else None,
+        'mean_ms': round(sum(samples) / len(samples) * 1000, 3) if samples else None,
+        'rps': round(len(samples) / elapsed, 1) if elapsed else None,
+    }
+
+
+# ---- 发请求的两种方式：WSGI 测试客户端（不含网络开销）和本地真实 HTTP 服务器 ----
+
+class ClientSession(object):
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None):
+        return self.client.open(path, method=method, data=data).status_code
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    # 只测当前请求本身，不跟随重定向
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class HttpSession(object):
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), _NoRedirect())
+
+    def request(self, method, path, data=None):
+        body = urllib.parse.urlencode(data).encode('utf-8') if data is not None else None
+        req = urllib.request.Request(self.base_url + path, data=body, method=method)
+        try:
+            with self.opener.open(req) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            e.read()
+            return e.code
+
+
+class ClientDriver(object):
+    name = 'client'
+    concurrency = 1  # 测试客户端在当前线程里直接调用应用，不做并发
+
+    def __init__(self, app):
+        self.app = app
+
+    def session(self):
+        return ClientSession(self.app)
+
+    def close(self):
+        pass
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):  # 不逐条打印访问日志
+        pass
+
+
+class HttpDriver(object):
+    name = 'http'
+
+    def __init__(self, app, concurrency=4):
+        self.concurrency = concurrency
+        self.server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=_QuietHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.base_url = 'http://127.0.0.1:%d' % self.server.server_port
+
+    def session(self):
+        return HttpSession(self.base_url)
+
+    def close(self):
+        self.server.shutdown()
+        self.thread.join()
+
+
+# ---- 压测场景 ----
+
+def _scenarios(movie_ids, spare_ids):
+    """返回 [(名称, 是否需要登录, 第 i 个请求的 (方法, 路径, 表单))]。
+
+    movie_ids 是登录用户已有的电影，编辑时轮流使用；spare_ids 是预先插入、供删除场景逐个删掉的电影。
+    """
+    return [
+        ('index', False, lambda i: ('GET', '/', None)),
+        ('watchlist', True, lambda i: ('GET', '/watchlist', None)),
+        ('readlist', True, lambda i: ('GET', '/readlist', None)),
+        ('todolist', True, lambda i: ('GET', '/todolist', None)),
+        ('login', False, lambda i: ('POST', '/login', {'username': USERNAME, 'password': PASSWORD})),
+        ('add', True, lambda i: ('POST', '/watchlist', {'title': 'Bench Movie %d' % i})),
+        ('edit', True, lambda i: ('POST', '/movie/edit/%d' % movie_ids[i % len(movie_ids)],
+                                  {'title': 'Edited %d' % i})),
+        ('delete', True, lambda i: ('POST', '/movie/delete/%d' % spare_ids.pop(), None)),
+    ]
+
+
+def _run_scenario(driver, build, login, requests):
+    sessions = [driver.session() for _ in range(driver.concurrency)]
+    if login:
+        for session in sessions:
+            session.request('POST', '/login', {'username': USERNAME, 'password': PASSWORD})
+    latencies, errors = [], []
+    counter = iter(range(requests))
+    lock = threading.Lock()
+
+    def worker(session):
+        while True:
+            with lock:
+                i = next(counter, None)
+                if i is None:
+                    return
+                method, path, data = build(i)
+            started = time.perf_counter()
+            status = session.request(method, path, data)
+            latency = time.perf_counter() - started
+            with lock:
+                latencies.append(latency)
+                if status >= 400:
+                    errors.append(status)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(len(sessions)) as executor:
+        list(executor.map(worker, sessions))
+    return summarize(latencies, time.perf_counter() - started, len(errors))
+
+
+def _prepare(size, seed, requests, echo):
+    from listweb.models import Movie
+    users, movies, books, todos = SIZES[size]
+    db.drop_all()
+    db.create_all()
+    forge_bulk(users, movies, books, todos, seed, echo=echo)
+    # 删除场景每个请求删掉一条，预先为登录用户插入足够的电影
+    user_id = 1
+    db.session.execute(Movie.__table__.insert(), [{'title': 'Spare %d' % i, 'user_id': user_id}
+                                                  for i in range(requests)])
+    db.session.commit()
+    ids = [row.id for row in db.session.query(Movie.id).filter_by(user_id=user_id).order_by(Movie.id)]
+    return ids[:-requests] or ids, ids[-requests:]
+
+
+def run(sizes=('small',), drivers=('client', 'http'), requests=200, concurrency=4, seed=0, echo=print, app=None):
+    """在每个规模的临时数据库上依次压测各个场景，返回可以写成 JSON 的结果。app 默认为当前程序。"""
+    if app is None:
+        app = current_app._get_current_object()
+    results = {'meta': {'python': platform.python_version(), 'requests': requests,
+                        'concurrency': concurrency, 'seed': seed, 'time': time.strftime('%Y-%m-%dT%H:%M:%S')},
+               'results': {}}
+    original_uri = app.config['SQLALCHEMY_DATABASE_URI']
+    original_cache = app.extensions.get('page_cache')
+    original_timing_log = app.config['TIMING_LOG']
+    directory = tempfile.mkdtemp(prefix='listweb-bench-')
+    try:
+        app.config['TIMING_LOG'] = False  # 压测的请求不写计时日志
+        with app.app_context():
+            for size in sizes:
+                db.session.remove()  # 会话可能还连着原来的数据库
+                app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(directory, size + '.db')
+                # 用独立的页面缓存，不影响（也不清空）正式环境共用的缓存
+                app.extensions['page_cache'] = SimpleCache(app.config['PAGE_CACHE_THRESHOLD'],
+                                                           app.config['PAGE_CACHE_TIMEOUT'])
+                for name in drivers:
+                    movie_ids, spare_ids = _prepare(size, seed, requests, echo)
+                    driver = HttpDriver(app, concurrency) if name == 'http' else ClientDriver(app)
+                    try:
+                        for scenario, login, build in _scenarios(movie_ids, spare_ids):
+                            summary = _run_scenario(driver, build, login, requests)
+                            results['results'].setdefault(size, {}).setdefault(name, {})[scenario] = summary
+                            echo('%-6s %-6s %-9s p50 %8.2fms  p95 %8.2fms  p99 %8.2fms  %8.1f req/s'
+                                 % (size, name, scenario, summary['p50_ms'], summary['p95_ms'],
+                                    summary['p99_ms'], summary['rps']))
+                    finally:
+                        driver.close()
+                db.session.remove()
+                db.get_engine().dispose()
+    finally:
+        db.session.remove()
+        app.config['SQLALCHEMY_DATABASE_URI'] = original_uri
+        app.config['TIMING_LOG'] = original_timing_log
+        if original_cache is None:
+            app.extensions.pop('page_cache', None)
+        else:
+            app.extensions['page_cache'] = original_cache
+        shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def compare(current, baseline, threshold=0.2, metric='p95_ms'):
+    """与基线比较，返回变慢超过 threshold（比例）的 [(规模, 方式, 场景, 基线值, 当前值)]。"""
+    regressions = []
+    for size, drivers in current['results'].items():
+        for name, scenarios in drivers.items():
+            for scenario, summary in scenarios.items():
+                old = baseline.get('results', {}).get(size, {}).get(name, {}).get(scenario, {}).get(metric)
+                new = summary.get(metric)
+                if old and new and new > old * (1 + threshold):
+                    regressions.append((size, name, scenario, old, new))
+    return regressions
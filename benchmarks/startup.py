@@ -0,0 +1,51 @@
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+# 冷启动耗时：每次在新的 Python 进程里导入 listweb、调用 create_app()、处理第一个请求，
+# 分别计时后取中位数。worker 启动、flask 命令的等待时间主要就是这几段。
+PHASES = ('import', 'create_app', 'first_request')
+
+_CHILD = '''
+import json, sys, time
+started = time.perf_counter()
+import listweb
+imported = time.perf_counter()
+app = listweb.create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite://', 'TESTING': True,
+                          'SLOWLOG_FILE': None, 'TIMING_LOG': False, 'SQL_QUERY_BUDGET': 0})
+created = time.perf_counter()
+modules = len(sys.modules)
+views_loaded = 'listweb.views' in sys.modules
+with app.app_context():
+    listweb.db.create_all()
+status = app.test_client().get('/').status_code
+finished = time.perf_counter()
+print(json.dumps({'import': imported - started, 'create_app': created - imported,
+                  'first_request': finished - created, 'modules': modules,
+                  'views_loaded': views_loaded, 'status': status}))
+'''
+
+
+def measure_once(cwd=None):
+    """在子进程里冷启动一次，返回各阶段秒数、进程总耗时（含解释器启动）和 create_app 后已加载的模块数。"""
+    started = time.perf_counter()
+    output = subprocess.run([sys.executable, '-c', _CHILD], cwd=cwd, check=True, stdout=subprocess.PIPE).stdout
+    result = json.loads(output.decode('utf-8').strip().splitlines()[-1])
+    result['process'] = time.perf_counter() - started
+    return result
+
+
+def run(runs=5, cwd=None, echo=print):
+    """冷启动 runs 次，返回各阶段耗时的中位数（毫秒）。"""
+    samples = [measure_once(cwd) for _ in range(runs)]
+    summary = {name + '_ms': round(statistics.median(sample[name] for sample in samples) * 1000, 2)
+               for name in PHASES + ('process',)}
+    summary['modules'] = samples[-1]['modules']
+    summary['views_loaded_at_start'] = samples[-1]['views_loaded']
+    for name in PHASES + ('process',):
+        echo('%-14s %8.2fms' % (name, summary[name + '_ms']))
+    echo('%d modules loaded after create_app(), views %s' % (
+        summary['modules'], 'loaded' if summary['views_loaded_at_start'] else 'deferred'))
+    return summary
@@ -1,48 +1,169 @@
 import os
 import sys
+import threading
 
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
 
+from listweb.engine import SQLAlchemy, DEFAULTS as SQLITE_DEFAULTS
+
 WIN = sys.platform.startswith('win')
 if WIN:  # 如果是 Windows 系统，使用三个斜线
     prefix = 'sqlite:///'
 else:  # 否则使用四个斜线
     prefix = 'sqlite:////'
-app = Flask(__name__)
-app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev')  # 基于安全的考虑，在部署时应该设置为随机字符，且不应该明文写在代码里。
-# 注意更新这里的路径，把 app.root_path 添加到 os.path.dirname() 中
-# 以便把文件定位到项目根目录
-app.config['SQLALCHEMY_DATABASE_URI'] = prefix + os.path.join(os
-.path.dirname(app.root_path), os.getenv('DATABASE_FILE', 'data.db'))
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False  # 关闭对模型修改的监控
 
-# 设置数据库 URI
-db = SQLAlchemy(app)  # 初始化扩展，传入程序实例app
-# 初始化 Flask-Login
-login_manager = LoginManager(app)  # 实例化扩展类
+# 扩展在模块级创建但不绑定程序实例，由 create_app() 调用 init_app 完成初始化
+db = SQLAlchemy()
+login_manager = LoginManager()
+
+
+def configure(app):
+    """写入默认配置，create_app(config) 传入的配置会覆盖这些值。"""
+    app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev')  # 基于安全的考虑，在部署时应该设置为随机字符，且不应该明文写在代码里。
+    # 注意更新这里的路径，把 app.root_path 添加到 os.path.dirname() 中
+    # 以便把文件定位到项目根目录
+    app.config['SQLALCHEMY_DATABASE_URI'] = prefix + os.path.join(
+        os.path.dirname(app.root_path), os.getenv('DATABASE_FILE', 'data.db'))
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False  # 关闭对模型修改的监控
+    app.config.update(SQLITE_DEFAULTS)  # SQLite 的 WAL、PRAGMA 和连接池设置，各项含义见 listweb/engine.py
+    app.config['LIST_PAGE_SIZE'] = int(os.getenv('LIST_PAGE_SIZE', 20))  # 清单每页显示的条目数
+    # 缓存的清单总数最多保留的秒数；写入会让它提前失效，这里只兜底绕过 ORM 直接改库的情况
+    app.config['COUNT_CACHE_TIMEOUT'] = 300
+    app.config['USER_CACHE_SIZE'] = 128  # 进程内缓存的用户数上限
+    app.config['USER_CACHE_TTL'] = 60  # 用户缓存的有效秒数，其他进程（如 flask admin）修改用户后最多延迟这么久生效
+    # 清单页面的整页缓存：'simple' 为进程内 LRU，'filesystem' 存到磁盘供多个 worker 共用，'null' 关闭；
+    # 缓存键里的版本号存在数据库里，无论哪种缓存，其他 worker 或命令写入后页面都会失效
+    app.config['PAGE_CACHE_TYPE'] = os.getenv('PAGE_CACHE_TYPE', 'simple')
+    app.config['PAGE_CACHE_DIR'] = os.path.join(os.path.dirname(app.root_path), 'cache')
+    app.config['PAGE_CACHE_THRESHOLD'] = 500  # 最多缓存的页面数
+    app.config['PAGE_CACHE_TIMEOUT'] = 300  # 页面缓存的有效秒数，写操作会让缓存提前失效
+    # 编译好的模板字节码存放的目录，多个 worker 共用，部署时由 flask compile-templates 预先生成；None 表示不缓存
+    app.config['TEMPLATE_CACHE_DIR'] = os.path.join(os.path.dirname(app.root_path), 'cache', 'templates')
+    # 渲染前检查模板文件是否改动过：None 表示跟随调试模式，flask serve 总是关闭，渲染时不再 stat() 模板文件
+    app.config['TEMPLATES_AUTO_RELOAD'] = None
+    app.config['STATIC_FINGERPRINT'] = True  # 静态文件地址带上内容哈希，并允许浏览器长期缓存
+    # 部署标识（如版本号或提交哈希），放进页面缓存键和 ETag，部署后旧的缓存页面和 304 全部失效；
+    # 不设置时使用静态文件清单的哈希，只有静态文件变了才失效
+    app.config['BUILD_ID'] = os.getenv('BUILD_ID')
+    app.config['COMPRESS_DYNAMIC'] = True  # 用 gzip 压缩动态生成的页面
+    app.config['COMPRESS_MIN_SIZE'] = 500  # 小于这个字节数的响应不压缩，省下的流量抵不过开销
+    app.config['COMPRESS_LEVEL'] = 6
+    app.config['SUGGEST_MAX_TITLES'] = 10000  # 每个清单的前缀树最多收录的标题数
+    app.config['SUGGEST_MAX_INDEXES'] = 256  # 进程内最多保留的前缀树棵数（每个用户的每个清单一棵）
+    app.config['TIMING_SAMPLE_RATE'] = float(os.getenv('TIMING_SAMPLE_RATE', 0.01))  # 请求分阶段计时的抽样比例（0 到 1）
+    # 被抽样的请求是否写 Server-Timing 响应头：None 表示只在调试模式下或对管理员发送，True 总是发送，False 不发送。
+    # 响应头里有校验密码的 hash 阶段，不要对所有人打开
+    app.config['TIMING_HEADER'] = None
+    app.config['TIMING_LOG'] = True  # 被抽样的请求写一行 JSON 日志
+    app.config['METRICS_ENABLED'] = True  # 在 /metrics 输出 Prometheus 格式的指标
+    # /metrics 是否允许匿名访问（供 Prometheus 抓取），默认只对管理员开放
+    app.config['METRICS_PUBLIC'] = os.getenv('METRICS_PUBLIC') == '1'
+    # gunicorn 多 worker 部署时设为所有 worker 共用的目录，各进程的计数写在这里再汇总；不设置则只统计当前进程
+    app.config['METRICS_DIR'] = os.getenv('METRICS_DIR')
+    app.config['METRICS_FLUSH_INTERVAL'] = 5  # 每个进程最多隔多少秒把计数写入 METRICS_DIR
+    # 性能剖析（仅管理员可用，见 listweb/profiler.py），默认关闭
+    app.config['PROFILER_ENABLED'] = os.getenv('PROFILER_ENABLED') == '1'
+    app.config['PROFILER_SAMPLING'] = os.getenv('PROFILER_SAMPLING') == '1'  # 后台定时采样调用栈
+    app.config['PROFILER_SAMPLE_INTERVAL'] = 0.01  # 采样间隔秒数
+    app.config['PROFILER_MAX_STACKS'] = 10000  # 每个进程最多保留的不同调用栈数
+    app.config['PROFILER_DIR'] = os.getenv('PROFILER_DIR')  # 保存单个请求 .prof 文件的目录，不设置则不保存
+    app.config['ADMIN_USERNAMES'] = tuple(filter(None, os.getenv('ADMIN_USERNAMES', '').split(',')))  # 站点主人之外的管理员
+    app.config['SLOWLOG_THRESHOLD_MS'] = 100  # 超过这么多毫秒的语句记入慢查询日志，None 表示关闭
+    app.config['SLOWLOG_SIZE'] = 200  # 每个进程的环形缓冲区保留的条数，也是管理页面显示的条数
+    app.config['SLOWLOG_FILE'] = os.path.join(os.path.dirname(app.root_path), 'slowlog.jsonl')  # 所有 worker 共用
+    app.config['SLOWLOG_FILE_MAX_BYTES'] = 5 * 1024 * 1024  # 超过后轮换为 slowlog.jsonl.1
+    app.config['SQL_QUERY_BUDGET'] = 10  # 单个请求的查询条数超过它时记录警告，0 表示不检查
+    app.config['SQL_N_PLUS_ONE_THRESHOLD'] = 5  # 同一条语句在一个请求里执行这么多次，当作疑似 N+1 记录警告
+    app.config['SQL_QUERY_HEADER'] = False  # 在响应头 X-Query-Count 中返回查询条数，调试时打开
+    app.config['API_MAX_PAGE_SIZE'] = 200  # API 每页最多返回的条目数
+    app.config['API_MAX_BATCH'] = 500  # 批量接口一次最多处理的增删改操作数
+    app.config['EXPORT_BATCH_SIZE'] = 1000  # 导出时每次从数据库游标读取的行数
+    app.config['IMPORT_CHUNK_SIZE'] = 500  # 批量导入时每条 INSERT 语句一次写入的行数
+    app.config['IMPORT_MAX_SIZE'] = 16 * 1024 * 1024  # 上传导入文件的最大字节数
+    # 请求体的上限，Werkzeug 解析表单前按 Content-Length 检查，超出时直接返回 413；导入上传是最大的请求
+    app.config['MAX_CONTENT_LENGTH'] = app.config['IMPORT_MAX_SIZE']
+    app.config['API_AUTH_CACHE_TTL'] = 300  # HTTP Basic 认证校验结果的缓存秒数，省掉每次请求都计算密码散列
 
 
 @login_manager.user_loader
 def load_user(user_id):  # 创建用户加载回调函数，接受用户 ID 作为参数
-    from listweb.models import User
-    user = models.User.query.get(int(user_id))  # 用 ID 作为 User 模型的主键查询对应的用户
+    from listweb.timing import phase
+    from listweb.usercache import get_user
+    with phase('auth'):
+        user = get_user(int(user_id))  # 先查请求内和进程内的缓存，未命中才按主键查询
     return user  # 返回用户对象
 
 
+@login_manager.request_loader
+def load_user_from_request(request):
+    # 只对 API 请求启用 HTTP Basic 认证，页面仍然只认登录会话；API 模块在这时才导入
+    from listweb.routes import API_PREFIX
+    if request.authorization is None or not request.path.startswith(API_PREFIX):
+        return None
+    from listweb.api import load_user_from_request as load_api_user
+    return load_api_user(request)
+
+
 # 如果未登录的用户访问对应的 URL，Flask-Login 会把用户重定向至login_manager.login_view指定的视图端点（函数名）
-login_manager.login_view = 'login'
+login_manager.login_view = 'auth.login'
 # 通过设置 login_manager.login_message 来自定义错误提示消息。
 login_manager.login_message = 'Sorry, please login first.'
 
 
 # 将user变量统一注入到每一个模板的上下文环境中
-@app.context_processor
 def inject_user():
-    from listweb.models import User
-    user = User.query.first()
+    from listweb.usercache import list_owner
+    user = list_owner()  # 登录后是当前用户，否则是站点主人；每个请求只查一次
     return dict(user=user)  # 需要返回字典，等同于return {'user': user}
 
 
-from listweb import commands, errors, views
+def create_app(config=None):
+    """创建程序实例。config 为覆盖默认值的配置字典。
+
+    这里只导入建立程序必需的模块：数据库事件、常用的请求钩子和命令。页面和 API 的视图模块
+    （连同它们用到的分页、缓存、检索等），以及剖析、慢查询页面、静态文件指纹和压缩等模块，
+    在 listweb/routes.py 中按导入路径登记，第一次用到时才导入；生产服务器只在 flask serve 时导入。
+    所以 flask initdb 之类的命令和刚启动的 worker 都不用加载整套页面代码。
+    """
+    app = Flask(__name__)
+    configure(app)
+    if config:
+        app.config.update(config)
+
+    db.init_app(app)  # 初始化扩展，传入程序实例app
+    login_manager.init_app(app)
+    app.context_processor(inject_user)
+
+    # 写入时同步版本号、全文索引、前缀树和变更记录的会话事件，命令行写库时同样需要
+    from listweb import versions, search, suggest, changes  # noqa: F401
+    # 请求钩子的注册顺序决定执行顺序（after_request 按注册的相反顺序执行），不要随意调整；
+    # 剖析、静态文件、压缩等钩子由 lazy_hooks 按导入路径登记，用到时才导入
+    from listweb import querystats, timing, templating, metrics, errors
+    from listweb.routes import blueprints, lazy_hooks
+    for module in (querystats, timing, templating, metrics):
+        module.init_app(app)
+    lazy_hooks(app)
+    errors.init_app(app)
+
+    from listweb.commands import cli
+    app.register_blueprint(cli)
+    for blueprint in blueprints():
+        app.register_blueprint(blueprint)
+    return app
+
+
+_default_app_lock = threading.Lock()
+
+
+def __getattr__(name):
+    # 兼容 from listweb import app（wsgi.py、FLASK_APP=listweb、测试）：第一次访问时按默认配置创建，
+    # 并像以前的 SQLAlchemy(app) 一样让 db 在没有应用上下文时也使用这个实例
+    global app
+    if name != 'app':
+        raise AttributeError('module %r has no attribute %r' % (__name__, name))
+    with _default_app_lock:
+        if 'app' not in globals():
+            app = create_app()
+            db.app = app
+    return app
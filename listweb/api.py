@@ -0,0 +1,296 @@
+import hashlib
+import hmac
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import Response, current_app, jsonify, request, stream_with_context
+from flask_login import current_user
+
+from listweb import db
+from listweb.models import User, Movie, Book, Todo
+from listweb.pagination import keyset_paginate
+from listweb.timing import phase
+
+RESOURCES = {'movies': Movie, 'books': Book, 'todos': Todo}
+
+
+def api_error(status, message, **extra):
+    response = jsonify(error=message, **extra)
+    response.status_code = status
+    return response
+
+
+# ---- 认证：浏览器里沿用登录会话，脚本可以用 HTTP Basic ----
+
+# 校验密码散列很慢（几十到上百毫秒），脚本每个请求都带 Basic 认证时，
+# 把校验通过的凭据摘要连同当时的密码散列值缓存一小段时间。
+# 命中时仍按用户名查一次数据库（走索引，比校验散列快得多），散列值变了（改过密码，
+# 不论在哪个进程里改的）就作废缓存重新校验，旧密码立即失效
+_verified = OrderedDict()
+_verified_lock = threading.Lock()
+
+
+def _credential_key(username, password):
+    secret = current_app.config['SECRET_KEY'].encode('utf-8')
+    return hmac.new(secret, ('%s\0%s' % (username, password)).encode('utf-8'), hashlib.sha256).hexdigest()
+
+
+def _user_from_basic_auth(auth):
+    user = User.query.filter_by(username=auth.username).first()
+    if user is None:
+        return None
+    key = _credential_key(auth.username, auth.password)
+    now = time.monotonic()
+    with _verified_lock:
+        entry = _verified.get(key)
+    if entry is not None and entry[0] > now and entry[1:] == (user.id, user.password_hash):
+        return user
+    if not user.validate_password(auth.password):
+        return None
+    with _verified_lock:
+        _verified[key] = (now + current_app.config['API_AUTH_CACHE_TTL'], user.id, user.password_hash)
+        while len(_verified) > 1024:
+            _verified.popitem(last=False)
+    return user
+
+
+def load_user_from_request(request):
+    # 由 listweb.load_user_from_request 在 API 请求带有 Basic 认证时调用
+    with phase('auth'):
+        return _user_from_basic_auth(request.authorization)
+
+
+def api_login_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not current_user.is_authenticated:
+            response = api_error(401, 'Authentication required.')
+            response.headers['WWW-Authenticate'] = 'Basic realm="listweb"'
+            return response
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+# ---- 序列化与校验 ----
+
+def serialize(item, fields=None):
+    fields = fields or ('id',) + tuple(item.FIELD_LIMITS)
+    return {field: getattr(item, field) for field in fields}
+
+
+def parse_fields(model):
+    # ?fields=id,title 只返回需要的字段
+    raw = request.args.get('fields')
+    if not raw:
+        return None
+    fields = tuple(field.strip() for field in raw.split(',') if field.strip())
+    allowed = ('id',) + tuple(model.FIELD_LIMITS)
+    unknown = [field for field in fields if field not in allowed]
+    if unknown:
+        raise ValueError('Unknown fields: %s' % ', '.join(unknown))
+    return fields
+
+
+def clean_item(model, data, partial=False):
+    """按 FIELD_LIMITS 校验一条数据，返回可以直接赋值给模型的字典，不合法时抛出 ValueError。"""
+    if not isinstance(data, dict):
+        raise ValueError('Item must be an object.')
+    values = {}
+    for field, limit in model.FIELD_LIMITS.items():
+        if field not in data:
+            if partial:
+                continue
+            raise ValueError('Missing field: %s' % field)
+        value = data[field]
+        if not isinstance(value, str) or not value or len(value) > limit:
+            raise ValueError('Invalid %s: must be 1-%d characters.' % (field, limit))
+        values[field] = value
+    return values
+
+
+def _owned(model, item_ids):
+    if not item_ids:
+        return {}
+    items = model.query.filter(model.user_id == current_user.id, model.id.in_(item_ids))
+    return {item.id: item for item in items}
+
+
+# ---- 视图，URL 规则见 listweb/routes.py ----
+
+@api_login_required
+def api_list(resource):
+    model = RESOURCES[resource]
+    try:
+        fields = parse_fields(model)
+    except ValueError as e:
+        return api_error(400, str(e))
+    per_page = min(request.args.get('per_page', current_app.config['LIST_PAGE_SIZE'], type=int),
+                   current_app.config['API_MAX_PAGE_SIZE'])
+    page = keyset_paginate(model, after=request.args.get('after', type=int),
+                           before=request.args.get('before', type=int),
+                           per_page=max(per_page, 1), user_id=current_user.id)
+    return jsonify(items=[serialize(item, fields) for item in page.items], total=page.total,
+                   next=page.next_cursor, prev=page.prev_cursor)
+
+
+@api_login_required
+def api_create(resource):
+    model = RESOURCES[resource]
+    try:
+        values = clean_item(model, request.get_json(silent=True))
+    except ValueError as e:
+        return api_error(400, str(e))
+    item = model(user_id=current_user.id, **values)
+    db.session.add(item)
+    db.session.commit()
+    return jsonify(serialize(item)), 201
+
+
+@api_login_required
+def api_item(resource, item_id):
+    model = RESOURCES[resource]
+    item = _owned(model, [item_id]).get(item_id)
+    if item is None:
+        return api_error(404, 'Item not found.')
+    if request.method == 'PATCH':
+        try:
+            values = clean_item(model, request.get_json(silent=True), partial=True)
+        except ValueError as e:
+            return api_error(400, str(e))
+        for field, value in values.items():
+            setattr(item, field, value)
+        db.session.commit()
+    elif request.method == 'DELETE':
+        db.session.delete(item)
+        db.session.commit()
+        return '', 204
+    return jsonify(serialize(item))
+
+
+@api_login_required
+def api_batch(resource):
+    """一次请求里批量增、改、删，全部校验通过后在同一个事务里执行。
+
+    请求体：{"create": [{...}], "update": [{"id": 1, ...}], "delete": [1, 2]}
+    """
+    model = RESOURCES[resource]
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return api_error(400, 'Request body must be a JSON object.')
+    creates = payload.get('create') or []
+    updates = payload.get('update') or []
+    deletes = payload.get('delete') or []
+    if not all(isinstance(ops, list) for ops in (creates, updates, deletes)):
+        return api_error(400, 'create, update and delete must be lists.')
+    if len(creates) + len(updates) + len(deletes) > current_app.config['API_MAX_BATCH']:
+        return api_error(413, 'Too many operations, the limit is %d.' % current_app.config['API_MAX_BATCH'])
+
+    errors = []
+    new_values, changes = [], {}
+    for index, data in enumerate(creates):
+        try:
+            new_values.append(clean_item(model, data))
+        except ValueError as e:
+            errors.append({'op': 'create', 'index': index, 'error': str(e)})
+    for index, data in enumerate(updates):
+        try:
+            item_id = data.get('id') if isinstance(data, dict) else None
+            if not isinstance(item_id, int):
+                raise ValueError('Missing integer id.')
+            changes[item_id] = clean_item(model, data, partial=True)
+        except ValueError as e:
+            errors.append({'op': 'update', 'index': index, 'error': str(e)})
+    if not all(isinstance(item_id, int) for item_id in deletes):
+        errors.append({'op': 'delete', 'error': 'Ids must be integers.'})
+    # 要改、要删的条目一次查询全部取出
+    existing = _owned(model, list(changes) + [i for i in deletes if isinstance(i, int)]) if not errors else {}
+    missing = [item_id for item_id in list(changes) + deletes if item_id not in existing]
+    if missing and not errors:
+        errors.append({'error': 'Items not found.', 'ids': missing})
+    if errors:
+        return api_error(400, 'Batch rejected, nothing was changed.', errors=errors)
+
+    created = [model(user_id=current_user.id, **values) for values in new_values]
+    db.session.add_all(created)
+    for item_id, values in changes.items():
+        for field, value in values.items():
+            setattr(existing[item_id], field, value)
+    for item_id in set(deletes):
+        db.session.delete(existing[item_id])
+    db.session.commit()
+    return jsonify(created=[item.id for item in created], updated=list(changes), deleted=sorted(set(deletes)))
+
+
+@api_login_required
+def api_changes():
+    """增量同步：返回游标 since 之后的增删改，删除的条目以 item 为 null 的墓碑返回。
+
+    since 早于压缩下限时返回 410，客户端需要丢弃本地数据重新全量同步，从 cursor 开始继续。
+    """
+    from listweb.changes import changes_since, horizon, latest_cursor
+    since = request.args.get('since', 0, type=int)
+    lower = horizon()
+    if since < lower:
+        return api_error(410, 'Cursor expired, full resync required.',
+                         cursor=max(latest_cursor(current_user.id), lower))
+    limit = min(request.args.get('limit', current_app.config['API_MAX_PAGE_SIZE'], type=int),
+                current_app.config['API_MAX_PAGE_SIZE'])
+    rows, cursor, more = changes_since(current_user.id, since, max(limit, 1))
+    # 每个清单一次查询取出这一页里仍然存在的条目
+    found = {}
+    for kind, model in RESOURCES.items():
+        ids = [row.item_id for row in rows if row.kind == model.__tablename__ and row.op == 'upsert']
+        found.update({(model.__tablename__, item.id): item for item in _owned(model, ids).values()})
+    changes = []
+    for row in rows:
+        item = found.get((row.kind, row.item_id))
+        # 之后又被删除的条目，墓碑在后面的页里，这里直接当作删除
+        changes.append({'cursor': row.id, 'kind': row.kind, 'id': row.item_id,
+                        'op': 'upsert' if item is not None else 'delete',
+                        'item': serialize(item) if item is not None else None})
+    return jsonify(changes=changes, cursor=cursor, more=more)
+
+
+@api_login_required
+def api_export():
+    """流式导出当前用户的清单，?format=ndjson|csv，?kinds=movie,book 只导出部分清单。"""
+    from listweb.export import FORMATS, KINDS, export
+    fmt = request.args.get('format', 'ndjson')
+    kinds = tuple(kind for kind in request.args.get('kinds', ','.join(KINDS)).split(',') if kind)
+    if fmt not in FORMATS or not kinds or not set(kinds) <= set(KINDS):
+        return api_error(400, 'Unsupported format or kinds.')
+    # 生成器在视图返回后才执行，需要保留请求上下文（以及其中的数据库会话）
+    chunks = stream_with_context(export(fmt, current_user.id, kinds, current_app.config['EXPORT_BATCH_SIZE']))
+    response = Response(chunks, mimetype=FORMATS[fmt])
+    response.headers['Content-Disposition'] = 'attachment; filename=lists.%s' % fmt
+    return response
+
+
+@api_login_required
+def api_import():
+    """上传 CSV / NDJSON / 豆瓣导出文件批量导入，?kind= 指定未注明清单的行归入哪个清单。"""
+    import io
+    from listweb.importer import FORMATS, KINDS, guess_format, import_items, read_rows
+    # 先看大小再访问 request.files，否则整个上传已经被解析、写进临时文件了；
+    # 分块上传事先不知道大小，无法限制，要求带上 Content-Length
+    if request.content_length is None and request.environ.get('wsgi.input_terminated'):
+        return api_error(411, 'Content-Length required.')
+    if (request.content_length or 0) > current_app.config['IMPORT_MAX_SIZE']:
+        return api_error(413, 'File too large.')
+    upload = request.files.get('file')
+    if upload is None:
+        return api_error(400, 'No file uploaded.')
+    fmt = request.args.get('format') or guess_format(upload.filename)
+    kind = request.args.get('kind', 'movie')
+    if fmt not in FORMATS or kind not in KINDS:
+        return api_error(400, 'Unsupported format or kind.')
+    lines = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+    try:
+        result = import_items(current_user.id, read_rows(lines, fmt, kind),
+                              current_app.config['IMPORT_CHUNK_SIZE'])
+    except UnicodeDecodeError:
+        db.session.rollback()
+        return api_error(400, 'File must be UTF-8 encoded.')
+    return jsonify(result.to_dict())
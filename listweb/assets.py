@@ -0,0 +1,131 @@
+import json
+import os
+import shutil
+import subprocess
+
+from flask import current_app, url_for
+from markupsafe import Markup, escape
+
+BUILD_DIR = 'build'  # 相对于 static 目录
+MANIFEST_NAME = 'assets.json'
+
+_manifest = None
+
+
+def _manifest_path(static_folder):
+    return os.path.join(static_folder, BUILD_DIR, MANIFEST_NAME)
+
+
+def load_manifest(reload=False):
+    global _manifest
+    if _manifest is None or reload:
+        try:
+            with open(_manifest_path(current_app.static_folder), encoding='utf-8') as f:
+                _manifest = json.load(f)
+        except (OSError, ValueError):
+            _manifest = {}
+    return _manifest
+
+
+def _is_fresh(target, source):
+    return os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(source)
+
+
+def _save_webp(image, target, width=None):
+    from PIL import Image, ImageSequence
+
+    frames, durations = [], []
+    for frame in ImageSequence.Iterator(image):
+        durations.append(frame.info.get('duration', 100))
+        frame = frame.convert('RGBA')
+        if width is not None:
+            height = max(1, round(frame.height * width / frame.width))
+            frame = frame.resize((width, height), Image.LANCZOS)
+        frames.append(frame)
+    frames[0].save(target, 'WEBP', save_all=True, append_images=frames[1:],
+                   duration=durations, loop=0, quality=75, method=4)
+
+
+def _save_mp4(ffmpeg, source, target):
+    # 静音、循环播放由 <video> 标签控制；H.264 要求宽高为偶数
+    subprocess.run([ffmpeg, '-y', '-loglevel', 'error', '-i', source, '-an',
+                    '-movflags', '+faststart', '-pix_fmt', 'yuv420p', '-c:v', 'libx264', '-crf', '28',
+                    '-vf', 'scale=trunc(iw/2)*2:trunc(ih/2)*2', target], check=True)
+
+
+def build_assets(static_folder, widths, echo=print):
+    """把 static 目录下的 GIF 动图转成 WebP 动图、MP4 和缩小的 WebP，返回新的清单。"""
+    from PIL import Image
+
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg is None:
+        echo('ffmpeg not found, skipping MP4 output.')
+    manifest = {}
+    for root, dirs, files in os.walk(static_folder):
+        dirs[:] = [d for d in dirs if os.path.join(root, d) != os.path.join(static_folder, BUILD_DIR)]
+        for name in sorted(files):
+            if not name.lower().endswith('.gif'):
+                continue
+            source = os.path.join(root, name)
+            filename = os.path.relpath(source, static_folder).replace(os.sep, '/')
+            stem = os.path.splitext(filename)[0]
+            target_dir = os.path.join(static_folder, BUILD_DIR, os.path.dirname(filename))
+            os.makedirs(target_dir, exist_ok=True)
+
+            with Image.open(source) as image:
+                entry = {'width': image.width, 'height': image.height,
+                         'size': os.path.getsize(source), 'webp': [], 'mp4': None}
+                for width in sorted(w for w in widths if w < image.width) + [None]:
+                    suffix = '-%dw.webp' % width if width else '.webp'
+                    output = '%s/%s%s' % (BUILD_DIR, stem, suffix)
+                    target = os.path.join(static_folder, output)
+                    if not _is_fresh(target, source):
+                        _save_webp(image, target, width)
+                    entry['webp'].append({'filename': output, 'width': width or image.width,
+                                          'size': os.path.getsize(target)})
+            if ffmpeg is not None:
+                output = '%s/%s.mp4' % (BUILD_DIR, stem)
+                target = os.path.join(static_folder, output)
+                if not _is_fresh(target, source):
+                    _save_mp4(ffmpeg, source, target)
+                entry['mp4'] = {'filename': output, 'size': os.path.getsize(target)}
+            manifest[filename] = entry
+            echo('%s: %d bytes -> smallest %d bytes' % (
+                filename, entry['size'],
+                min([v['size'] for v in entry['webp']] + ([entry['mp4']['size']] if entry['mp4'] else []))))
+
+    with open(_manifest_path(static_folder), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+    return manifest
+
+
+def animated_image(filename, alt='', class_=None, width=None):
+    """输出动图的 HTML：有构建产物时用 <picture>（WebP 多尺寸）或 <video>（MP4），否则退回 <img>。
+
+    width 为页面上的显示宽度（CSS 像素），用来挑选足够清晰的最小文件。
+    """
+    attrs = ' alt="%s"' % escape(alt)
+    if class_:
+        attrs += ' class="%s"' % escape(class_)
+    img = '<img%s src="%s" loading="lazy" decoding="async"/>' % (
+        attrs, url_for('static', filename=filename))
+    entry = load_manifest().get(filename)
+    if not entry:
+        return Markup(img)
+
+    variants = entry['webp']
+    # 宽度够用的变体里最小的那个；都不够宽就用最大的
+    suitable = [v for v in variants if width is None or v['width'] >= width] or variants[-1:]
+    best_webp = min(suitable, key=lambda v: v['size'])
+    mp4 = entry.get('mp4')
+    if mp4 and mp4['size'] < best_webp['size']:
+        return Markup('<video%s autoplay loop muted playsinline preload="metadata">'
+                      '<source src="%s" type="video/mp4"/>%s</video>' % (
+                          attrs.replace(' alt=', ' aria-label=', 1),
+                          url_for('static', filename=mp4['filename']), img))
+
+    srcset = ', '.join('%s %dw' % (url_for('static', filename=v['filename']), v['width'])
+                       for v in variants)
+    sizes = ' sizes="%dpx"' % width if width else ''
+    return Markup('<picture><source type="image/webp" srcset="%s"%s/>%s</picture>' % (
+        escape(srcset), sizes, img))
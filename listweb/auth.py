@@ -0,0 +1,63 @@
+from flask import request, url_for, redirect, flash, render_template
+from flask_login import current_user, login_required, login_user, logout_user
+
+from listweb import db
+from listweb.metrics import LOGINS
+from listweb.models import User
+
+# 登录、退出和注册（auth 蓝图），URL 规则见 listweb/routes.py
+
+
+def login():
+    if request.method == 'POST':
+        username = request.form['username']
+        password = request.form['password']
+
+        if not username or not password:
+            flash('Invalid input.')
+            return redirect(url_for('auth.login'))
+
+        user = User.query.filter_by(username=username).first()  # username 上有唯一索引
+        # 验证用户名和密码是否一致
+        if user is not None and user.validate_password(password):
+            LOGINS.inc(result='success')
+            login_user(user)
+            flash("Successfully login!")
+            return redirect(url_for('lists.index'))
+        else:
+            LOGINS.inc(result='failure')
+            flash("Invalid username or password.")  # 若验证失败显示错误信息
+            return redirect(url_for('auth.login'))
+
+    return render_template('login.html')
+
+
+@login_required
+def logout():
+    logout_user()
+    flash('Goodbye!')
+    return redirect(url_for('lists.index'))
+
+
+def register():
+    if current_user.is_authenticated:
+        return redirect(url_for('lists.index'))
+    if request.method == 'POST':
+        name = request.form.get('name') or request.form.get('username')
+        username = request.form.get('username')
+        password = request.form.get('password')
+        if (not username or len(username) > 20) or (not password or len(password) > 128) or len(name) > 20:
+            flash('Invalid input.')
+            return redirect(url_for('auth.register'))
+        if User.query.filter_by(username=username).first() is not None:
+            flash('Username already taken.')
+            return redirect(url_for('auth.register'))
+        user = User(name=name, username=username)
+        user.set_password(password)
+        db.session.add(user)
+        db.session.commit()
+        login_user(user)
+        flash('Registration successful!')
+        return redirect(url_for('lists.index'))
+
+    return render_template('register.html')
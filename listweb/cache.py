@@ -0,0 +1,250 @@
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from functools import wraps
+
+from flask import current_app, make_response, request, session
+from flask_login import current_user
+
+
+class NullCache(object):
+    """不缓存任何内容，PAGE_CACHE_TYPE = 'null' 时使用。"""
+
+    def get(self, key):
+        return None
+
+    def set(self, key, value, timeout=None):
+        pass
+
+    def delete(self, key):
+        pass
+
+    def clear(self):
+        pass
+
+
+class SimpleCache(NullCache):
+    """进程内的 LRU 缓存，条目超过 threshold 时淘汰最久未用的，timeout 为 0 表示永不过期。"""
+
+    def __init__(self, threshold=500, default_timeout=300):
+        self.threshold = threshold
+        self.default_timeout = default_timeout
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expires(self, timeout):
+        if timeout is None:
+            timeout = self.default_timeout
+        return time.time() + timeout if timeout else 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires and expires < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=None):
+        with self._lock:
+            self._entries[key] = (self._expires(timeout), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.threshold:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class FileSystemCache(SimpleCache):
+    """磁盘缓存，每个键一个文件，同一台机器上的多个 worker 进程可以共用。"""
+
+    suffix = '.cache'
+
+    def __init__(self, directory, threshold=500, default_timeout=300):
+        super(FileSystemCache, self).__init__(threshold, default_timeout)
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest() + self.suffix)
+
+    def _files(self):
+        return [os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                if name.endswith(self.suffix)]
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                expires, value = pickle.load(f)
+        except (OSError, EOFError, pickle.PickleError):
+            return None
+        if expires and expires < time.time():
+            self.delete(key)
+            return None
+        return value
+
+    def set(self, key, value, timeout=None):
+        self._prune()
+        # 先写临时文件再原子替换，其他进程不会读到写了一半的文件
+        fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=self.directory)
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump((self._expires(timeout), value), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self._path(key))
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def clear(self):
+        for path in self._files():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _prune(self):
+        files = self._files()
+        if len(files) < self.threshold:
+            return
+        # 按最后修改时间删掉最旧的一半
+        files.sort(key=lambda path: os.path.getmtime(path) if os.path.exists(path) else 0)
+        for path in files[:len(files) // 2]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def create_cache(config):
+    cache_type = config['PAGE_CACHE_TYPE']
+    if cache_type == 'simple':
+        return SimpleCache(config['PAGE_CACHE_THRESHOLD'], config['PAGE_CACHE_TIMEOUT'])
+    if cache_type == 'filesystem':
+        return FileSystemCache(config['PAGE_CACHE_DIR'], config['PAGE_CACHE_THRESHOLD'],
+                               config['PAGE_CACHE_TIMEOUT'])
+    if cache_type == 'null':
+        return NullCache()
+    raise ValueError('Unknown PAGE_CACHE_TYPE: %r' % cache_type)
+
+
+def get_cache():
+    cache = current_app.extensions.get('page_cache')
+    if cache is None:
+        cache = current_app.extensions['page_cache'] = create_cache(current_app.config)
+    return cache
+
+
+def _auth_state():
+    if current_user.is_authenticated:
+        return 'user:%s' % current_user.get_id()
+    return 'anon'
+
+
+def _scoped_names(tables):
+    # 页面展示的是某一个用户的清单，只依赖该用户的清单和用户信息的版本；
+    # 页面标题里有用户名，所以 user 的版本也算在内
+    from listweb.usercache import list_owner
+    from listweb.versions import scoped_name
+    owner = list_owner()
+    owner_id = owner.id if owner is not None else None
+    return [scoped_name(table, owner_id) for table in tables + ('user',)]
+
+
+def build_id():
+    # 部署标识：优先用 BUILD_ID 配置，否则开启静态文件指纹时用清单的哈希。
+    # 部署后静态文件地址变了，旧页面里的地址已经 404，不能再命中缓存或返回 304
+    build = current_app.config['BUILD_ID']
+    if build is None and current_app.config['STATIC_FINGERPRINT'] and not current_app.debug:
+        from listweb.fingerprint import manifest_hash
+        build = manifest_hash()
+    return build or ''
+
+
+def page_cache_key(tables):
+    from listweb.versions import stamps
+    versions = stamps(_scoped_names(tables))
+    stamp = ','.join('%s=%s' % (name, token) for name, (token, modified) in versions.items())
+    return 'page:%s:%s:%s:%s:%s' % (build_id(), request.endpoint, request.full_path, _auth_state(), stamp)
+
+
+def conditional_page(*tables):
+    """为 GET 请求加上 ETag / Last-Modified，客户端缓存仍然有效时直接返回 304，只查版本号，不查清单也不渲染模板。"""
+    from listweb.metrics import CACHE
+
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if request.method != 'GET' or session.get('_flashes'):
+                return f(*args, **kwargs)
+            from listweb.versions import stamps
+            # 校验值由数据库里的版本号和部署标识算出，其他进程写入或重新部署后也会变化；两处读的是同一次查询的结果
+            etag = hashlib.sha1(page_cache_key(tables).encode('utf-8')).hexdigest()[:20]
+            latest = max(modified for token, modified in stamps(_scoped_names(tables)).values())
+            # Last-Modified 只精确到秒：最后一次写入还在当前这一秒内时，同一秒里稍后的写入会得到相同的值，
+            # 客户端拿它来验证会误判为没变，所以这时不发 Last-Modified，只靠 ETag
+            modified = None
+            if int(latest) < int(time.time()):
+                modified = datetime.fromtimestamp(int(latest), timezone.utc)
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains_weak(etag)
+            else:
+                not_modified = (modified is not None and request.if_modified_since is not None
+                                and request.if_modified_since >= modified)
+            CACHE.inc(cache='http', result='hit' if not_modified else 'miss')
+            if not_modified:
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(f(*args, **kwargs))
+            response.set_etag(etag, weak=True)
+            if modified is not None:  # 赋值 None 时 Werkzeug 会填上当前时间
+                response.last_modified = modified
+            # 登录后的页面只允许浏览器缓存，且每次都要先验证
+            response.cache_control.no_cache = True
+            if current_user.is_authenticated:
+                response.cache_control.private = True
+            response.vary.add('Cookie')
+            return response
+        return decorated_function
+    return decorator
+
+
+def cached_page(*tables):
+    """缓存 GET 请求渲染出的整页 HTML，tables 中任一清单版本变化后自动失效。"""
+    from listweb.metrics import CACHE
+
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            # 有待显示的 flash 消息时页面内容不通用，既不读也不写缓存
+            if request.method != 'GET' or session.get('_flashes'):
+                return f(*args, **kwargs)
+            cache = get_cache()
+            key = page_cache_key(tables)
+            html = cache.get(key)
+            CACHE.inc(cache='page', result='miss' if html is None else 'hit')
+            if html is None:
+                html = f(*args, **kwargs)
+                if not isinstance(html, str):  # 重定向等非 HTML 响应不缓存
+                    return html
+                cache.set(key, html)
+            return html
+        return decorated_function
+    return decorator
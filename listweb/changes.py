@@ -0,0 +1,79 @@
+from datetime import datetime, timedelta
+
+from listweb import db
+from listweb.models import Change, ChangeHorizon
+
+LISTS = ('movie', 'book', 'todo')
+
+
+def record_changes(connection, changes):
+    """写入变更记录，changes 为 (清单名, 条目 id, 用户 id, 'upsert' 或 'delete') 的列表。
+
+    批量导入等绕过 ORM 的写入之后调用，与写入本身放在同一个事务里。
+    """
+    now = datetime.utcnow()
+    rows = [{'kind': kind, 'item_id': item_id, 'user_id': user_id, 'op': op, 'created': now}
+            for kind, item_id, user_id, op in changes]
+    if rows:
+        connection.execute(Change.__table__.insert(), rows)
+    return len(rows)
+
+
+def horizon():
+    state = ChangeHorizon.query.get(1)
+    return state.cursor if state is not None else 0
+
+
+def latest_cursor(user_id):
+    return db.session.query(db.func.max(Change.id)).filter(Change.user_id == user_id).scalar() or 0
+
+
+def changes_since(user_id, since, limit):
+    """返回 since 之后的一页变更 (记录列表, 新游标, 是否还有更多)，同一条目在这一页里只保留最后一次。"""
+    rows = (Change.query.filter(Change.user_id == user_id, Change.id > since)
+            .order_by(Change.id).limit(limit + 1).all())
+    more = len(rows) > limit
+    rows = rows[:limit]
+    latest = {}
+    for row in rows:
+        latest[(row.kind, row.item_id)] = row
+    return sorted(latest.values(), key=lambda row: row.id), (rows[-1].id if rows else since), more
+
+
+def compact(older_than_days=30):
+    """压缩变更记录，返回删除的行数。
+
+    每个条目只保留最后一条记录；早于 older_than_days 天的墓碑也删掉，
+    并把删掉的最新墓碑的游标记为同步下限，更旧的游标只能重新全量同步。
+    """
+    table = Change.__table__
+    connection = db.session.connection()
+    latest = (db.select(db.func.max(table.c.id))
+              .group_by(table.c.user_id, table.c.kind, table.c.item_id).scalar_subquery())
+    removed = connection.execute(table.delete().where(table.c.id.not_in(latest))).rowcount
+    expired = (table.c.op == 'delete') & (table.c.created < datetime.utcnow() - timedelta(days=older_than_days))
+    newest = connection.execute(db.select(db.func.max(table.c.id)).where(expired)).scalar()
+    if newest is not None:
+        removed += connection.execute(table.delete().where(expired)).rowcount
+        state = ChangeHorizon.query.get(1) or ChangeHorizon(id=1)
+        state.cursor = max(state.cursor or 0, newest)
+        db.session.add(state)
+    db.session.commit()
+    return removed
+
+
+@db.event.listens_for(db.session, 'after_flush')
+def _record_changes(session, flush_context):
+    # 与业务数据在同一个事务里写入变更记录，回滚时一起回滚
+    changes = []
+    for item in session.new:
+        if getattr(item, '__tablename__', None) in LISTS:
+            changes.append((item.__tablename__, item.id, item.user_id, 'upsert'))
+    for item in session.dirty:
+        if getattr(item, '__tablename__', None) in LISTS and session.is_modified(item):
+            changes.append((item.__tablename__, item.id, item.user_id, 'upsert'))
+    for item in session.deleted:
+        if getattr(item, '__tablename__', None) in LISTS:
+            changes.append((item.__tablename__, item.id, item.user_id, 'delete'))
+    if changes:
+        record_changes(session.connection(), changes)
@@ -1,11 +1,16 @@
 import click
+from flask import Blueprint, current_app
 
-from listweb import app, db
+from listweb import db
 from listweb.models import User, Movie, Book, Todo
+from listweb.usercache import invalidate_user
+
+# 命令行命令挂在 cli 蓝图上，cli_group=None 表示直接注册为 flask 的顶层命令（flask initdb 而不是 flask cli initdb）
+cli = Blueprint('cli', __name__, cli_group=None)
 
 
 # 自定义命令 initdb，初始化数据库
-@app.cli.command()  # 注册为命令
+@cli.cli.command()  # 注册为命令
 @click.option('--drop', is_flag=True, help='Create after drop.')
 # 设置选项
 def initdb(drop):
@@ -17,11 +22,25 @@ def initdb(drop):
 
 
 # 自定义创建虚拟数据命令
-@app.cli.command()
-def forge():
-    """Generate fake data."""
+@cli.cli.command()
+@click.option('--users', type=int, help='Number of users to generate.')
+@click.option('--movies', type=int, help='Total number of movies, spread over the users.')
+@click.option('--books', type=int, help='Total number of books, spread over the users.')
+@click.option('--todos', type=int, help='Total number of todos, spread over the users.')
+@click.option('--seed', type=int, default=0, show_default=True, help='Random seed, the same seed gives the same data.')
+def forge(users, movies, books, todos, seed):
+    """Generate fake data.
+
+    Without options, seed a small demo list. With any count option, generate
+    a large random database for load testing.
+    """
     db.drop_all()
     db.create_all()
+    if any(count is not None for count in (users, movies, books, todos)):
+        from listweb.fakedata import forge_bulk
+        forge_bulk(users or 1, movies or 0, books or 0, todos or 0, seed, echo=click.echo)
+        click.echo('Done.')
+        return
     # 全局的两个变量移动到这个函数内
     user_name = 'zzy'
 
@@ -50,23 +69,195 @@ def forge():
     db.session.add(user)
 
     for m in movies:
-        movie = Movie(title=m['title'])
+        movie = Movie(title=m['title'], user=user)
         db.session.add(movie)
 
     for b in books:
-        book = Book(title=b['title'])
+        book = Book(title=b['title'], user=user)
         db.session.add(book)
 
     for td in todos:
-        todo = Todo(title=td['title'],ddl=td['ddl'])
+        todo = Todo(title=td['title'], ddl=td['ddl'], user=user)
         db.session.add(todo)
 
     db.session.commit()
     click.echo('Done.')
 
 
+# 从头重建全文索引
+@cli.cli.command()
+def reindex():
+    """Rebuild the full-text search index."""
+    from listweb.search import rebuild
+    total = rebuild()
+    click.echo('Indexed %d items.' % total)
+
+
+# 压缩增量同步用的变更记录
+@cli.cli.command('compact-changes')
+@click.option('--days', default=30, show_default=True, help='Drop delete tombstones older than this many days.')
+def compact_changes(days):
+    """Compact the change log used by /api/v1/changes."""
+    from listweb.changes import compact
+    removed = compact(days)
+    click.echo('Removed %d change rows.' % removed)
+
+
+# 导出清单，逐批读取、边读边写，内存占用与数据量无关
+@cli.cli.command('export')
+@click.option('--format', 'fmt', type=click.Choice(['ndjson', 'csv']), default='ndjson', show_default=True)
+@click.option('--output', type=click.File('w', encoding='utf-8'), default='-', help='Output file, defaults to stdout.')
+@click.option('--user', 'username', help='Only export the lists of this user.')
+@click.option('--batch-size', default=1000, show_default=True)
+def export_command(fmt, output, username, batch_size):
+    """Export all lists as NDJSON or CSV."""
+    from listweb.export import export
+    user_id = None
+    if username:
+        user = User.query.filter_by(username=username).first()
+        if user is None:
+            raise click.ClickException('No such user: %s' % username)
+        user_id = user.id
+    for chunk in export(fmt, user_id, batch_size=batch_size):
+        output.write(chunk)
+
+
+# 批量导入清单，校验、去重后分批插入，整个文件一个事务
+@cli.cli.command('import')
+@click.argument('source', type=click.File('r', encoding='utf-8-sig'))
+@click.option('--user', 'username', required=True, help='Import into the lists of this user.')
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'ndjson', 'douban']),
+              help='Input format, guessed from the file name by default.')
+@click.option('--kind', type=click.Choice(['movie', 'book', 'todo']), default='movie', show_default=True,
+              help='List for rows that do not name one.')
+@click.option('--chunk-size', default=500, show_default=True)
+def import_command(source, username, fmt, kind, chunk_size):
+    """Bulk import items from CSV, NDJSON or a Douban export."""
+    from listweb.importer import guess_format, import_items, read_rows
+    user = User.query.filter_by(username=username).first()
+    if user is None:
+        raise click.ClickException('No such user: %s' % username)
+    result = import_items(user.id, read_rows(source, fmt or guess_format(source.name), kind), chunk_size)
+    for line, error in result.errors[:20]:
+        click.echo('Line %d: %s' % (line, error), err=True)
+    click.echo('Imported %d items, skipped %d duplicates and %d invalid rows in %.2fs (%d rows/s).'
+               % (result.created, result.duplicates, len(result.errors), result.seconds, result.rate))
+
+
+# 压测各个页面，结果写成 JSON，可以与保存的基线比较
+@cli.cli.command('bench')
+@click.option('--sizes', default='small', show_default=True, help='Comma separated database sizes: small, medium, large.')
+@click.option('--drivers', default='client,http', show_default=True,
+              help='client drives the app through the WSGI test client, http through a local server.')
+@click.option('--requests', 'requests_', default=200, show_default=True, help='Requests per scenario.')
+@click.option('--concurrency', default=4, show_default=True, help='Concurrent clients for the http driver.')
+@click.option('--seed', default=0, show_default=True)
+@click.option('--output', type=click.File('w'), help='Write the results as JSON to this file.')
+@click.option('--baseline', type=click.File('r'), help='Compare with results saved by an earlier run.')
+@click.option('--threshold', default=0.2, show_default=True, help='Allowed p95 slowdown against the baseline.')
+def bench(sizes, drivers, requests_, concurrency, seed, output, baseline, threshold):
+    """Benchmark the pages against forged databases."""
+    import json
+    try:
+        from benchmarks.runner import SIZES, compare, run
+    except ImportError:
+        raise click.ClickException('Run from the project root, the benchmarks package is not importable.')
+    sizes = [size for size in sizes.split(',') if size]
+    drivers = [name for name in drivers.split(',') if name]
+    unknown = [name for name in sizes if name not in SIZES] + [name for name in drivers if name not in ('client', 'http')]
+    if unknown:
+        raise click.ClickException('Unknown sizes or drivers: %s' % ', '.join(unknown))
+    results = run(sizes, drivers, requests_, concurrency, seed, echo=click.echo, app=current_app._get_current_object())
+    if output is not None:
+        json.dump(results, output, indent=2, sort_keys=True)
+    if baseline is not None:
+        regressions = compare(results, json.load(baseline), threshold)
+        for size, name, scenario, old, new in regressions:
+            click.echo('REGRESSION %s/%s/%s: p95 %.2fms -> %.2fms' % (size, name, scenario, old, new))
+        if regressions:
+            raise SystemExit(1)
+        click.echo('No regressions against the baseline.')
+
+
+# 测量冷启动：导入、create_app() 和第一个请求各花多少时间
+@cli.cli.command('bench-startup')
+@click.option('--runs', default=5, show_default=True, help='Fresh processes to start, the median is reported.')
+@click.option('--output', type=click.File('w'), help='Write the results as JSON to this file.')
+def bench_startup(runs, output):
+    """Measure cold start time in fresh processes."""
+    import json
+    import os
+    try:
+        from benchmarks.startup import run
+    except ImportError:
+        raise click.ClickException('Run from the project root, the benchmarks package is not importable.')
+    summary = run(runs, cwd=os.path.dirname(current_app.root_path), echo=click.echo)
+    if output is not None:
+        json.dump(summary, output, indent=2, sort_keys=True)
+
+
+# 查看慢查询日志，按语句汇总并附上执行计划
+@cli.cli.command('slowlog')
+@click.option('--limit', default=20, show_default=True, help='Number of statements to show.')
+@click.option('--scans', is_flag=True, help='Only show statements that scan a whole table.')
+@click.option('--clear', 'clear_', is_flag=True, help='Delete the recorded entries.')
+def slowlog(limit, scans, clear_):
+    """Show the slowest recorded SQL statements with their query plans."""
+    from listweb import slowlog as log
+    path = current_app.config['SLOWLOG_FILE']
+    if not path:
+        raise click.ClickException('SLOWLOG_FILE is not configured.')
+    if clear_:
+        log.clear(path)
+        click.echo('Cleared.')
+        return
+    groups = [group for group in log.summarize(log.read_file(path)) if group['scan'] or not scans]
+    if not groups:
+        click.echo('No slow queries recorded.')
+    for group in groups[:limit]:
+        click.echo('%dx  max %.1fms  avg %.1fms%s' % (group['count'], group['max_ms'], group['avg_ms'],
+                                                    '  FULL SCAN' if group['scan'] else ''))
+        click.echo('  ' + group['statement'])
+        click.echo('  last: %s %s' % (group['last']['path'] or '-', group['last']['parameters']))
+        for line in group['plan'] or ():
+            click.echo('    ' + line)
+
+
+# 预先编译全部模板写入字节码缓存，部署时执行，worker 启动后不用再编译
+@cli.cli.command('compile-templates')
+def compile_templates_command():
+    """Precompile all templates into the bytecode cache."""
+    from listweb.templating import compile_templates
+    try:
+        count = compile_templates(current_app)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+    click.echo('Compiled %d templates into %s.' % (count, current_app.config['TEMPLATE_CACHE_DIR']))
+
+
+# 预派生的生产服务器：flask serve --workers 4，也可以 python -m listweb.serve，见 listweb/serve.py。
+# 服务器模块（连同 werkzeug.serving）只在执行这条命令时才导入；命令自己加载程序，不需要应用上下文
+@cli.cli.command('serve', with_appcontext=False)
+@click.option('--bind', default='127.0.0.1:8000', show_default=True, help='Address to listen on, host:port.')
+@click.option('--workers', default=2, show_default=True, help='Number of worker processes.')
+@click.option('--graceful-timeout', default=30, show_default=True,
+              help='Seconds to wait for workers to finish their requests when stopping.')
+def serve(bind, workers, graceful_timeout):
+    """Run the preforking production server."""
+    from flask.cli import ScriptInfo
+    from listweb.serve import serve as run
+    host, _, port = bind.rpartition(':')
+    info = click.get_current_context().find_object(ScriptInfo)
+    if info is not None:  # flask serve：用 FLASK_APP 指定的程序
+        app = info.load_app()
+    else:
+        from listweb import create_app
+        app = create_app()
+    run(app, host or '127.0.0.1', int(port), workers, graceful_timeout)
+
+
 # 注册用户
-@app.cli.command()
+@cli.cli.command()
 @click.option('--username', prompt=True, help='The username usedto login.')
 @click.option('--password', prompt=True, hide_input=True, confirmation_prompt=True, help='The password used to login.')
 def admin(username, password):
@@ -84,4 +275,38 @@ def admin(username, password):
         db.session.add(user)
 
     db.session.commit()  # 提交数据库会话
+    invalidate_user(user.id)
     click.echo('Done.')
+
+
+# 构建静态资源：把 GIF 动图转成 WebP / MP4 及缩小的版本
+@cli.cli.command('build-assets')
+@click.option('--widths', default='120,240,480', help='Comma separated widths of the downscaled variants.')
+def build_assets_command(widths):
+    """Transcode GIFs into WebP/MP4 variants."""
+    try:
+        import PIL  # noqa: F401
+    except ImportError:
+        raise click.ClickException('Pillow is required: pip install Pillow')
+    from listweb.assets import build_assets, load_manifest
+    manifest = build_assets(current_app.static_folder, [int(w) for w in widths.split(',') if w], echo=click.echo)
+    load_manifest(reload=True)
+    click.echo('Built %d images.' % len(manifest))
+
+
+# 计算静态文件的内容哈希，写入 static/manifest.json，部署时在 build-assets 之后执行
+@cli.cli.command('digest-static')
+def digest_static():
+    """Write the fingerprinted static file manifest."""
+    from listweb.fingerprint import write_manifest
+    manifest = write_manifest(current_app.static_folder)
+    click.echo('Fingerprinted %d files.' % len(manifest))
+
+
+# 为静态文本文件生成 .gz / .br 压缩副本，部署时在 digest-static 之后执行
+@cli.cli.command('compress-static')
+def compress_static():
+    """Precompress static files with gzip and brotli."""
+    from listweb.compress import precompress
+    written = precompress(current_app.static_folder, echo=click.echo)
+    click.echo('Wrote %d compressed files.' % written)
@@ -0,0 +1,90 @@
+import gzip
+import mimetypes
+import os
+
+from flask import current_app, request, send_from_directory
+from werkzeug.security import safe_join
+
+# 值得压缩的文本类文件；图片、视频本身已经压缩过
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.json', '.svg', '.html', '.txt', '.xml', '.ico')
+COMPRESSIBLE_MIMETYPES = ('text/html', 'text/css', 'text/plain', 'application/json',
+                          'application/javascript', 'image/svg+xml')
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def _brotli():
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+def precompress(static_folder, echo=print):
+    """为 static 目录下的文本文件写出 .gz 和 .br（需安装 brotli）压缩副本，返回写出的文件数。"""
+    brotli = _brotli()
+    if brotli is None:
+        echo('brotli not installed, writing .gz files only.')
+    written = 0
+    for root, dirs, files in os.walk(static_folder):
+        for name in files:
+            if not name.lower().endswith(COMPRESSIBLE_EXTENSIONS):
+                continue
+            path = os.path.join(root, name)
+            with open(path, 'rb') as f:
+                data = f.read()
+            outputs = [('.gz', lambda d: gzip.compress(d, 9, mtime=0))]
+            if brotli is not None:
+                outputs.append(('.br', lambda d: brotli.compress(d, quality=11)))
+            for suffix, compress in outputs:
+                target = path + suffix
+                if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(path):
+                    continue
+                compressed = compress(data)
+                if len(compressed) >= len(data):  # 压缩后不更小就不必提供
+                    continue
+                with open(target, 'wb') as f:
+                    f.write(compressed)
+                written += 1
+    return written
+
+
+def send_static(filename, max_age=None):
+    """发送静态文件，客户端支持时改发预先压缩好的 .br / .gz 副本。"""
+    if filename.lower().endswith(COMPRESSIBLE_EXTENSIONS):
+        for encoding, suffix in ENCODINGS:
+            if not request.accept_encodings[encoding]:
+                continue
+            path = safe_join(current_app.static_folder, filename + suffix)
+            if path is None or not os.path.isfile(path):
+                continue
+            # send_from_directory 走 wsgi.file_wrapper，服务器支持时由 sendfile 零拷贝发送
+            response = send_from_directory(current_app.static_folder, filename + suffix, max_age=max_age,
+                                           mimetype=mimetypes.guess_type(filename)[0])
+            response.content_encoding = encoding
+            response.vary.add('Accept-Encoding')
+            return response
+    response = send_from_directory(current_app.static_folder, filename, max_age=max_age)
+    if filename.lower().endswith(COMPRESSIBLE_EXTENSIONS):
+        response.vary.add('Accept-Encoding')
+    return response
+
+
+def compress_response(response):
+    # 动态渲染的页面在足够大时用 gzip 压缩后再发送
+    config = current_app.config
+    if (not config['COMPRESS_DYNAMIC']
+            or response.status_code != 200
+            or response.direct_passthrough
+            or response.is_streamed
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES
+            or not request.accept_encodings['gzip']):
+        return response
+    data = response.get_data()
+    if len(data) < config['COMPRESS_MIN_SIZE']:
+        return response
+    response.set_data(gzip.compress(data, config['COMPRESS_LEVEL']))
+    response.content_encoding = 'gzip'
+    response.vary.add('Accept-Encoding')
+    return response
@@ -0,0 +1,78 @@
+from flask_sqlalchemy import SQLAlchemy as _SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.pool import NullPool, QueuePool
+
+# SQLite 的默认配置，适合 gunicorn 多 worker 部署，可以在 app.config 中覆盖：
+# SQLITE_JOURNAL_MODE  WAL 模式下读不阻塞写、写不阻塞读，多个 worker 并发读时不再排队等提交
+# SQLITE_SYNCHRONOUS   WAL 下用 NORMAL 只在检查点时 fsync，断电最多丢最后几个事务但不会损坏数据库
+# SQLITE_BUSY_TIMEOUT  遇到其他连接持有写锁时最多等待的毫秒数，而不是立即报 database is locked
+# SQLITE_CACHE_SIZE    每个连接的页缓存，负数表示 KiB
+# SQLITE_MMAP_SIZE     用内存映射读取数据库文件的字节数，减少一次内核到用户态的拷贝
+# SQLITE_TEMP_STORE    排序、临时表放在内存里
+# SQLITE_FOREIGN_KEYS  启用外键约束
+# SQLITE_POOL_SIZE     每个进程保持的连接数，0 表示每次都新建连接（Flask-SQLAlchemy 的默认行为）
+DEFAULTS = {
+    'SQLITE_JOURNAL_MODE': 'WAL',
+    'SQLITE_SYNCHRONOUS': 'NORMAL',
+    'SQLITE_BUSY_TIMEOUT': 5000,
+    'SQLITE_CACHE_SIZE': -16000,
+    'SQLITE_MMAP_SIZE': 268435456,
+    'SQLITE_TEMP_STORE': 'MEMORY',
+    'SQLITE_FOREIGN_KEYS': True,
+    'SQLITE_POOL_SIZE': 5,
+    'SQLITE_POOL_OVERFLOW': 10,
+}
+
+
+def _in_memory(sa_url):
+    return sa_url.database in (None, '', ':memory:')
+
+
+def sqlite_pragmas(config, in_memory=False):
+    pragmas = [
+        ('busy_timeout', int(config['SQLITE_BUSY_TIMEOUT'])),
+        ('synchronous', config['SQLITE_SYNCHRONOUS']),
+        ('cache_size', int(config['SQLITE_CACHE_SIZE'])),
+        ('temp_store', config['SQLITE_TEMP_STORE']),
+        ('foreign_keys', 'ON' if config['SQLITE_FOREIGN_KEYS'] else 'OFF'),
+    ]
+    if not in_memory:  # 内存数据库没有日志文件，也无法内存映射
+        pragmas.insert(0, ('journal_mode', config['SQLITE_JOURNAL_MODE']))
+        pragmas.append(('mmap_size', int(config['SQLITE_MMAP_SIZE'])))
+    return pragmas
+
+
+def configure_sqlite(engine, config):
+    pragmas = sqlite_pragmas(config, _in_memory(engine.url))
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas:
+            cursor.execute('PRAGMA %s = %s' % (name, value))
+        cursor.close()
+
+
+class SQLAlchemy(_SQLAlchemy):
+    """建立引擎时按 app.config 配置 SQLite 连接池和 PRAGMA，并挂上查询统计。"""
+
+    def apply_driver_hacks(self, app, sa_url, options):
+        sa_url, options = super(SQLAlchemy, self).apply_driver_hacks(app, sa_url, options)
+        if sa_url.drivername.startswith('sqlite') and not _in_memory(sa_url):
+            pool_size = app.config['SQLITE_POOL_SIZE']
+            if pool_size and options.get('poolclass') is NullPool:
+                # 复用连接，省掉每个请求打开文件、执行 PRAGMA 的开销；
+                # 连接可能被不同线程取用，需要关闭 pysqlite 的同线程检查
+                options['poolclass'] = QueuePool
+                options['pool_size'] = pool_size
+                options['max_overflow'] = app.config['SQLITE_POOL_OVERFLOW']
+                options.setdefault('connect_args', {})['check_same_thread'] = False
+        return sa_url, options
+
+    def create_engine(self, sa_url, engine_opts):
+        from listweb.querystats import instrument
+        engine = super(SQLAlchemy, self).create_engine(sa_url, engine_opts)
+        instrument(engine)  # 按请求统计查询条数和耗时
+        if engine.dialect.name == 'sqlite':
+            configure_sqlite(engine, self.get_app().config)
+        return engine
@@ -1,18 +1,19 @@
 from flask import render_template
 
-from listweb import app
 
-
-@app.errorhandler(404)
 def page_not_found(e):
     return render_template('errors/404.html'), 404
 
 
-@app.errorhandler(400)
 def bad_request(e):
     return render_template('errors/400.html'), 400
 
 
-@app.errorhandler(500)
 def internal_server_error(e):
     return render_template('errors/500.html'), 500
+
+
+def init_app(app):
+    app.register_error_handler(404, page_not_found)
+    app.register_error_handler(400, bad_request)
+    app.register_error_handler(500, internal_server_error)
@@ -0,0 +1,56 @@
+import csv
+import io
+import json
+
+from listweb import db
+
+KINDS = ('movie', 'book', 'todo')
+CSV_FIELDS = ('kind', 'id', 'user_id', 'title', 'ddl')
+FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+
+def _model(kind):
+    from listweb.models import Movie, Book, Todo
+    return {'movie': Movie, 'book': Book, 'todo': Todo}[kind]
+
+
+def iter_items(user_id=None, kinds=KINDS, batch_size=1000):
+    """按 id 顺序逐行产出条目字典；只查询需要的列并分批从游标读取，内存占用与总行数无关。"""
+    for kind in kinds:
+        model = _model(kind)
+        columns = [model.id, model.user_id] + [getattr(model, field) for field in model.FIELD_LIMITS]
+        names = [column.key for column in columns]
+        query = db.session.query(*columns).order_by(model.id)
+        if user_id is not None:
+            query = query.filter(model.user_id == user_id)
+        for row in query.yield_per(batch_size):
+            item = dict(zip(names, row))
+            item['kind'] = kind
+            yield item
+
+
+def to_ndjson(items):
+    for item in items:
+        yield json.dumps(item, ensure_ascii=False) + '\n'
+
+
+def to_csv(items):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, CSV_FIELDS, extrasaction='ignore')
+    writer.writeheader()
+    rows = 0
+    for item in items:
+        writer.writerow(item)
+        rows += 1
+        # 攒够一批再输出，避免每行一次 write 调用
+        if rows % 100 == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def export(fmt, user_id=None, kinds=KINDS, batch_size=1000):
+    """返回逐段产出导出内容的生成器，fmt 为 'ndjson' 或 'csv'。"""
+    items = iter_items(user_id, kinds, batch_size)
+    return to_csv(items) if fmt == 'csv' else to_ndjson(items)
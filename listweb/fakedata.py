@@ -0,0 +1,92 @@
+import random
+import time
+from datetime import date, datetime, timedelta
+
+from werkzeug.security import generate_password_hash
+
+from listweb import db
+
+# 生成标题用的词表，中文标题和英文标题大约各占一半
+CJK_HEADS = ['沉默的', '遥远的', '最后的', '秘密', '夏日', '黑色', '城市', '星空下的', '孤独的', '无尽的',
+             '消失的', '第七个', '燃烧的', '白色', '南方', '海上', '午夜', '九月的', '漫长的', '寂静的']
+CJK_TAILS = ['羔羊', '旅程', '王国', '花园', '之歌', '战争', '记忆', '海岸', '列车', '情书',
+             '森林', '少年', '简史', '灯塔', '迷宫', '河流', '信使', '故乡', '时光', '启蒙']
+CJK_SUFFIXES = ['', '', '', '2', '3', '：重生', '：终章', '（上）', '（下）']
+LATIN_HEADS = ['Silent', 'Distant', 'Last', 'Secret', 'Summer', 'Black', 'Broken', 'Hidden', 'Lonely', 'Endless',
+               'Burning', 'White', 'Midnight', 'Golden', 'Lost', 'Wild', 'Quiet', 'Crimson', 'Northern', 'Iron']
+LATIN_TAILS = ['Lambs', 'Journey', 'Kingdom', 'Garden', 'Song', 'War', 'Memory', 'Shore', 'Train', 'Letters',
+               'Forest', 'River', 'Lighthouse', 'Maze', 'Messenger', 'Empire', 'Road', 'Child', 'Storm', 'Night']
+TODO_VERBS = ['学', '读完', '复习', '整理', '准备', '写', '练习', '修好', '预约', '提交']
+TODO_OBJECTS = ['SQL', '爬虫', '线性代数', '周报', '简历', '论文初稿', '吉他', '自行车', '体检', '年度总结']
+DDL_WORDS = ['今天', '明天', '本周内', '暑假内', '月底前']
+PASSWORD = 'password'
+
+
+def make_title(rng):
+    if rng.random() < 0.5:
+        return rng.choice(CJK_HEADS) + rng.choice(CJK_TAILS) + rng.choice(CJK_SUFFIXES)
+    title = 'The %s %s' % (rng.choice(LATIN_HEADS), rng.choice(LATIN_TAILS))
+    if rng.random() < 0.2:
+        title += ' %s' % rng.choice(['II', 'III', 'Returns', 'Reloaded'])
+    return title
+
+
+def make_todo(rng, today):
+    if rng.random() < 0.3:
+        ddl = rng.choice(DDL_WORDS)
+    else:
+        ddl = (today + timedelta(days=rng.randint(0, 365))).isoformat()
+    return rng.choice(TODO_VERBS) + rng.choice(TODO_OBJECTS), ddl
+
+
+def _insert(connection, table, columns, rows, chunk_size):
+    # rows 逐行产出与 columns 对应的元组，每凑够 chunk_size 行直接交给驱动 executemany：
+    # 省掉 SQLAlchemy 逐行处理参数字典的开销，内存占用也与总行数无关
+    statement = table.insert().values({name: db.bindparam(name) for name in columns})
+    compiled = statement.compile(dialect=connection.dialect)
+    order = [columns.index(name) for name in compiled.positiontup]
+    chunk = []
+    for row in rows:
+        chunk.append(tuple(row[i] for i in order))
+        if len(chunk) >= chunk_size:
+            connection.exec_driver_sql(str(compiled), chunk)
+            chunk = []
+    if chunk:
+        connection.exec_driver_sql(str(compiled), chunk)
+
+
+def forge_bulk(users, movies, books, todos, seed=0, chunk_size=10000, echo=print):
+    """用 Core 批量插入生成大量随机数据，返回生成的总行数。
+
+    所有用户的密码都是 PASSWORD，用户名为 user1、user2……；
+    条目随机分给各个用户，写完后一次性重建全文索引和变更记录。
+    """
+    from listweb.models import User, Movie, Book, Todo, Change
+    from listweb.search import rebuild
+    rng = random.Random(seed)
+    today = date(2022, 7, 1) + timedelta(days=seed % 365)  # 日期也由种子决定，结果可以复现
+    started = time.perf_counter()
+    connection = db.session.connection()
+    password_hash = generate_password_hash(PASSWORD)  # 散列很慢，所有用户共用一个
+    _insert(connection, User.__table__, ['id', 'name', 'username', 'password_hash'],
+            ((i, '用户%d' % i, 'user%d' % i, password_hash) for i in range(1, users + 1)), chunk_size)
+    with db.session.no_autoflush:
+        _insert(connection, Movie.__table__, ['title', 'user_id'],
+                ((make_title(rng), rng.randint(1, users)) for _ in range(movies)), chunk_size)
+        _insert(connection, Book.__table__, ['title', 'user_id'],
+                ((make_title(rng), rng.randint(1, users)) for _ in range(books)), chunk_size)
+        _insert(connection, Todo.__table__, ['title', 'ddl', 'user_id'],
+                (make_todo(rng, today) + (rng.randint(1, users),) for _ in range(todos)), chunk_size)
+    # 变更记录直接在数据库里用 INSERT ... SELECT 生成，不经过 Python
+    change = Change.__table__
+    for model in (Movie, Book, Todo):
+        table = model.__table__
+        select = db.select(table.c.user_id, db.literal(table.name), table.c.id, db.literal('upsert'),
+                           db.literal(datetime.utcnow())).order_by(table.c.id)
+        connection.execute(change.insert().from_select(['user_id', 'kind', 'item_id', 'op', 'created'], select))
+    db.session.commit()
+    echo('Inserted %d users, %d movies, %d books and %d todos in %.2fs.'
+         % (users, movies, books, todos, time.perf_counter() - started))
+    indexed = rebuild(batch_size=chunk_size)
+    echo('Indexed %d items. Every user has the password "%s".' % (indexed, PASSWORD))
+    return users + movies + books + todos
@@ -0,0 +1,83 @@
+import hashlib
+import json
+import os
+
+from flask import current_app
+
+MANIFEST_NAME = 'manifest.json'  # 保存在 static 目录下，由 flask digest-static 生成
+ONE_YEAR = 31536000
+
+_manifest = None
+_reverse = None
+_manifest_hash = None
+
+
+def fingerprinted_name(filename, data):
+    # style.css -> style.<内容哈希>.css，内容不变文件名就不变
+    digest = hashlib.md5(data).hexdigest()[:10]
+    stem, ext = os.path.splitext(filename)
+    return '%s.%s%s' % (stem, digest, ext)
+
+
+def compute_manifest(static_folder):
+    manifest = {}
+    for root, dirs, files in os.walk(static_folder):
+        for name in files:
+            path = os.path.join(root, name)
+            filename = os.path.relpath(path, static_folder).replace(os.sep, '/')
+            # 预压缩副本随原文件一起提供，不单独出现在页面里
+            if filename == MANIFEST_NAME or filename.endswith(('.gz', '.br')):
+                continue
+            with open(path, 'rb') as f:
+                manifest[filename] = fingerprinted_name(filename, f.read())
+    return manifest
+
+
+def write_manifest(static_folder):
+    manifest = compute_manifest(static_folder)
+    with open(os.path.join(static_folder, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+    load_manifest(reload=True)
+    return manifest
+
+
+def load_manifest(reload=False):
+    # 优先读取构建时生成的清单，没有的话启动后第一次用到时现算一次
+    global _manifest, _reverse, _manifest_hash
+    if _manifest is None or reload:
+        try:
+            with open(os.path.join(current_app.static_folder, MANIFEST_NAME), encoding='utf-8') as f:
+                _manifest = json.load(f)
+        except (OSError, ValueError):
+            _manifest = compute_manifest(current_app.static_folder)
+        _reverse = {hashed: filename for filename, hashed in _manifest.items()}
+        _manifest_hash = hashlib.md5(json.dumps(_manifest, sort_keys=True).encode('utf-8')).hexdigest()[:10]
+    return _manifest
+
+
+def manifest_hash():
+    # 整个清单的哈希，任何静态文件的内容变了它就会变，页面缓存键和 ETag 用它区分部署
+    load_manifest()
+    return _manifest_hash
+
+
+def fingerprint_static_url(endpoint, values):
+    # 调试模式下文件随时在改，不做改写
+    if endpoint != 'static' or current_app.debug or not current_app.config['STATIC_FINGERPRINT']:
+        return
+    filename = values.get('filename')
+    if filename:
+        values['filename'] = load_manifest().get(filename, filename)
+
+
+def static(filename):
+    from listweb.compress import send_static
+    load_manifest()
+    original = _reverse.get(filename)
+    if original is None:  # 未带哈希的旧地址照常提供
+        return send_static(filename)
+    # 带哈希的文件名内容永远不变，可以让浏览器缓存一年且不再验证
+    response = send_static(original, max_age=ONE_YEAR)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
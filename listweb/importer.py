@@ -0,0 +1,138 @@
+import csv
+import json
+import time
+
+from listweb import db
+from listweb.api import clean_item
+from listweb.changes import record_changes
+from listweb.search import index_items
+from listweb.versions import scoped_name, touch
+
+KINDS = ('movie', 'book', 'todo')
+FORMATS = ('csv', 'ndjson', 'douban')
+# 豆瓣导出文件（如“豆伴”导出的 CSV）的中文表头
+DOUBAN_COLUMNS = {'标题': 'title', '名称': 'title', '截止': 'ddl'}
+
+
+def _model(kind):
+    from listweb.models import Movie, Book, Todo
+    return {'movie': Movie, 'book': Book, 'todo': Todo}[kind]
+
+
+class ImportResult(object):
+    """一次导入的统计：新增、重复跳过、校验失败的条数及耗时。"""
+
+    def __init__(self):
+        self.created = 0
+        self.duplicates = 0
+        self.errors = []  # [(行号, 错误信息)]
+        self.seconds = 0.0
+
+    @property
+    def rate(self):  # 每秒处理的行数
+        total = self.created + self.duplicates + len(self.errors)
+        return total / self.seconds if self.seconds else 0.0
+
+    def to_dict(self, max_errors=20):
+        return {'created': self.created, 'duplicates': self.duplicates, 'invalid': len(self.errors),
+                'errors': [{'line': line, 'error': error} for line, error in self.errors[:max_errors]],
+                'seconds': round(self.seconds, 3), 'rows_per_second': round(self.rate)}
+
+
+def guess_format(filename):
+    if filename and filename.lower().endswith(('.ndjson', '.jsonl', '.json')):
+        return 'ndjson'
+    return 'csv'
+
+
+def read_rows(lines, fmt, kind='movie'):
+    """把文本行解析成 (行号, 清单名, 字段字典)，未指明清单的行归入 kind。"""
+    if fmt == 'ndjson':
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                data = json.loads(line)
+            except ValueError:
+                data = None
+            if not isinstance(data, dict):
+                yield number, None, 'Invalid JSON.'
+                continue
+            yield number, data.get('kind') or kind, data
+        return
+    reader = csv.DictReader(lines)
+    douban = fmt == 'douban' or any(name in DOUBAN_COLUMNS for name in reader.fieldnames or ())
+    for data in reader:
+        if douban:
+            data = {DOUBAN_COLUMNS.get(name, name): value for name, value in data.items()}
+            # 豆瓣的标题是“中文名 / 原名”，只保留中文名
+            data['title'] = (data.get('title') or '').split(' / ')[0].strip()
+        data = {name: value for name, value in data.items() if value}  # CSV 的空单元格当作未填
+        yield reader.line_num, data.get('kind') or kind, data
+
+
+def _existing_keys(model, user_id):
+    columns = [getattr(model, field) for field in model.FIELD_LIMITS]
+    return set(db.session.query(*columns).filter(model.user_id == user_id))
+
+
+def import_items(user_id, rows, chunk_size=500):
+    """校验、去重后把条目批量写入 user_id 名下，全部在一个事务里完成。
+
+    按 chunk_size 条一组执行 executemany 插入，绕过 ORM 的逐条 flush；
+    写入后手动同步全文索引、变更记录和版本号。
+    """
+    result = ImportResult()
+    started = time.perf_counter()
+    pending = {kind: [] for kind in KINDS}
+    seen = {}
+    for number, kind, data in rows:
+        if kind not in KINDS:
+            result.errors.append((number, data if isinstance(data, str) else 'Unknown kind: %s' % kind))
+            continue
+        model = _model(kind)
+        try:
+            values = clean_item(model, {name: value.strip() if isinstance(value, str) else value
+                                        for name, value in data.items()})
+        except ValueError as e:
+            result.errors.append((number, str(e)))
+            continue
+        if kind not in seen:
+            seen[kind] = _existing_keys(model, user_id)
+        key = tuple(values[field] for field in model.FIELD_LIMITS)
+        if key in seen[kind]:
+            result.duplicates += 1
+            continue
+        seen[kind].add(key)
+        values['user_id'] = user_id
+        pending[kind].append(values)
+
+    connection = db.session.connection()
+    for kind, items in pending.items():
+        if not items:
+            continue
+        model = _model(kind)
+        # 先单独插入第一行：执行 INSERT 后本事务就持有了 SQLite 的写锁，直到提交都没有其他连接能写入，
+        # 所以之后插入的行 id 都大于第一行；插入前读的最大 id 不可靠，读完到插入之间其他进程可能已经写入
+        first = connection.execute(model.__table__.insert(), items[0]).inserted_primary_key[0]
+        for start in range(1, len(items), chunk_size):
+            connection.execute(model.__table__.insert(), items[start:start + chunk_size])
+        inserted = (db.session.query(model.id, model.title).filter(model.user_id == user_id, model.id >= first)
+                    .order_by(model.id).yield_per(chunk_size))
+        batch = []
+        for item_id, title in inserted:
+            batch.append(model(id=item_id, title=title, user_id=user_id))
+            if len(batch) >= chunk_size:
+                _index_batch(connection, kind, batch)
+                batch = []
+        _index_batch(connection, kind, batch)
+        touch(db.session, kind, scoped_name(kind, user_id))
+        result.created += len(items)
+    db.session.commit()
+    result.seconds = time.perf_counter() - started
+    return result
+
+
+def _index_batch(connection, kind, items):
+    index_items(connection, items)
+    record_changes(connection, [(kind, item.id, item.user_id, 'upsert') for item in items])
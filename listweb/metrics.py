@@ -0,0 +1,288 @@
+import atexit
+import glob
+import os
+import pickle
+import tempfile
+import threading
+import time
+
+from flask import abort, current_app, g, request
+from flask_login import current_user
+
+# 进程内的指标注册表，按 Prometheus 文本格式在 /metrics 输出。
+# 设置了 METRICS_DIR 时为多进程模式（gunicorn 多个 worker）：每个进程定期把自己的计数写到
+# METRICS_DIR/metrics-<pid>.pickle，/metrics 把所有进程的文件与当前进程内存中的数值相加后输出。
+# 主进程回收退出的 worker 时用 mark_dead() 把它的计数并入 metrics-dead.pickle 再删掉它的文件，
+# 计数器仍然单调递增，进程号被复用时也不会覆盖旧的计数；服务器启动时用 clear() 清空目录。
+# flask serve 会自动调用这两个函数，用 gunicorn 时在 on_starting 和 child_exit 钩子里调用。
+# 其他 worker 的数值最多延迟 METRICS_FLUSH_INTERVAL 秒。
+# /metrics 默认只对管理员开放，METRICS_PUBLIC 打开后才允许匿名抓取。
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+_metrics = []  # 注册顺序即输出顺序
+
+
+class _Metric(object):
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}  # {标签值元组: 数值}
+        _metrics.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with _lock:
+            counts = self.values.get(key)
+            if counts is None:
+                # 每个桶各自计数（输出时再累加），最后两项为总和与次数
+                counts = self.values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            counts[-2] += value
+            counts[-1] += 1
+
+
+class Gauge(_Metric):
+    """抓取时调用 collect() 现算的数值，不跨进程累加。"""
+    type = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), collect=None):
+        super(Gauge, self).__init__(name, documentation, labelnames)
+        self.collect = collect  # 返回 {标签值元组: 数值}
+
+
+REQUESTS = Counter('listweb_http_requests_total', 'HTTP requests.', ('endpoint', 'method', 'status'))
+LATENCY = Histogram('listweb_http_request_duration_seconds', 'HTTP request latency.', ('endpoint',))
+SQL_QUERIES = Counter('listweb_sql_queries_total', 'SQL statements executed while handling requests.',
+                      ('endpoint',))
+SQL_SECONDS = Counter('listweb_sql_query_seconds_total', 'Time spent executing SQL while handling requests.',
+                      ('endpoint',))
+CACHE = Counter('listweb_cache_requests_total', 'Cache lookups.', ('cache', 'result'))
+LOGINS = Counter('listweb_login_attempts_total', 'Login attempts.', ('result',))
+
+
+def _collect_list_sizes():
+    from listweb.models import Movie, Book, Todo
+    from listweb.pagination import count_rows
+    # 总数按版本号缓存，两次写入之间重复抓取不会再查库
+    return {(model.__tablename__,): count_rows(model) for model in (Movie, Book, Todo)}
+
+
+def _collect_users():
+    from listweb.models import User
+    from listweb.pagination import count_rows
+    return {(): count_rows(User)}
+
+
+Gauge('listweb_list_items', 'Items stored in each list.', ('list',), collect=_collect_list_sizes)
+Gauge('listweb_users', 'Registered users.', collect=_collect_users)
+
+
+# ---- 多进程汇总 ----
+
+DEAD_NAME = 'metrics-dead.pickle'  # 已退出的进程累计的计数
+
+_last_flush = [0.0]
+_flush_dir = [None]  # 最近一次写入的目录，进程退出时再写一次
+
+
+def _path(directory, pid):
+    return os.path.join(directory, 'metrics-%d.pickle' % pid)
+
+
+def _write(path, values):
+    # 先写临时文件再原子替换，读取的进程不会读到写了一半的文件
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        pickle.dump(values, f, pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+
+
+def _load(path):
+    try:
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+
+
+def _snapshot():
+    with _lock:
+        return {metric.name: {key: list(value) if isinstance(value, list) else value
+                              for key, value in metric.values.items()}
+                for metric in _metrics if not isinstance(metric, Gauge)}
+
+
+def flush(directory):
+    """把当前进程的计数原子地写入 directory。"""
+    os.makedirs(directory, exist_ok=True)
+    _write(_path(directory, os.getpid()), _snapshot())
+    _last_flush[0] = time.monotonic()
+    _flush_dir[0] = directory
+
+
+def mark_dead(directory, pid):
+    """把已退出的进程 pid 的计数并入 metrics-dead.pickle 并删掉它的文件。只由回收 worker 的主进程调用。"""
+    path = _path(directory, pid)
+    snapshot = _load(path)
+    if snapshot is not None:
+        dead = _load(os.path.join(directory, DEAD_NAME)) or {}
+        _merge(dead, snapshot)
+        _write(os.path.join(directory, DEAD_NAME), dead)
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def clear(directory):
+    """删掉 directory 中所有进程的计数文件，服务器启动时调用。"""
+    for path in glob.glob(os.path.join(directory, 'metrics-*.pickle')):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def _merge(total, snapshot):
+    for name, values in snapshot.items():
+        merged = total.setdefault(name, {})
+        for key, value in values.items():
+            if isinstance(value, list):
+                current = merged.get(key)
+                merged[key] = value if current is None else [a + b for a, b in zip(current, value)]
+            else:
+                merged[key] = merged.get(key, 0) + value
+
+
+def collect(directory=None):
+    """返回所有进程汇总后的 {指标名: {标签值元组: 数值}}。"""
+    total = {}
+    if directory:
+        own = _path(directory, os.getpid())
+        for path in glob.glob(os.path.join(directory, 'metrics-*.pickle')):
+            snapshot = _load(path) if path != own else None
+            if snapshot is not None:
+                _merge(total, snapshot)
+    _merge(total, _snapshot())
+    return total
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{%s}' % ','.join('%s="%s"' % (name, value) for (name, _), value in zip(pairs, escaped))
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(directory=None):
+    values = collect(directory)
+    lines = []
+    for metric in _metrics:
+        lines.append('# HELP %s %s' % (metric.name, metric.documentation))
+        lines.append('# TYPE %s %s' % (metric.name, metric.type))
+        if isinstance(metric, Gauge):
+            for key, value in sorted(metric.collect().items()):
+                labels = _format_labels(metric.labelnames, key)
+                lines.append('%s%s %s' % (metric.name, labels, _format_value(value)))
+            continue
+        for key, value in sorted(values.get(metric.name, {}).items()):
+            if isinstance(metric, Histogram):
+                cumulative = 0
+                for bound, count in zip(metric.buckets, value):
+                    cumulative += count
+                    labels = _format_labels(metric.labelnames, key, [('le', _format_value(float(bound)))])
+                    lines.append('%s_bucket%s %d' % (metric.name, labels, cumulative))
+                labels = _format_labels(metric.labelnames, key, [('le', '+Inf')])
+                lines.append('%s_bucket%s %d' % (metric.name, labels, value[-1]))
+                labels = _format_labels(metric.labelnames, key)
+                lines.append('%s_sum%s %s' % (metric.name, labels, _format_value(value[-2])))
+                lines.append('%s_count%s %d' % (metric.name, labels, value[-1]))
+            else:
+                lines.append('%s%s %s' % (metric.name, _format_labels(metric.labelnames, key),
+                                          _format_value(value)))
+    return '\n'.join(lines) + '\n'
+
+
+# ---- 请求钩子 ----
+
+def start_request_metrics():
+    g.metrics_started = time.perf_counter()
+
+
+def record_request_metrics(response):
+    from listweb.querystats import current_stats
+    started = g.pop('metrics_started', None)
+    if started is None or not current_app.config['METRICS_ENABLED']:
+        return response
+    endpoint = request.endpoint or 'none'  # 404 等没有匹配到视图的请求
+    REQUESTS.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+    LATENCY.observe(time.perf_counter() - started, endpoint=endpoint)
+    stats = current_stats()
+    if stats is not None and stats.count:
+        SQL_QUERIES.inc(stats.count, endpoint=endpoint)
+        SQL_SECONDS.inc(stats.duration, endpoint=endpoint)
+    directory = current_app.config['METRICS_DIR']
+    if directory and time.monotonic() - _last_flush[0] >= current_app.config['METRICS_FLUSH_INTERVAL']:
+        flush(directory)
+    return response
+
+
+def metrics():
+    if not current_app.config['METRICS_ENABLED']:
+        return 'Metrics are disabled.\n', 404
+    if not current_app.config['METRICS_PUBLIC']:
+        from listweb.usercache import is_admin
+        if not is_admin(current_user):
+            abort(403)
+    response = current_app.response_class(render(current_app.config['METRICS_DIR']),
+                                          mimetype='text/plain')
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4; charset=utf-8'
+    return response
+
+
+def init_app(app):
+    app.before_request(start_request_metrics)
+    app.after_request(record_request_metrics)
+    app.add_url_rule('/metrics', 'metrics', metrics)
+
+
+@atexit.register
+def _flush_at_exit():
+    directory = _flush_dir[0]
+    if directory:
+        try:
+            flush(directory)
+        except OSError:
+            pass
@@ -1,33 +1,76 @@
+from datetime import datetime
+
 from flask_login import UserMixin
 from werkzeug.security import check_password_hash, generate_password_hash
 
 from listweb import db
+from listweb.timing import phase
 
 
 class User(db.Model, UserMixin):  # 表名将会是 user（自动生成，小写处理）
     id = db.Column(db.Integer, primary_key=True)  # 主键
     name = db.Column(db.String(20))  # 名字
-    username = db.Column(db.String(20))  # 用户名
+    username = db.Column(db.String(20), unique=True, index=True)  # 用户名，登录时按它查找
     password_hash = db.Column(db.String(128))  # 密码散列值
+    # 各清单都属于某个用户；dynamic 表示访问时返回查询对象而不是一次加载全部
+    movies = db.relationship('Movie', backref='user', lazy='dynamic', cascade='all, delete-orphan')
+    books = db.relationship('Book', backref='user', lazy='dynamic', cascade='all, delete-orphan')
+    todos = db.relationship('Todo', backref='user', lazy='dynamic', cascade='all, delete-orphan')
 
     def set_password(self, password):  # 用来设置密码的方法，接受密码作为参数
-        self.password_hash = generate_password_hash(password)  # 将生成的密码保持到对应字段
+        with phase('hash'):
+            self.password_hash = generate_password_hash(password)  # 将生成的密码保持到对应字段
 
     def validate_password(self, password):  # 验证密码
-        return check_password_hash(self.password_hash, password)
+        with phase('hash'):  # 散列故意算得很慢，单独计时
+            return check_password_hash(self.password_hash, password)
 
 
 class Movie(db.Model):  # 表名将会是 movie
+    # (user_id, id) 复合索引：按用户筛选并按 id 分页、计数都只走索引
+    __table_args__ = (db.Index('ix_movie_user_id_id', 'user_id', 'id'),)
+    # 可编辑的字段及其最大长度，与添加表单的校验规则一致
+    FIELD_LIMITS = {'title': 60}
     id = db.Column(db.Integer, primary_key=True)  # 主键
     title = db.Column(db.String(60))  # 电影标题
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)  # 所属用户
 
 
 class Book(db.Model):  # 表名将会是 book
+    __table_args__ = (db.Index('ix_book_user_id_id', 'user_id', 'id'),)
+    FIELD_LIMITS = {'title': 60}
     id = db.Column(db.Integer, primary_key=True)  # 主键
     title = db.Column(db.String(60))  # 书籍标题
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)  # 所属用户
 
 
 class Todo(db.Model):  # 表名将会是 todo
+    __table_args__ = (db.Index('ix_todo_user_id_id', 'user_id', 'id'),)
+    FIELD_LIMITS = {'title': 128, 'ddl': 128}
     id = db.Column(db.Integer, primary_key=True)  # 主键
     title = db.Column(db.String(60))  # todo标题
     ddl = db.Column(db.String(60))  # todo's ddl
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), nullable=False)  # 所属用户
+
+
+class Change(db.Model):  # 清单条目的变更记录，供客户端增量同步
+    # AUTOINCREMENT 保证 id 单调递增、压缩删除旧记录后也不会复用，可以直接用作同步游标
+    __table_args__ = (db.Index('ix_change_user_id_id', 'user_id', 'id'), {'sqlite_autoincrement': True})
+    id = db.Column(db.Integer, primary_key=True)  # 同步游标
+    user_id = db.Column(db.Integer, nullable=False)  # 条目所属用户，用户删除后记录仍要保留，所以不设外键
+    kind = db.Column(db.String(10), nullable=False)  # 清单名：movie、book、todo
+    item_id = db.Column(db.Integer, nullable=False)  # 条目 id
+    op = db.Column(db.String(10), nullable=False)  # 'upsert' 或 'delete'（墓碑）
+    created = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)  # 变更时间，压缩时按它判断新旧
+
+
+class ChangeHorizon(db.Model):  # 只有一行：压缩时删掉的最新墓碑的游标，比它旧的游标只能全量同步
+    id = db.Column(db.Integer, primary_key=True)
+    cursor = db.Column(db.Integer, nullable=False, default=0)
+
+
+class ListVersion(db.Model):  # 每个清单的版本号，与数据写入在同一个事务里更新，所有进程看到的都一样
+    __tablename__ = 'list_version'
+    name = db.Column(db.String(64), primary_key=True)  # 表名或 表名:用户 id，如 movie、movie:3
+    token = db.Column(db.String(16), nullable=False)  # 随机版本号，每次提交改动后换新
+    modified = db.Column(db.Float, nullable=False)  # 最近一次改动的时间戳
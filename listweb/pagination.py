@@ -0,0 +1,79 @@
+from flask import current_app, request
+
+from listweb import db
+from listweb.cache import SimpleCache
+from listweb.versions import list_version, scoped_name
+
+# 按 (表名[:用户], 版本号) 缓存总数。版本号存在数据库里，任何进程写入后旧的总数都不会再被命中，由 LRU 淘汰；
+# 另有 COUNT_CACHE_TIMEOUT 兜底，直接改库（不换版本号）时过一会儿也会重新统计
+_counts = SimpleCache(threshold=10000)
+
+
+class Page(object):
+    """一页清单数据，按 id 做游标（keyset）分页。"""
+
+    def __init__(self, items, total, has_prev, has_next):
+        self.items = items
+        self.total = total
+        self.has_prev = has_prev
+        self.has_next = has_next
+
+    @property
+    def prev_cursor(self):  # 上一页：取 id 小于本页第一条的记录
+        return self.items[0].id if self.has_prev and self.items else None
+
+    @property
+    def next_cursor(self):  # 下一页：取 id 大于本页最后一条的记录
+        return self.items[-1].id if self.has_next and self.items else None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def count_rows(model, query=None, user_id=None):
+    name = model.__tablename__
+    if user_id is not None:
+        name = scoped_name(name, user_id)
+    key = 'count:%s:%s' % (name, list_version(name))
+    total = _counts.get(key)
+    if total is None:
+        query = query if query is not None else model.query
+        total = query.order_by(None).with_entities(db.func.count(model.id)).scalar()
+        _counts.set(key, total, timeout=current_app.config['COUNT_CACHE_TIMEOUT'])
+    return total
+
+
+def keyset_paginate(model, query=None, after=None, before=None, per_page=None, user_id=None):
+    # 传入 user_id 时只取该用户的条目，走 (user_id, id) 复合索引
+    if query is None:
+        query = model.query
+    if user_id is not None:
+        query = query.filter(model.user_id == user_id)
+    base = query
+    if per_page is None:
+        per_page = current_app.config['LIST_PAGE_SIZE']
+    if before is not None:
+        # 往前翻页时倒序取，再翻转回正序
+        rows = query.filter(model.id < before).order_by(model.id.desc()).limit(per_page + 1).all()
+        has_prev = len(rows) > per_page
+        items = list(reversed(rows[:per_page]))
+        has_next = True
+    else:
+        if after is not None:
+            query = query.filter(model.id > after)
+        rows = query.order_by(model.id.asc()).limit(per_page + 1).all()
+        has_next = len(rows) > per_page
+        items = rows[:per_page]
+        has_prev = after is not None
+    return Page(items, count_rows(model, base, user_id), has_prev, has_next)
+
+
+def paginate_request(model, query=None, user_id=None):
+    # 从查询参数 ?after=<id> / ?before=<id> 读取游标，非法值当作第一页
+    return keyset_paginate(model, query,
+                           after=request.args.get('after', type=int),
+                           before=request.args.get('before', type=int),
+                           user_id=user_id)
@@ -0,0 +1,133 @@
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+
+from flask import abort, current_app, g, request
+from flask_login import current_user
+
+from listweb.usercache import is_admin
+
+# 两种按需开启的性能剖析，只对管理员开放（PROFILER_ENABLED 打开后才生效）：
+# 1. 单个请求的 cProfile：请求带上 ?_profile=1 或请求头 X-Profile: 1，
+#    返回的不是页面而是按累计耗时排序的函数列表；设置了 PROFILER_DIR 时同时保存 .prof 文件。
+# 2. 后台栈采样：PROFILER_SAMPLING 打开后，每个进程起一个线程定时抓取正在处理请求的线程的调用栈，
+#    按端点汇总成 collapsed stacks，在 /admin/profile/stacks 输出，可以直接交给 flamegraph.pl 或 speedscope。
+_samples = Counter()  # {(端点, 'a;b;c'): 次数}
+_active = {}  # {线程 id: 端点}，只记录正在处理请求的线程
+_lock = threading.Lock()
+_sampler = None
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return '%s:%d:%s' % (os.path.basename(code.co_filename), code.co_firstlineno, code.co_name)
+
+
+def collapse(frame):
+    """把调用栈转成 collapsed 格式：从最外层到最内层，以分号连接。"""
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame).replace(';', ':'))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class Sampler(threading.Thread):
+    def __init__(self, interval, max_stacks):
+        super(Sampler, self).__init__(name='listweb-profiler', daemon=True)
+        self.interval = interval
+        self.max_stacks = max_stacks
+        self.pid = os.getpid()
+        self.stopped = threading.Event()
+
+    def sample(self):
+        frames = sys._current_frames()
+        with _lock:
+            for thread_id, endpoint in list(_active.items()):
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                key = (endpoint, collapse(frame))
+                # 栈的种类有上限，满了以后只给已有的栈计数，防止内存无限增长
+                if key in _samples or len(_samples) < self.max_stacks:
+                    _samples[key] += 1
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+
+def start_sampler(interval, max_stacks):
+    global _sampler
+    # fork 出的 worker 里不会有父进程的线程，按进程号判断是否需要重新启动
+    if _sampler is None or _sampler.pid != os.getpid() or not _sampler.is_alive():
+        _sampler = Sampler(interval, max_stacks)
+        _sampler.start()
+    return _sampler
+
+
+def collapsed_stacks(endpoint=None):
+    with _lock:
+        items = sorted(_samples.items())
+    return ''.join('%s %d\n' % (stack if endpoint else '%s;%s' % (name, stack), count)
+                   for (name, stack), count in items if endpoint is None or name == endpoint)
+
+
+def reset_samples():
+    with _lock:
+        _samples.clear()
+
+
+def _profile_requested():
+    return request.args.get('_profile') == '1' or request.headers.get('X-Profile') == '1'
+
+
+def start_profiling():
+    config = current_app.config
+    if not config['PROFILER_ENABLED']:
+        return
+    if config['PROFILER_SAMPLING']:
+        start_sampler(config['PROFILER_SAMPLE_INTERVAL'], config['PROFILER_MAX_STACKS'])
+        with _lock:
+            _active[threading.get_ident()] = request.endpoint or 'none'
+    if _profile_requested() and is_admin(current_user):
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+
+def finish_profiling(response):
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return response
+    profiler.disable()
+    directory = current_app.config['PROFILER_DIR']
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        profiler.dump_stats(os.path.join(directory, '%s-%d.prof' % (request.endpoint, int(time.time() * 1000))))
+    output = io.StringIO()
+    pstats.Stats(profiler, stream=output).sort_stats('cumulative').print_stats(40)
+    report = current_app.response_class(output.getvalue(), mimetype='text/plain')
+    report.headers['X-Profiled-Status'] = str(response.status_code)
+    return report
+
+
+def forget_active_thread(exc):
+    with _lock:
+        _active.pop(threading.get_ident(), None)
+
+
+def profile_stacks():
+    """输出采样得到的 collapsed stacks，?endpoint= 只看某个端点，?reset=1 输出后清空。"""
+    if not current_app.config['PROFILER_ENABLED']:
+        abort(404)
+    if not is_admin(current_user):
+        abort(403)
+    text = collapsed_stacks(request.args.get('endpoint'))
+    if request.args.get('reset') == '1':
+        reset_samples()
+    return current_app.response_class(text, mimetype='text/plain')
@@ -0,0 +1,115 @@
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import current_app, g, has_app_context, request
+from sqlalchemy import event
+
+
+# 统计每个请求执行的 SQL：条数、总耗时，以及每条语句（参数化后的文本）的执行次数。
+# 参数不同而文本相同的语句在一个请求里反复出现，多半是循环里逐条查询的 N+1。
+_recorders = threading.local()  # query_budget() 用的记录器，与请求无关
+
+
+class QueryStats(object):
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0  # 秒
+        self.statements = Counter()
+
+    def record(self, statement, duration):
+        self.count += 1
+        self.duration += duration
+        self.statements[statement] += 1
+
+    def repeated(self, threshold):
+        """返回执行次数不少于 threshold 的语句 [(语句, 次数)]，按次数从多到少排列。"""
+        return [(statement, n) for statement, n in self.statements.most_common() if n >= threshold]
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def current_stats():
+    # 当前请求（应用上下文）的统计，没有上下文时返回 None
+    if not has_app_context():
+        return None
+    if 'query_stats' not in g:
+        g.query_stats = QueryStats()
+    return g.query_stats
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['query_started'].pop()
+    duration = time.perf_counter() - started
+    stats = current_stats()
+    if stats is not None:
+        stats.record(statement, duration)
+    for recorder in getattr(_recorders, 'stack', ()):
+        recorder.record(statement, duration)
+    # 只有超过阈值的语句才需要慢查询日志模块，用到时才导入
+    if has_app_context():
+        threshold = current_app.config['SLOWLOG_THRESHOLD_MS']
+        if threshold is not None and duration * 1000 >= threshold:
+            from listweb.slowlog import observe
+            observe(conn, statement, parameters, duration, executemany)
+
+
+def _handle_error(exception_context):
+    # 出错的语句不会触发 after_cursor_execute，把开始时间弹出
+    started = exception_context.connection.info.get('query_started') if exception_context.connection else None
+    if started:
+        started.pop()
+
+
+def instrument(engine):
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(engine, 'handle_error', _handle_error)
+
+
+def check_request(response):
+    """请求结束时检查查询条数和重复语句，超出 SQL_QUERY_BUDGET 或疑似 N+1 时记录警告。"""
+    stats = g.get('query_stats')
+    if stats is None:
+        return response
+    config = current_app.config
+    if config['SQL_QUERY_HEADER']:
+        response.headers['X-Query-Count'] = str(stats.count)
+    budget = config['SQL_QUERY_BUDGET']
+    if budget and stats.count > budget:
+        current_app.logger.warning('%s %s ran %d queries (budget %d) in %.1fms', request.method, request.path,
+                                   stats.count, budget, stats.duration * 1000)
+    for statement, n in stats.repeated(config['SQL_N_PLUS_ONE_THRESHOLD']):
+        current_app.logger.warning('Probable N+1 on %s %s, statement ran %d times: %s',
+                                   request.method, request.path, n, ' '.join(statement.split())[:200])
+    return response
+
+
+def init_app(app):
+    app.after_request(check_request)
+
+
+@contextmanager
+def query_budget(limit):
+    """在测试里限制一段代码执行的查询条数，超出时抛出 QueryBudgetExceeded 并列出执行过的语句。
+
+        with query_budget(3):
+            client.get('/watchlist')
+    """
+    stats = QueryStats()
+    stack = _recorders.__dict__.setdefault('stack', [])
+    stack.append(stats)
+    try:
+        yield stats
+    finally:
+        stack.remove(stats)
+    if stats.count > limit:
+        lines = ['%dx %s' % (n, ' '.join(statement.split())) for statement, n in stats.statements.most_common()]
+        raise QueryBudgetExceeded('%d queries executed, budget is %d:\n%s' % (stats.count, limit, '\n'.join(lines)))
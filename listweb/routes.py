@@ -0,0 +1,93 @@
+from flask import Blueprint, current_app
+from werkzeug.utils import cached_property, import_string
+
+# 各个区域的蓝图和 URL 规则集中登记在这里，视图函数用 LazyView 按导入路径引用：
+# 程序启动时只建立 URL 表，视图模块在第一次有请求进来时才导入（见 Flask 文档 Lazily Loading Views）。
+# 端点名为 蓝图名.函数名，如 lists.watchlist、auth.login。
+API_PREFIX = '/api/v1'
+RESOURCE = '<any(movies, books, todos):resource>'
+
+
+class LazyView(object):
+    """第一次被调用时才导入的视图函数。"""
+
+    def __init__(self, import_name):
+        self.__module__, self.__name__ = import_name.rsplit('.', 1)
+        self.import_name = import_name
+
+    @cached_property
+    def view(self):
+        return import_string(self.import_name)
+
+    def __call__(self, *args, **kwargs):
+        return self.view(*args, **kwargs)
+
+
+class LazyHook(LazyView):
+    """配置项 flag 打开时才导入并调用的请求钩子；关闭时不导入，after_request 钩子原样返回响应。"""
+
+    def __init__(self, import_name, flag):
+        super(LazyHook, self).__init__(import_name)
+        self.flag = flag
+
+    def __call__(self, *args):
+        if not current_app.config[self.flag]:
+            return args[0] if args else None
+        return self.view(*args)
+
+
+def _add(blueprint, rule, import_name, **options):
+    view = LazyView(import_name)
+    blueprint.add_url_rule(rule, view.__name__, view, **options)
+
+
+def blueprints():
+    """建立各区域的蓝图：lists 清单、auth 登录注册、settings 账号设置、api 接口。"""
+    lists = Blueprint('lists', __name__)
+    _add(lists, '/', 'listweb.views.index')
+    _add(lists, '/watchlist', 'listweb.views.watchlist', methods=['GET', 'POST'])
+    _add(lists, '/readlist', 'listweb.views.readlist', methods=['GET', 'POST'])
+    _add(lists, '/todolist', 'listweb.views.todolist', methods=['GET', 'POST'])
+    _add(lists, '/search', 'listweb.views.search')
+    _add(lists, '/suggest', 'listweb.views.suggest')
+    _add(lists, '/movie/edit/<int:movie_id>', 'listweb.views.edit_movies', methods=['GET', 'POST'])
+    _add(lists, '/book/edit/<int:book_id>', 'listweb.views.edit_books', methods=['GET', 'POST'])
+    _add(lists, '/todo/edit/<int:todo_id>', 'listweb.views.edit_todos', methods=['GET', 'POST'])
+    _add(lists, '/movie/delete/<int:movie_id>', 'listweb.views.delete_movie', methods=['POST'])  # 限定只接受 POST 请求
+    _add(lists, '/book/delete/<int:book_id>', 'listweb.views.delete_book', methods=['POST'])
+    _add(lists, '/todo/delete/<int:todo_id>', 'listweb.views.delete_todo', methods=['POST'])
+
+    auth = Blueprint('auth', __name__)
+    _add(auth, '/login', 'listweb.auth.login', methods=['GET', 'POST'])
+    _add(auth, '/logout', 'listweb.auth.logout')
+    _add(auth, '/register', 'listweb.auth.register', methods=['GET', 'POST'])
+
+    settings = Blueprint('settings', __name__)
+    _add(settings, '/settings', 'listweb.settings.settings', methods=['GET', 'POST'])
+
+    api = Blueprint('api', __name__, url_prefix=API_PREFIX)
+    _add(api, '/' + RESOURCE, 'listweb.api.api_list', methods=['GET'])
+    _add(api, '/' + RESOURCE, 'listweb.api.api_create', methods=['POST'])
+    _add(api, '/' + RESOURCE + '/<int:item_id>', 'listweb.api.api_item', methods=['GET', 'PATCH', 'DELETE'])
+    _add(api, '/' + RESOURCE + '/batch', 'listweb.api.api_batch', methods=['POST'])
+    _add(api, '/changes', 'listweb.api.api_changes')
+    _add(api, '/export', 'listweb.api.api_export')
+    _add(api, '/import', 'listweb.api.api_import', methods=['POST'])
+    return lists, auth, settings, api
+
+
+def lazy_hooks(app):
+    """登记按需导入的请求钩子、模板函数和管理页面：剖析（连同 cProfile、pstats）、慢查询页面、
+    动图、静态文件指纹和压缩模块都不在 create_app() 时导入，命令行和刚启动的 worker 用不到它们。
+
+    after_request 钩子按注册的相反顺序执行，顺序与原先各模块 init_app 的注册顺序保持一致。
+    """
+    app.before_request(LazyHook('listweb.profiler.start_profiling', 'PROFILER_ENABLED'))
+    app.after_request(LazyHook('listweb.profiler.finish_profiling', 'PROFILER_ENABLED'))
+    app.teardown_request(LazyHook('listweb.profiler.forget_active_thread', 'PROFILER_ENABLED'))
+    app.add_url_rule('/admin/profile/stacks', 'profile_stacks', LazyView('listweb.profiler.profile_stacks'))
+    app.add_url_rule('/admin/slowlog', 'slowlog_page', LazyView('listweb.slowlog.slowlog_page'))
+    app.add_template_global(LazyView('listweb.assets.animated_image'))
+    app.url_defaults(LazyHook('listweb.fingerprint.fingerprint_static_url', 'STATIC_FINGERPRINT'))
+    app.view_functions['static'] = LazyView('listweb.fingerprint.static')
+    app.after_request(LazyHook('listweb.compress.compress_response', 'COMPRESS_DYNAMIC'))
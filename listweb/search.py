@@ -0,0 +1,136 @@
+import re
+
+from listweb import db
+
+# 全文索引放在一张 FTS5 虚拟表里，三个清单共用：
+#   rowid  = 条目 id * 4 + 清单编号，由 rowid 即可定位到原条目，删除、更新都按主键进行
+#   body   = 分好词的标题
+#   owner  = 'u<用户 id>'，查询时 owner:u<id> 限定用户，关键词只匹配 body 列，
+#            否则搜索 u、u1 之类的词会命中该用户的所有条目
+# unicode61 分词器会把连续的汉字当成一个词，所以写入前先把每个中日韩字符用空格隔开，
+# 查询时再把关键词拆成相邻字符组成的短语，效果相当于子串匹配。
+KINDS = {'movie': 1, 'book': 2, 'todo': 3}
+TABLE = 'search_index'
+
+_CJK = '\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff'
+# 一次扫描切出词元：单个中日韩字符，或一串不含中日韩字符的字母数字。
+# 编译这个正则要好几毫秒，交给 re 模块在第一次分词时编译并缓存，不占启动时间
+_TOKEN = '[%s]|[^\\W%s]+' % (_CJK, _CJK)
+
+db.event.listen(db.Model.metadata, 'after_create', db.DDL(
+    "CREATE VIRTUAL TABLE IF NOT EXISTS %s USING fts5(body, owner, tokenize='unicode61 remove_diacritics 2')"
+    % TABLE).execute_if(dialect='sqlite'))
+db.event.listen(db.Model.metadata, 'before_drop', db.DDL(
+    'DROP TABLE IF EXISTS %s' % TABLE).execute_if(dialect='sqlite'))
+
+
+def segment(text):
+    return ' '.join(re.findall(_TOKEN, (text or '').lower()))
+
+
+def _rowid(kind, item_id):
+    return item_id * 4 + KINDS[kind]
+
+
+def _document(item):
+    return _row_document(item.__tablename__, item.id, item.title, item.user_id)
+
+
+def _row_document(kind, item_id, title, user_id):
+    return {'rowid': _rowid(kind, item_id), 'body': segment(title), 'owner': 'u%s' % user_id}
+
+
+def index_items(connection, items):
+    """写入（或覆盖）条目的索引，批量导入等绕过 ORM 的写入之后调用。"""
+    delete_items(connection, items)
+    _insert(connection, [_document(item) for item in items])
+
+
+def delete_items(connection, items):
+    rowids = [{'rowid': _rowid(item.__tablename__, item.id)} for item in items]
+    if rowids:
+        connection.execute(db.text('DELETE FROM %s WHERE rowid = :rowid' % TABLE), rowids)
+
+
+def rebuild(batch_size=1000):
+    """清空并重建整个索引，返回写入的条目数。"""
+    from listweb.models import Movie, Book, Todo
+    connection = db.session.connection()
+    connection.execute(db.text('DELETE FROM %s' % TABLE))
+    total = 0
+    for model in (Movie, Book, Todo):
+        batch = []
+        # 只查询需要的列，不构造 ORM 对象，百万行时快得多
+        query = db.session.query(model.id, model.title, model.user_id).order_by(model.id)
+        for item_id, title, user_id in query.yield_per(batch_size):
+            batch.append(_row_document(model.__tablename__, item_id, title, user_id))
+            if len(batch) >= batch_size:
+                total += _insert(connection, batch)
+                batch = []
+        total += _insert(connection, batch)
+    # 合并 FTS5 的内部段，重建后查询更快
+    connection.execute(db.text("INSERT INTO %s (%s) VALUES ('optimize')" % (TABLE, TABLE)))
+    db.session.commit()
+    return total
+
+
+def _insert(connection, documents):
+    if documents:
+        # 直接交给驱动 executemany，省掉 SQLAlchemy 逐行处理参数的开销
+        connection.exec_driver_sql('INSERT INTO %s (rowid, body, owner) VALUES (?, ?, ?)' % TABLE,
+                                   [(d['rowid'], d['body'], d['owner']) for d in documents])
+    return len(documents)
+
+
+def match_expression(query):
+    # 每个以空格分开的关键词变成一个短语，多个关键词之间为 AND，最后一个按前缀匹配
+    phrases = ['"%s"' % segment(part) for part in query.split() if segment(part)]
+    if not phrases:
+        return None
+    phrases[-1] += ' *'
+    return ' AND '.join(phrases)
+
+
+def search(query, user_id, kinds=('movie', 'book', 'todo'), limit=50):
+    """在某个用户的清单里检索，返回 {清单名: [条目, ...]}，按相关度排序。"""
+    from listweb.models import Movie, Book, Todo
+    models = {'movie': Movie, 'book': Book, 'todo': Todo}
+    results = {kind: [] for kind in kinds}
+    expression = match_expression(query)
+    if expression is None or user_id is None:
+        return results
+    rows = db.session.execute(db.text(
+        'SELECT rowid FROM %s WHERE %s MATCH :expression ORDER BY rank LIMIT :limit' % (TABLE, TABLE)),
+        {'expression': 'owner:u%s AND body:(%s)' % (user_id, expression), 'limit': limit}).fetchall()
+    ids = {kind: [] for kind in kinds}
+    codes = {code: kind for kind, code in KINDS.items()}
+    for (rowid,) in rows:
+        kind = codes.get(rowid % 4)
+        if kind in ids:
+            ids[kind].append(rowid // 4)
+    for kind, item_ids in ids.items():
+        if item_ids:
+            model = models[kind]
+            found = {item.id: item for item in model.query.filter(model.id.in_(item_ids),
+                                                                   model.user_id == user_id)}
+            results[kind] = [found[item_id] for item_id in item_ids if item_id in found]
+    return results
+
+
+@db.event.listens_for(db.session, 'after_flush')
+def _sync_index(session, flush_context):
+    # 与业务数据在同一个事务里更新索引，回滚时一起回滚
+    changed, removed = [], []
+    for item in session.new:
+        if getattr(item, '__tablename__', None) in KINDS:
+            changed.append(item)
+    for item in session.dirty:
+        if getattr(item, '__tablename__', None) in KINDS and session.is_modified(item):
+            changed.append(item)
+    for item in session.deleted:
+        if getattr(item, '__tablename__', None) in KINDS:
+            removed.append(item)
+    if changed or removed:
+        connection = session.connection()
+        delete_items(connection, removed)
+        index_items(connection, changed)
@@ -0,0 +1,244 @@
+import gc
+import mimetypes
+import os
+import signal
+import sys
+import threading
+import time
+import traceback
+
+import click
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+# 自带的预派生（prefork）生产服务器：flask serve 或 python -m listweb.serve
+#   1. 主进程加载程序，预先导入所有视图、编译全部模板、读入静态文件清单，再 gc.freeze() 后 fork 出 worker，
+#      这些对象留在各进程共享的内存页里，worker 收到的第一个请求也不用再做这些事；
+#   2. 所有 worker 在主进程建立的同一个监听套接字上 accept，每个 worker 内部用线程处理并发请求；
+#   3. worker 启动后丢掉从主进程继承的数据库连接池，各自重新建立连接；
+#   4. SIGTERM / SIGINT：worker 处理完手上的请求后退出；SIGHUP：平滑重启，
+#      主进程带着监听套接字重新执行自己（重新加载代码），新 worker 起来后再让旧 worker 退出，期间不断开连接。
+FD_ENV = 'LISTWEB_SERVE_FD'  # 平滑重启时传给新主进程的监听套接字
+OLD_WORKERS_ENV = 'LISTWEB_SERVE_OLD_WORKERS'  # 平滑重启时等新 worker 起来后要停掉的旧 worker
+KEEPALIVE = 5  # 空闲的 keep-alive 连接保持的秒数，也让 worker 退出时不会一直等空闲连接
+
+
+class _RequestHandler(WSGIRequestHandler):
+    timeout = KEEPALIVE
+
+
+def warm(app):
+    """加载 fork 前可以共享的东西，返回 (视图数, 模板数)。"""
+    # 动图、静态文件指纹和压缩的钩子是按需导入的，也在 fork 前导入
+    from listweb import assets, compress, fingerprint  # noqa: F401
+    from listweb.routes import LazyView
+    views = [view for view in app.view_functions.values() if isinstance(view, LazyView)]
+    for view in views:
+        view.view  # 导入视图模块
+    # 生产环境模板不会改动，渲染前不再检查模板文件的修改时间
+    app.config['TEMPLATES_AUTO_RELOAD'] = False
+    app.jinja_env.auto_reload = False
+    templates = [name for name in app.jinja_env.list_templates() if name.endswith('.html')]
+    for name in templates:
+        app.jinja_env.get_template(name)  # 有字节码缓存时直接读取，加载后留在 Jinja 环境的缓存里
+    with app.app_context():
+        fingerprint.load_manifest()
+        assets.load_manifest()
+    mimetypes.init()  # 否则第一次发送静态文件时才读取系统的类型表
+    return len(views), len(templates)
+
+
+def _dispose_engine(app):
+    from listweb import db
+    with app.app_context():
+        db.session.remove()
+        # close=False：只丢掉继承来的连接池，不去关闭其他进程也持有的连接
+        db.get_engine().dispose(close=False)
+
+
+def command_line():
+    """重新拼出启动本进程的命令行（sys.orig_argv 要到 Python 3.10 才有）。"""
+    spec = getattr(sys.modules['__main__'], '__spec__', None)
+    if spec is not None:  # python -m listweb.serve、python -m flask serve
+        return [sys.executable, '-m', spec.name] + sys.argv[1:]
+    return [sys.executable] + sys.argv  # flask serve：sys.argv[0] 是 flask 脚本的路径
+
+
+def _flush_metrics(app):
+    # worker 用 os._exit 退出，不会运行 metrics 的 atexit 钩子，退出前自己把最后一段计数写出去
+    from listweb import metrics
+    directory = app.config['METRICS_DIR']
+    if directory and app.config['METRICS_ENABLED']:
+        metrics.flush(directory)
+
+
+def _collect_metrics(app, pid):
+    # 回收 worker 后把它的计数并入已退出进程的合计，它的进程号以后可能被新进程复用
+    from listweb import metrics
+    directory = app.config['METRICS_DIR']
+    if directory:
+        metrics.mark_dead(directory, pid)
+
+
+def _clear_metrics(app):
+    # 重新启动的服务器从零开始计数，删掉上一次运行留下的文件
+    from listweb import metrics
+    directory = app.config['METRICS_DIR']
+    if directory:
+        metrics.clear(directory)
+
+
+class PreforkServer(object):
+    def __init__(self, app, host, port, workers=2, graceful_timeout=30, echo=click.echo):
+        self.app = app
+        self.workers = workers
+        self.graceful_timeout = graceful_timeout
+        self.echo = echo
+        fd = os.environ.pop(FD_ENV, None)
+        self.server = make_server(host, port, app, threaded=True, request_handler=_RequestHandler,
+                                  fd=int(fd) if fd is not None else None)
+        if fd is not None:
+            os.close(int(fd))  # make_server 用的是复制出来的描述符
+        self.server.daemon_threads = False  # 退出前等正在处理的请求完成
+        # 所有 worker 都在等同一个套接字，连接到来时只有一个能 accept 到，其余的不能阻塞在 accept 上
+        self.server.socket.setblocking(False)
+        self.old_workers = [int(pid) for pid in os.environ.pop(OLD_WORKERS_ENV, '').split(',') if pid]
+        self.children = set()
+        self.stopping = False
+        self.reloading = False
+
+    # ---- worker ----
+
+    def _worker(self):
+        for signum in (signal.SIGINT, signal.SIGHUP):
+            signal.signal(signum, signal.SIG_IGN)  # 终端的 Ctrl-C 由主进程统一处理
+        signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=self.server.shutdown).start())
+        gc.enable()
+        _dispose_engine(self.app)
+        from listweb import db
+        with self.app.app_context():
+            db.engine.connect().close()  # 先建好一个连接放进池里
+        try:
+            self.server.serve_forever()  # 退出时 werkzeug 会调用 server_close()，等待处理中的请求
+        finally:
+            _flush_metrics(self.app)
+
+    def spawn(self):
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid:
+            self.children.add(pid)
+            return pid
+        code = 0
+        try:
+            self._worker()
+        except BaseException:
+            traceback.print_exc()
+            code = 1
+        finally:
+            os._exit(code)
+
+    # ---- 主进程 ----
+
+    def _stop(self, signum, frame):
+        self.stopping = True
+
+    def _reload(self, signum, frame):
+        self.reloading = True
+
+    def reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if not pid:
+                return
+            if pid in self.children:
+                self.children.discard(pid)
+                if not self.stopping:
+                    self.echo('Worker %d exited with code %d, restarting.' % (pid, os.waitstatus_to_exitcode(status)))
+            elif pid in self.old_workers:
+                self.old_workers.remove(pid)
+            _collect_metrics(self.app, pid)
+
+    def terminate(self, pids):
+        for pid in list(pids):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def wait(self, timeout):
+        """等所有 worker 退出，超时仍未退出的强制结束。"""
+        deadline = time.monotonic() + timeout
+        while (self.children or self.old_workers) and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.1)
+        for pid in self.children | set(self.old_workers):
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        self.reap()
+
+    def reexec(self):
+        """带着监听套接字和当前 worker 的进程号重新执行自己，由新主进程加载新代码。"""
+        fd = self.server.socket.fileno()
+        os.set_inheritable(fd, True)
+        os.environ[FD_ENV] = str(fd)
+        os.environ[OLD_WORKERS_ENV] = ','.join(str(pid) for pid in self.children | set(self.old_workers))
+        argv = command_line()
+        self.echo('Reloading.')
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.execv(sys.executable, argv)
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        signal.signal(signal.SIGHUP, self._reload)
+        # 回收垃圾后冻结：fork 前的对象不再被 GC 扫描、改写，worker 里这些内存页一直与主进程共享
+        gc.collect()
+        gc.freeze()
+        if not self.old_workers:  # 平滑重启时旧 worker 还在运行，它们的计数退出时照常并入
+            _clear_metrics(self.app)
+        for _ in range(self.workers):
+            self.spawn()
+        gc.enable()
+        self.echo('Listening on http://%s:%d with %d workers (pid %d).'
+                  % (self.server.host, self.server.port, self.workers, os.getpid()))
+        if self.old_workers:  # 新 worker 已经在同一个套接字上 accept，旧 worker 处理完手上的请求就退出
+            self.terminate(self.old_workers)
+        while not self.stopping:
+            if self.reloading:
+                self.reexec()
+            self.reap()
+            while len(self.children) < self.workers and not self.stopping:
+                self.spawn()
+            time.sleep(0.5)
+        self.terminate(self.children | set(self.old_workers))
+        self.wait(self.graceful_timeout)
+        self.server.server_close()
+        self.echo('Stopped.')
+
+
+def serve(app, host='127.0.0.1', port=8000, workers=2, graceful_timeout=30, echo=click.echo):
+    if not hasattr(os, 'fork'):
+        raise click.ClickException('The prefork server needs os.fork(), use waitress or similar on Windows.')
+    gc.disable()  # 加载期间不回收，避免在要共享的内存页上留下空洞；worker 里会重新打开
+    views, templates = warm(app)
+    _dispose_engine(app)  # 预热时建立的连接不能带进 worker
+    echo('Preloaded %d views and %d templates.' % (views, templates))
+    server = PreforkServer(app, host, port, workers, graceful_timeout, echo)
+    server.run()
+
+
+if __name__ == '__main__':
+    # 与 wsgi.py 一样读取项目根目录的 .env
+    from dotenv import load_dotenv
+    dotenv_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.env')
+    if os.path.exists(dotenv_path):
+        load_dotenv(dotenv_path)
+    from listweb.commands import serve as main  # 与 flask serve 是同一个命令
+    main()
@@ -0,0 +1,31 @@
+from flask import request, url_for, redirect, flash, render_template
+from flask_login import current_user, login_required
+
+from listweb import db
+from listweb.models import User
+from listweb.usercache import attach, invalidate_user
+
+# 账号设置（settings 蓝图），URL 规则见 listweb/routes.py
+
+
+@login_required
+def settings():
+    if request.method == 'POST':
+        username = request.form['username']
+        password = request.form['password']
+        if (not username or len(username) > 20) or (not password or len(password) > 128):
+            flash('Invalid input.')
+            return redirect(url_for('settings.settings'))
+        if User.query.filter(User.username == username, User.id != current_user.id).first() is not None:
+            flash('Username already taken.')
+            return redirect(url_for('settings.settings'))
+        # current_user 会返回当前登录用户的数据库记录对象（可能来自缓存），并入会话后修改
+        user = attach(current_user._get_current_object())
+        user.username = username
+        user.set_password(password)
+        db.session.commit()
+        invalidate_user(user.id)
+        flash('Settings updated.')
+        return redirect(url_for('lists.index'))
+
+    return render_template('settings.html')
@@ -0,0 +1,166 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+from flask import abort, current_app, has_app_context, has_request_context, render_template, request
+from flask_login import current_user
+
+# 慢查询记录：执行时间超过 SLOWLOG_THRESHOLD_MS 的语句连同参数、耗时和 EXPLAIN QUERY PLAN 放进环形缓冲区，
+# 同时追加到 SLOWLOG_FILE（JSON Lines），供 flask slowlog 和其他 worker 的管理页面读取。
+# 执行计划按语句形状（参数化后的 SQL）缓存，同一形状只 EXPLAIN 一次。
+_entries = deque()
+_plans = OrderedDict()  # {语句: 执行计划}，LRU
+_lock = threading.Lock()
+_file_lock = threading.Lock()
+MAX_PLANS = 1000
+
+
+def _normalize(statement):
+    return ' '.join(statement.split())
+
+
+def explain(dbapi_connection, statement, parameters):
+    """在原始 DBAPI 连接上执行 EXPLAIN QUERY PLAN，返回按层级缩进的计划行；不会再触发 SQLAlchemy 的事件。"""
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters)
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+    depth = {0: -1}
+    lines = []
+    for node_id, parent, _, detail in rows:
+        depth[node_id] = depth.get(parent, -1) + 1
+        lines.append('  ' * depth[node_id] + detail)
+    return lines
+
+
+def is_scan(plan):
+    # SQLite 里 SCAN 表示逐行扫描整张表；走索引的是 SEARCH ... USING INDEX 或 SCAN ... USING COVERING INDEX
+    return any(line.strip().startswith('SCAN ') and 'INDEX' not in line for line in plan or ())
+
+
+def _plan_for(conn, statement, parameters, executemany):
+    shape = _normalize(statement)
+    with _lock:
+        if shape in _plans:
+            _plans.move_to_end(shape)
+            return _plans[shape]
+    plan = None
+    if conn.dialect.name == 'sqlite':
+        try:
+            plan = explain(conn.connection, statement, parameters[0] if executemany else parameters)
+        except Exception as e:  # 无法解释的语句（如 DDL）只记录原因
+            plan = ['(explain failed: %s)' % e]
+    with _lock:
+        _plans[shape] = plan
+        while len(_plans) > MAX_PLANS:
+            _plans.popitem(last=False)
+    return plan
+
+
+def observe(conn, statement, parameters, duration, executemany=False):
+    """由 querystats 在每条语句执行后调用，超过阈值的语句记入慢查询日志。"""
+    if not has_app_context():
+        return
+    config = current_app.config
+    threshold = config['SLOWLOG_THRESHOLD_MS']
+    if threshold is None or duration * 1000 < threshold:
+        return
+    words = statement.split(None, 1)
+    if not words or words[0].upper() not in ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH'):
+        return  # PRAGMA、DDL 等不记录
+    plan = _plan_for(conn, statement, parameters, executemany)
+    entry = {
+        'time': time.time(),
+        'duration_ms': round(duration * 1000, 3),
+        'statement': _normalize(statement),
+        'parameters': repr(parameters)[:500],
+        'path': request.path if has_request_context() else None,
+        'plan': plan,
+        'scan': is_scan(plan),
+    }
+    with _lock:
+        _entries.append(entry)
+        while len(_entries) > config['SLOWLOG_SIZE']:
+            _entries.popleft()
+    if config['SLOWLOG_FILE']:
+        _append(config['SLOWLOG_FILE'], entry, config['SLOWLOG_FILE_MAX_BYTES'])
+
+
+def _append(path, entry, max_bytes):
+    line = json.dumps(entry, ensure_ascii=False) + '\n'
+    with _file_lock:
+        try:
+            # 超过大小上限时轮换，只保留一个旧文件
+            if max_bytes and os.path.getsize(path) > max_bytes:
+                os.replace(path, path + '.1')
+        except OSError:
+            pass
+        with open(path, 'a', encoding='utf-8') as f:  # 追加写一行，多个进程同时写也不会交错
+            f.write(line)
+
+
+def recent():
+    """当前进程环形缓冲区里的记录，按时间先后排列。"""
+    with _lock:
+        return list(_entries)
+
+
+def read_file(path, limit=None):
+    entries = []
+    for name in (path + '.1', path):
+        try:
+            with open(name, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        continue
+        except OSError:
+            continue
+    return entries[-limit:] if limit else entries
+
+
+def clear(path=None):
+    with _lock:
+        _entries.clear()
+        _plans.clear()
+    if path:
+        for name in (path, path + '.1'):
+            if os.path.exists(name):
+                os.remove(name)
+
+
+def summarize(entries):
+    """按语句形状汇总：[{statement, count, max_ms, avg_ms, plan, scan, last, path}]，最慢的在前。"""
+    groups = OrderedDict()
+    for entry in entries:
+        group = groups.get(entry['statement'])
+        if group is None:
+            group = groups[entry['statement']] = {'statement': entry['statement'], 'count': 0, 'total_ms': 0.0,
+                                                  'max_ms': 0.0, 'plan': entry['plan'], 'scan': entry['scan']}
+        group['count'] += 1
+        group['total_ms'] += entry['duration_ms']
+        group['max_ms'] = max(group['max_ms'], entry['duration_ms'])
+        group['last'] = entry
+    for group in groups.values():
+        group['avg_ms'] = round(group.pop('total_ms') / group['count'], 3)
+    return sorted(groups.values(), key=lambda group: group['max_ms'], reverse=True)
+
+
+def current_entries():
+    # 配置了日志文件时读文件（包含所有 worker 的记录），否则只有当前进程的
+    path = current_app.config['SLOWLOG_FILE']
+    return read_file(path, current_app.config['SLOWLOG_SIZE']) if path else recent()
+
+
+def slowlog_page():
+    from listweb.usercache import is_admin
+    if not is_admin(current_user):
+        abort(403)
+    groups = summarize(current_entries())
+    return render_template('slowlog.html', groups=groups,
+                           threshold=current_app.config['SLOWLOG_THRESHOLD_MS'])
@@ -0,0 +1,34 @@
+/* 添加表单的输入提示：停止输入 200ms 后请求 /suggest，把已有的同名条目列出来，避免重复添加 */
+(function () {
+    var DELAY = 200;
+    document.querySelectorAll('input[data-suggest]').forEach(function (input) {
+        var datalist = document.getElementById(input.getAttribute('list'));
+        var timer = null;
+        var last = '';
+        input.addEventListener('input', function () {
+            clearTimeout(timer);
+            timer = setTimeout(function () {
+                var q = input.value.trim();
+                if (!q || q === last) {
+                    return;
+                }
+                last = q;
+                var url = input.dataset.suggestUrl + '?list=' + encodeURIComponent(input.dataset.suggest) +
+                    '&q=' + encodeURIComponent(q);
+                fetch(url, {credentials: 'same-origin'})
+                    .then(function (response) { return response.ok ? response.json() : {suggestions: []}; })
+                    .then(function (data) {
+                        if (input.value.trim() !== q) {
+                            return;  // 结果返回前用户又改了输入
+                        }
+                        datalist.innerHTML = '';
+                        data.suggestions.forEach(function (title) {
+                            var option = document.createElement('option');
+                            option.value = title;
+                            datalist.appendChild(option);
+                        });
+                    });
+            }, DELAY);
+        });
+    });
+})();
@@ -0,0 +1,206 @@
+import threading
+from collections import OrderedDict, deque
+
+from flask import current_app
+
+from listweb import db
+from listweb.versions import list_version, pending_version, scoped_name
+
+LISTS = ('movie', 'book', 'todo')
+
+
+class _Node(object):
+    __slots__ = ('children', 'titles')
+
+    def __init__(self):
+        self.children = {}
+        self.titles = None  # {原始标题: 出现次数}，只有标题结尾的节点才有
+
+
+class Trie(object):
+    """标题前缀树，按小写后的标题逐字符建树，同一个标题可以出现多次。"""
+
+    def __init__(self):
+        self.root = _Node()
+        self.size = 0
+
+    def insert(self, title):
+        node = self.root
+        for char in title.lower():
+            node = node.children.setdefault(char, _Node())
+        if node.titles is None:
+            node.titles = {}
+        node.titles[title] = node.titles.get(title, 0) + 1
+        self.size += 1
+
+    def remove(self, title):
+        """删掉一次出现的 title，树里没有这个标题时返回 False。"""
+        path = [self.root]
+        for char in title.lower():
+            node = path[-1].children.get(char)
+            if node is None:
+                return False
+            path.append(node)
+        node = path[-1]
+        if not node.titles or title not in node.titles:
+            return False
+        node.titles[title] -= 1
+        if not node.titles[title]:
+            del node.titles[title]
+        self.size -= 1
+        # 删掉不再通向任何标题的节点
+        key = title.lower()
+        for depth in range(len(path) - 1, 0, -1):
+            node = path[depth]
+            if node.children or node.titles:
+                break
+            del path[depth - 1].children[key[depth - 1]]
+        return True
+
+    def complete(self, prefix, limit=10):
+        node = self.root
+        for char in prefix.lower():
+            node = node.children.get(char)
+            if node is None:
+                return []
+        # 从前缀节点开始按字符顺序深度优先，取够 limit 个就停
+        results, stack = [], [node]
+        while stack and len(results) < limit:
+            node = stack.pop()
+            if node.titles:
+                results.extend(sorted(node.titles)[:limit - len(results)])
+            stack.extend(node.children[char] for char in sorted(node.children, reverse=True))
+        return results
+
+
+class _Index(object):
+    """一个清单的前缀树，最多收录最近的 capacity 个标题，超出时淘汰最早收录的。"""
+
+    def __init__(self, version, capacity):
+        self.trie = Trie()
+        self.titles = deque()  # 收录顺序，最早的在左边
+        self.capacity = capacity
+        self.version = version
+        self.lock = threading.Lock()
+
+    def add(self, title):
+        self.trie.insert(title)
+        self.titles.append(title)
+        while len(self.titles) > self.capacity:
+            self.trie.remove(self.titles.popleft())
+
+    def discard(self, title):
+        # 超出容量早已淘汰的标题不在树里，什么也不做
+        if self.trie.remove(title):
+            self.titles.remove(title)
+
+
+# 键为 (清单, 用户 id) 的前缀树，按 LRU 保留最多 SUGGEST_MAX_INDEXES 棵
+_indexes = OrderedDict()
+_lock = threading.Lock()
+
+
+def _model(name):
+    from listweb.models import Movie, Book, Todo
+    return {'movie': Movie, 'book': Book, 'todo': Todo}[name]
+
+
+def _build(name, user_id, version):
+    model = _model(name)
+    capacity = current_app.config['SUGGEST_MAX_TITLES']
+    index = _Index(version, capacity)
+    # 每棵树最多收录最近的 SUGGEST_MAX_TITLES 个标题，控制内存占用；
+    # 提交后的增量更新也经过 _Index.add，超出时淘汰最早的，树不会无限增长
+    query = (db.session.query(model.title).filter(model.user_id == user_id)
+             .order_by(model.id.desc()).limit(capacity))
+    for (title,) in reversed(query.all()):  # 从旧到新收录
+        if title:
+            index.add(title)
+    return index
+
+
+def get_index(name, user_id):
+    key = (name, user_id)
+    version = list_version(scoped_name(name, user_id))
+    with _lock:
+        index = _indexes.get(key)
+        if index is not None:
+            _indexes.move_to_end(key)
+    # 版本号对不上说明其他进程改过这个清单，重新建树
+    if index is None or index.version != version:
+        index = _build(name, user_id, version)
+        with _lock:
+            _indexes[key] = index
+            while len(_indexes) > current_app.config['SUGGEST_MAX_INDEXES']:
+                _indexes.popitem(last=False)
+    return index
+
+
+def suggest(name, user_id, prefix, limit=10):
+    if not prefix or user_id is None:
+        return []
+    index = get_index(name, user_id)
+    with index.lock:
+        return index.trie.complete(prefix, limit)
+
+
+def clear():
+    with _lock:
+        _indexes.clear()
+
+
+@db.event.listens_for(db.session, 'after_flush')
+def _collect_changes(session, flush_context):
+    # 记下本次事务里增删改的标题，提交后再更新内存中的前缀树
+    changes = session.info.setdefault('suggest_changes', [])
+    for item in session.new:
+        if getattr(item, '__tablename__', None) in LISTS and item.title:
+            changes.append((item.__tablename__, item.user_id, None, item.title))
+    for item in session.dirty:
+        if getattr(item, '__tablename__', None) in LISTS:
+            history = db.inspect(item).attrs.title.history
+            if history.has_changes():
+                old = history.deleted[0] if history.deleted else None
+                changes.append((item.__tablename__, item.user_id, old, item.title))
+    for item in session.deleted:
+        if getattr(item, '__tablename__', None) in LISTS and item.title:
+            changes.append((item.__tablename__, item.user_id, item.title, None))
+    # 同时记下本次事务前后的版本号（versions 的同名钩子先运行，已经换好了），用来判断内存中的树是否与数据库一致
+    versions = session.info.setdefault('suggest_versions', {})
+    for name, user_id, old, new in changes:
+        if (name, user_id) not in versions:
+            versions[(name, user_id)] = pending_version(session, scoped_name(name, user_id))
+
+
+@db.event.listens_for(db.session, 'after_commit')
+def _apply_changes(session):
+    versions = session.info.pop('suggest_versions', {})
+    for name, user_id, old, new in session.info.pop('suggest_changes', ()):
+        with _lock:
+            index = _indexes.get((name, user_id))
+        if index is None:  # 还没建树，下次用到时再从数据库加载
+            continue
+        before, after = versions.get((name, user_id)) or (None, None)
+        if before is None or index.version not in (before, after):
+            # 树本来就是旧的（其他进程改过），增量更新也没用，下次用到时重建
+            with _lock:
+                _indexes.pop((name, user_id), None)
+            continue
+        with index.lock:
+            if old:
+                index.discard(old)
+            if new:
+                index.add(new)
+            # 记下提交后的新版本号，避免下次查询时整棵重建
+            index.version = after
+
+
+@db.event.listens_for(db.session, 'after_soft_rollback')
+def _forget_changes(session, previous_transaction):
+    session.info.pop('suggest_changes', None)
+    session.info.pop('suggest_versions', None)
+
+
+@db.event.listens_for(db.Model.metadata, 'after_drop')
+def _clear_on_drop(target, connection, **kw):
+    clear()
@@ -0,0 +1,27 @@
+import os
+
+from jinja2 import FileSystemBytecodeCache
+
+# 模板字节码缓存：编译好的模板存到 TEMPLATE_CACHE_DIR，每个 worker 第一次用到模板时直接读取，不必再编译。
+# 缓存文件里带有模板源码的校验和，模板改动后对应的缓存自动失效并重新编译。
+# 部署时执行 flask compile-templates 预先编译全部模板。
+
+
+def init_app(app):
+    directory = app.config['TEMPLATE_CACHE_DIR']
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(directory)
+
+
+def compile_templates(app):
+    """清空字节码缓存后重新编译 templates 目录下的全部模板，返回模板数。"""
+    env = app.jinja_env
+    if env.bytecode_cache is None:
+        raise RuntimeError('TEMPLATE_CACHE_DIR is not configured.')
+    env.bytecode_cache.clear()  # 顺便去掉已经删除的模板留下的缓存
+    names = env.list_templates()
+    for name in names:
+        # 绕过 Jinja 环境里已经加载的模板，经由加载器编译并写入字节码缓存
+        env.loader.load(env, name)
+    return len(names)
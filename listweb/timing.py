@@ -0,0 +1,104 @@
+import json
+import logging
+import random
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from flask import current_app, g, has_app_context, request
+from flask_login import current_user
+from jinja2 import Template
+
+# 按阶段统计请求耗时，写进 Server-Timing 响应头（浏览器开发者工具里可以直接看到）和结构化日志：
+#   auth    加载当前用户、HTTP Basic 认证
+#   hash    计算、校验密码散列
+#   db      执行 SQL（来自 listweb.querystats）
+#   render  渲染 Jinja 模板
+#   static  发送静态文件
+#   total   整个请求
+# 只有被抽样（TIMING_SAMPLE_RATE）的请求才计时，未抽样的请求几乎没有额外开销。
+# 响应头默认只发给调试模式下的请求和管理员，hash 阶段的耗时不能让匿名用户看到。
+logger = logging.getLogger('listweb.timing')  # 每条记录一行 JSON，可以单独配置输出位置
+logger.setLevel(logging.INFO)
+
+
+def _timings():
+    return g.get('timings') if has_app_context() else None
+
+
+@contextmanager
+def phase(name):
+    """把一段代码的耗时累加到当前请求的 name 阶段，请求未被抽样时什么也不做。"""
+    timings = _timings()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = timings.get(name, 0.0) + time.perf_counter() - started
+
+
+class TimedTemplate(Template):
+    def render(self, *args, **kwargs):
+        with phase('render'):
+            return super(TimedTemplate, self).render(*args, **kwargs)
+
+
+def start_timing():
+    rate = current_app.config['TIMING_SAMPLE_RATE']
+    if rate >= 1 or (rate > 0 and random.random() < rate):
+        g.timings = OrderedDict()
+        g.timing_started = time.perf_counter()
+
+
+def _breakdown(timings, total):
+    from listweb.querystats import current_stats
+    phases = OrderedDict((name, timings[name]) for name in ('auth', 'hash') if name in timings)
+    stats = current_stats()
+    if stats is not None and stats.count:
+        phases['db'] = stats.duration
+    if 'render' in timings:
+        phases['render'] = timings['render']
+    if request.endpoint == 'static':
+        phases['static'] = total
+    phases['total'] = total
+    return phases, (stats.count if stats is not None else 0)
+
+
+def _header_allowed():
+    header = current_app.config['TIMING_HEADER']
+    if header is None:
+        from listweb.usercache import is_admin
+        return current_app.debug or is_admin(current_user)
+    return header
+
+
+def finish_timing(response):
+    timings = g.get('timings')
+    if timings is None:
+        return response
+    total = time.perf_counter() - g.timing_started
+    phases, queries = _breakdown(timings, total)
+    config = current_app.config
+    if _header_allowed():
+        entries = []
+        for name, seconds in phases.items():
+            entry = '%s;dur=%.2f' % (name, seconds * 1000)
+            if name == 'db':
+                entry += ';desc="%d queries"' % queries
+            entries.append(entry)
+        response.headers['Server-Timing'] = ', '.join(entries)
+    if config['TIMING_LOG']:
+        record = {'method': request.method, 'path': request.path, 'endpoint': request.endpoint,
+                  'status': response.status_code, 'queries': queries}
+        record.update(('%s_ms' % name, round(seconds * 1000, 3)) for name, seconds in phases.items())
+        logger.info(json.dumps(record))
+    return response
+
+
+def init_app(app):
+    app.jinja_env.template_class = TimedTemplate
+    app.before_request(start_timing)
+    app.after_request(finish_timing)
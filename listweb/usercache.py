@@ -0,0 +1,123 @@
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, g, has_app_context
+from flask_login import current_user
+from sqlalchemy.orm import make_transient_to_detached
+
+from listweb import db
+
+# 进程级 LRU：键为 ('id', user_id) 或 'owner'，值为 (过期时间, 用户字段字典)。
+# 只缓存字段快照而不是 ORM 对象本身，取出时重新构造成 detached 的 User，
+# 不会和某个请求的数据库会话绑在一起。
+_entries = OrderedDict()
+_lock = threading.Lock()
+
+
+def _snapshot(user):
+    return {column.key: getattr(user, column.key) for column in user.__table__.columns}
+
+
+def _restore(data):
+    from listweb.models import User
+    user = User(**data)
+    make_transient_to_detached(user)  # 标记为已持久化的对象，merge 时无需再查询
+    return user
+
+
+def _request_store():
+    # 同一个请求（应用上下文）内共享的查找结果
+    if not has_app_context():
+        return {}
+    if 'user_cache' not in g:
+        g.user_cache = {}
+    return g.user_cache
+
+
+def _lru_get(key):
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None:
+            return None
+        expires, data = entry
+        if expires < time.monotonic():
+            del _entries[key]
+            return None
+        _entries.move_to_end(key)
+        return data
+
+
+def _lru_set(key, data):
+    config = current_app.config
+    with _lock:
+        _entries[key] = (time.monotonic() + config['USER_CACHE_TTL'], data)
+        _entries.move_to_end(key)
+        while len(_entries) > config['USER_CACHE_SIZE']:
+            _entries.popitem(last=False)
+
+
+def _lookup(key, load):
+    store = _request_store()
+    if key in store:
+        return store[key]
+    from listweb.metrics import CACHE
+    data = _lru_get(key)
+    CACHE.inc(cache='user', result='miss' if data is None else 'hit')
+    if data is not None:
+        user = _restore(data)
+    else:
+        user = load()
+        if user is not None:
+            data = _snapshot(user)
+            _lru_set(key, data)
+            _lru_set(('id', user.id), data)
+    store[key] = user
+    return user
+
+
+def get_user(user_id):
+    from listweb.models import User
+    return _lookup(('id', user_id), lambda: User.query.get(user_id))
+
+
+def get_owner():
+    # 站点主人（第一个用户），未登录时页面标题等处显示的就是这个用户的名字
+    from listweb.models import User
+    return _lookup('owner', lambda: User.query.order_by(User.id).first())
+
+
+def list_owner():
+    # 清单页面展示谁的清单：登录后是自己的，未登录时展示站点主人的
+    if current_user.is_authenticated:
+        return current_user._get_current_object()
+    return get_owner()
+
+
+def is_admin(user):
+    # 站点主人（第一个用户）和 ADMIN_USERNAMES 中的用户是管理员
+    if not user.is_authenticated:
+        return False
+    owner = get_owner()
+    return (owner is not None and user.id == owner.id) or user.username in current_app.config['ADMIN_USERNAMES']
+
+
+def attach(user):
+    # 把缓存得到的用户并入当前会话以便修改，不会额外查询数据库
+    return db.session.merge(user, load=False)
+
+
+def invalidate_user(user_id=None):
+    with _lock:
+        _entries.pop('owner', None)
+        if user_id is None:
+            _entries.clear()
+        else:
+            _entries.pop(('id', user_id), None)
+    if has_app_context():
+        g.pop('user_cache', None)
+
+
+@db.event.listens_for(db.Model.metadata, 'after_drop')
+def _clear_on_drop(target, connection, **kw):
+    invalidate_user()
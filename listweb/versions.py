@@ -0,0 +1,140 @@
+import time
+import uuid
+
+from flask import g, has_app_context
+from sqlalchemy.dialects.sqlite import insert
+
+from listweb import db
+from listweb.cache import get_cache
+
+# 每个清单（按表名区分）的版本号，提交了对应表的增删改之后换成新值。
+# 依赖数据变化的缓存（总数、页面、ETag 等）把版本号放进缓存键里，版本变了就自然失效。
+# 版本号存在数据库的 list_version 表里，与数据写入在同一个事务里更新：
+# 其他 worker、flask 命令写入后，所有进程读到的都是新版本号，回滚时版本号也一起回滚。
+# 版本号是随机生成的，不会与旧值重复；表里还没有的清单版本号为 INITIAL。
+INITIAL = ('0', 0.0)
+
+
+def _new_version():
+    return uuid.uuid4().hex[:16]
+
+
+def _memo():
+    # 同一个请求里只查一次数据库
+    return g.setdefault('list_versions', {}) if has_app_context() else {}
+
+
+def stamps(names):
+    """返回 {清单名: (版本号, 修改时间)}，一次查询取回所有清单。"""
+    from listweb.models import ListVersion
+    memo = _memo()
+    missing = [name for name in names if name not in memo]
+    if missing:
+        rows = db.session.query(ListVersion.name, ListVersion.token, ListVersion.modified).filter(
+            ListVersion.name.in_(missing))
+        found = {name: (token, modified) for name, token, modified in rows}
+        for name in missing:
+            memo[name] = found.get(name, INITIAL)
+    return {name: memo[name] for name in names}
+
+
+def list_version(name):
+    return stamps([name])[name][0]
+
+
+def last_modified(name):
+    return stamps([name])[name][1]
+
+
+def pending_version(session, name):
+    """本次事务里 name 的 (旧版本号, 新版本号)，没有改动时返回 None。提交后的钩子里不能再查库，用它代替。"""
+    stamp = session.info.get('version_stamps', {}).get(name)
+    return stamp[:2] if stamp is not None else None
+
+
+def _bump(session, names):
+    # 每个事务里每个清单只换一次版本号
+    from listweb.models import ListVersion
+    pending = session.info.setdefault('version_stamps', {})
+    names = sorted(set(names) - set(pending))
+    if not names:
+        return
+    table = ListVersion.__table__
+    connection = session.connection()
+    old = dict(connection.execute(db.select(table.c.name, table.c.token).where(table.c.name.in_(names))).all())
+    now = time.time()
+    rows = []
+    for name in names:
+        token = _new_version()
+        pending[name] = (old.get(name, INITIAL[0]), token, now)
+        rows.append({'name': name, 'token': token, 'modified': now})
+    statement = insert(table)
+    connection.execute(statement.on_conflict_do_update(
+        index_elements=[table.c.name],
+        set_={'token': statement.excluded.token, 'modified': statement.excluded.modified}), rows)
+
+
+def reset_versions():
+    # 版本表随其他表一起重建了，清掉本进程按旧版本号存下的页面缓存
+    if has_app_context():
+        get_cache().clear()
+        g.pop('list_versions', None)
+
+
+def scoped_name(table, user_id):
+    # 按用户区分的版本号，如 movie:3；某个用户的写入不会让其他用户的缓存失效
+    return '%s:%s' % (table, user_id)
+
+
+def _touched_tables(session):
+    touched = session.info.setdefault('touched_tables', set())
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        table = getattr(obj, '__tablename__', None)
+        if table is None:
+            continue
+        touched.add(table)
+        if table == 'user':
+            touched.add(scoped_name(table, obj.id))
+        elif getattr(obj, 'user_id', None) is not None:
+            touched.add(scoped_name(table, obj.user_id))
+    return touched
+
+
+def touch(session, *names):
+    # 绕过 ORM 的批量写入手动登记改动的表，提交前与 ORM 写入一样更新版本号
+    session.info.setdefault('touched_tables', set()).update(names)
+
+
+# 以下钩子要先于 search、suggest 等模块的同名钩子注册，它们导入本模块时已经满足
+@db.event.listens_for(db.session, 'after_flush')
+def _collect_touched(session, flush_context):
+    _bump(session, _touched_tables(session))
+
+
+@db.event.listens_for(db.session, 'before_commit')
+def _bump_touched(session):
+    # touch() 登记的表没有经过 flush，在提交前补上
+    _bump(session, session.info.get('touched_tables', ()))
+
+
+@db.event.listens_for(db.session, 'after_commit')
+def _remember_bumped(session):
+    session.info.pop('touched_tables', None)
+    bumped = session.info.pop('version_stamps', {})
+    if has_app_context():
+        memo = _memo()
+        for name, (old, token, modified) in bumped.items():
+            memo[name] = (token, modified)
+
+
+@db.event.listens_for(db.session, 'after_soft_rollback')
+def _forget_touched(session, previous_transaction):
+    session.info.pop('touched_tables', None)
+    session.info.pop('version_stamps', None)
+    if has_app_context():
+        g.pop('list_versions', None)  # 可能读到了回滚掉的版本号
+
+
+@db.event.listens_for(db.Model.metadata, 'after_drop')
+def _reset_on_drop(target, connection, **kw):
+    reset_versions()
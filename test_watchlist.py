@@ -1,8 +1,9 @@
+import os
 import unittest
 
 from listweb import app, db
 from listweb.models import Movie, User
-from listweb.commands import forge, initdb
+from listweb.commands import forge, initdb, reindex
 
 
 class WatchlistTestCase(unittest.TestCase):
@@ -10,13 +11,15 @@ class WatchlistTestCase(unittest.TestCase):
     def setUp(self):
         app.config.update(
             TESTING=True,
-            SQLALCHEMY_DATABASE_URI='sqlite:///:memory:'
+            SQLALCHEMY_DATABASE_URI='sqlite:///:memory:',
+            LIST_PAGE_SIZE=20,
+            SLOWLOG_FILE=None
         )
         db.create_all()
 
         user = User(name='Test', username='test')
         user.set_password('123')
-        movie = Movie(title='Test Movie Title')
+        movie = Movie(title='Test Movie Title', user=user)
         db.session.add_all([user, movie])
         db.session.commit()
 
@@ -126,6 +129,84 @@ class WatchlistTestCase(unittest.TestCase):
         self.assertIn('Settings', data)
         self.assertIn('Your Name', data)
 
+    def test_settings_update_invalidates_user_cache(self):
+        self.login()
+        response = self.client.get('/')
+        self.assertIn('test\'s web', response.get_data(as_text=True))
+
+        response = self.client.post('/settings', data=dict(
+            username='peter',
+            password='456'
+        ), follow_redirects=True)
+        data = response.get_data(as_text=True)
+        self.assertIn('Settings updated.', data)
+        self.assertIn('peter\'s web', data)
+        self.assertTrue(User.query.first().validate_password('456'))
+
+    def test_user_cache_shared_within_request(self):
+        from listweb.usercache import get_owner, get_user
+        with app.test_request_context('/'):
+            owner = get_owner()
+            self.assertIs(get_owner(), owner)
+            self.assertIs(get_user(owner.id), get_user(owner.id))
+        with app.test_request_context('/'):
+            cached = get_owner()
+            self.assertIsNot(cached, owner)
+            self.assertEqual(cached.username, 'test')
+            self.assertTrue(cached.validate_password('123'))
+
+    def test_register(self):
+        response = self.client.post('/register', data=dict(
+            username='alice',
+            name='Alice',
+            password='abc'
+        ), follow_redirects=True)
+        data = response.get_data(as_text=True)
+        self.assertIn('Registration successful!', data)
+        self.assertIn('Logout', data)
+        self.assertTrue(User.query.filter_by(username='alice').first().validate_password('abc'))
+
+        self.client.get('/logout')
+        response = self.client.post('/register', data=dict(
+            username='alice',
+            password='xyz'
+        ), follow_redirects=True)
+        self.assertIn('Username already taken.', response.get_data(as_text=True))
+
+        response = self.client.post('/register', data=dict(
+            username='',
+            password='xyz'
+        ), follow_redirects=True)
+        self.assertIn('Invalid input.', response.get_data(as_text=True))
+
+    def test_lists_are_scoped_to_owner(self):
+        other = User(name='Other', username='other')
+        other.set_password('789')
+        db.session.add(other)
+        db.session.commit()
+        self.client.post('/login', data=dict(username='other', password='789'), follow_redirects=True)
+
+        response = self.client.post('/watchlist', data=dict(title='Other Movie'), follow_redirects=True)
+        data = response.get_data(as_text=True)
+        self.assertIn('Other Movie', data)
+        self.assertNotIn('Test Movie Title', data)
+        self.assertIn('1 movies in the watchlist', data)
+        self.assertEqual(Movie.query.filter_by(title='Other Movie').first().user_id, other.id)
+
+        self.assertEqual(self.client.get('/movie/edit/1').status_code, 404)
+        self.assertEqual(self.client.post('/movie/delete/1').status_code, 404)
+        self.assertIsNotNone(Movie.query.get(1))
+
+        # 未登录的访客看到的是站点主人的清单
+        self.client.get('/logout')
+        data = self.client.get('/watchlist').get_data(as_text=True)
+        self.assertIn('Test Movie Title', data)
+        self.assertNotIn('Other Movie', data)
+
+    def test_anonymous_cannot_add_items(self):
+        self.client.post('/watchlist', data=dict(title='Sneaky'))
+        self.assertIsNone(Movie.query.filter_by(title='Sneaky').first())
+
     def test_create_item(self):
         self.login()
 
@@ -173,11 +254,1011 @@ class WatchlistTestCase(unittest.TestCase):
         self.assertIn('Item deleted.', data)
         self.assertNotIn('Test Movie Title', data)
 
+    def test_watchlist_pagination(self):
+        app.config['LIST_PAGE_SIZE'] = 2
+        db.session.add_all([Movie(title='Movie %d' % i, user_id=1) for i in range(2, 6)])
+        db.session.commit()
+
+        response = self.client.get('/watchlist')
+        data = response.get_data(as_text=True)
+        self.assertIn('5 movies in the watchlist', data)
+        self.assertIn('Test Movie Title', data)
+        self.assertIn('Movie 2', data)
+        self.assertNotIn('Movie 3', data)
+        self.assertIn('/watchlist?after=2', data)
+        self.assertNotIn('Previous', data)
+
+        response = self.client.get('/watchlist?after=4')
+        data = response.get_data(as_text=True)
+        self.assertIn('Movie 5', data)
+        self.assertNotIn('Movie 4', data)
+        self.assertIn('/watchlist?before=5', data)
+        self.assertNotIn('Next', data)
+
+        response = self.client.get('/watchlist?before=5')
+        data = response.get_data(as_text=True)
+        self.assertIn('Movie 3', data)
+        self.assertIn('Movie 4', data)
+        self.assertNotIn('Movie 5', data)
+        self.assertIn('/watchlist?before=3', data)
+        self.assertIn('/watchlist?after=4', data)
+
+    def test_list_count_cache_invalidation(self):
+        self.login()
+        response = self.client.get('/watchlist')
+        self.assertIn('1 movies in the watchlist', response.get_data(as_text=True))
+
+        response = self.client.post('/watchlist', data=dict(
+            title='Another Movie'
+        ), follow_redirects=True)
+        self.assertIn('2 movies in the watchlist', response.get_data(as_text=True))
+
+        response = self.client.post('/movie/delete/1', follow_redirects=True)
+        self.assertIn('1 movies in the watchlist', response.get_data(as_text=True))
+
+    def test_page_cache_invalidated_by_writes(self):
+        response = self.client.get('/watchlist')
+        self.assertIn('Test Movie Title', response.get_data(as_text=True))
+
+        # 绕过 ORM 直接改库，版本号不变，命中的仍是缓存的页面
+        db.session.execute(db.text("UPDATE movie SET title = 'Changed Behind'"))
+        db.session.commit()
+        response = self.client.get('/watchlist')
+        self.assertIn('Test Movie Title', response.get_data(as_text=True))
+
+        movie = Movie.query.get(1)
+        movie.title = 'Changed Through ORM'
+        db.session.commit()
+        response = self.client.get('/watchlist')
+        data = response.get_data(as_text=True)
+        self.assertIn('Changed Through ORM', data)
+        self.assertNotIn('Test Movie Title', data)
+
+    def test_conditional_get(self):
+        # 把 setUp 中写入的时间提前，否则 Last-Modified 与当前时间在同一秒内，不会发送
+        db.session.execute(db.text('UPDATE list_version SET modified = modified - 5'))
+        db.session.commit()
+        response = self.client.get('/watchlist')
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers['ETag']
+        last_modified = response.headers['Last-Modified']
+        self.assertTrue(etag.startswith('W/'))
+
+        response = self.client.get('/watchlist', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.get_data(), b'')
+
+        response = self.client.get('/watchlist', headers={'If-Modified-Since': last_modified})
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get('/readlist', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+
+        db.session.add(Movie(title='Fresh Movie', user_id=1))
+        db.session.commit()
+        response = self.client.get('/watchlist', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Fresh Movie', response.get_data(as_text=True))
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_conditional_get_same_second_write(self):
+        # 刚写入的页面只发 ETag，同一秒内的后续写入不会被 If-Modified-Since 误判为没变；
+        # 把修改时间设在几秒之后，测试运行时跨过整秒也还算“当前这一秒内的写入”
+        import time
+        db.session.execute(db.text('UPDATE list_version SET modified = :now'), {'now': time.time() + 5})
+        db.session.commit()
+        response = self.client.get('/watchlist')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('ETag', response.headers)
+        self.assertNotIn('Last-Modified', response.headers)
+        from werkzeug.http import http_date
+        response = self.client.get('/watchlist', headers={'If-Modified-Since': http_date(time.time() + 5)})
+        self.assertEqual(response.status_code, 200)
+
+    def test_build_id_changes_etag(self):
+        response = self.client.get('/watchlist')
+        etag = response.headers['ETag']
+        self.assertEqual(self.client.get('/watchlist', headers={'If-None-Match': etag}).status_code, 304)
+
+        # 重新部署后页面里的静态文件地址可能变了，旧的 ETag 和缓存的页面都不能再用
+        app.config['BUILD_ID'] = 'v2'
+        try:
+            response = self.client.get('/watchlist', headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 200)
+            self.assertNotEqual(response.headers['ETag'], etag)
+        finally:
+            app.config['BUILD_ID'] = None
+
+    def write_from_other_process(self, path, title):
+        # 另一个进程（其他 worker、flask 命令）往 path 指向的数据库添加一部电影，本进程内存里什么都没变
+        import subprocess
+        import sys
+        code = ('import sys; from listweb import create_app, db; from listweb.models import Movie, User\n'
+                'app = create_app({"SQLALCHEMY_DATABASE_URI": "sqlite:///" + sys.argv[1], "SLOWLOG_FILE": None})\n'
+                'with app.app_context():\n'
+                '    db.create_all()\n'
+                '    user = User.query.filter_by(username="test").first()\n'
+                '    if user is None:\n'
+                '        user = User(name="Test", username="test")\n'
+                '        user.set_password("123")\n'
+                '    db.session.add(Movie(title=sys.argv[2], user=user))\n'
+                '    db.session.commit()\n')
+        subprocess.run([sys.executable, '-c', code, path, title], check=True,
+                       cwd=os.path.dirname(os.path.abspath(__file__)))
+
+    def other_process_client(self, **config):
+        import tempfile
+        from listweb import create_app
+        fd, path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        self.write_from_other_process(path, 'First Movie')
+        config.update(TESTING=True, SQLALCHEMY_DATABASE_URI='sqlite:///' + path, SLOWLOG_FILE=None)
+        client = create_app(config).test_client()
+        client.post('/login', data=dict(username='test', password='123'), follow_redirects=True)
+        return client, path
+
+    def test_conditional_get_other_process(self):
+        client, path = self.other_process_client()
+        response = client.get('/watchlist')
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers['ETag']
+        self.assertEqual(client.get('/watchlist', headers={'If-None-Match': etag}).status_code, 304)
+
+        self.write_from_other_process(path, 'Second Movie')
+        response = client.get('/watchlist', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Second Movie', response.get_data(as_text=True))
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertEqual(client.get('/watchlist', headers={'If-None-Match': response.headers['ETag']}).status_code, 304)
+
+    def test_page_cache_other_process(self):
+        # 默认的进程内页面缓存也能感知其他进程的写入：缓存键里的版本号来自数据库
+        client, path = self.other_process_client(PAGE_CACHE_TYPE='simple')
+        self.assertIn('First Movie', client.get('/watchlist').get_data(as_text=True))
+        self.write_from_other_process(path, 'Second Movie')
+        self.assertIn('Second Movie', client.get('/watchlist').get_data(as_text=True))
+
+    def test_counts_other_process(self):
+        # 总数缓存按数据库里的版本号区分，其他进程写入后指标里的条目数跟着变
+        client, path = self.other_process_client()
+        self.assertIn('listweb_list_items{list="movie"} 1', client.get('/metrics').get_data(as_text=True))
+        self.write_from_other_process(path, 'Second Movie')
+        self.assertIn('listweb_list_items{list="movie"} 2', client.get('/metrics').get_data(as_text=True))
+
+    def test_filesystem_page_cache(self):
+        import tempfile
+        from listweb.cache import FileSystemCache
+
+        with tempfile.TemporaryDirectory() as directory:
+            cache = FileSystemCache(directory, threshold=4, default_timeout=0)
+            cache.set('a', '<p>a</p>')
+            self.assertEqual(cache.get('a'), '<p>a</p>')
+            self.assertEqual(FileSystemCache(directory).get('a'), '<p>a</p>')
+            cache.set('b', 'b', timeout=-1)
+            self.assertIsNone(cache.get('b'))
+            for i in range(10):
+                cache.set('k%d' % i, i)
+            self.assertLessEqual(len(os.listdir(directory)), 4)
+            cache.clear()
+            self.assertIsNone(cache.get('k9'))
+
+    def test_animated_image_helper(self):
+        from listweb import assets
+
+        response = self.client.get('/watchlist')
+        self.assertIn('class="foot_image" src="/static/images/', response.get_data(as_text=True))
+        self.assertIn('loading="lazy"', response.get_data(as_text=True))
+
+        assets._manifest = {'images/a.gif': {
+            'width': 200, 'height': 100, 'size': 5000, 'mp4': None,
+            'webp': [{'filename': 'build/images/a-120w.webp', 'width': 120, 'size': 800},
+                     {'filename': 'build/images/a.webp', 'width': 200, 'size': 1500}]}}
+        try:
+            with app.test_request_context('/'):
+                html = assets.animated_image('images/a.gif', alt='a', width=100)
+                self.assertIn('<picture><source type="image/webp"', html)
+                self.assertIn('/static/build/images/a-120w.webp 120w', html)
+                self.assertIn('sizes="100px"', html)
+                self.assertIn('<img alt="a" src="/static/images/a.gif" loading="lazy"', html)
+
+                assets._manifest['images/a.gif']['mp4'] = {'filename': 'build/images/a.mp4', 'size': 600}
+                html = assets.animated_image('images/a.gif', alt='a', width=100)
+                self.assertIn('<video aria-label="a" autoplay loop muted playsinline', html)
+                self.assertIn('/static/build/images/a.mp4', html)
+        finally:
+            with app.app_context():
+                assets.load_manifest(reload=True)
+
+    def test_fingerprinted_static_urls(self):
+        from listweb.fingerprint import load_manifest
+
+        response = self.client.get('/')
+        data = response.get_data(as_text=True)
+        hashed = load_manifest()['style.css']
+        self.assertRegex(hashed, r'^style\.[0-9a-f]{10}\.css$')
+        self.assertIn('/static/%s' % hashed, data)
+
+        response = self.client.get('/static/%s' % hashed)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('body', response.get_data(as_text=True))
+        self.assertIn('immutable', response.headers['Cache-Control'])
+        self.assertIn('max-age=31536000', response.headers['Cache-Control'])
+        response.close()
+
+        response = self.client.get('/static/style.css')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('immutable', response.headers.get('Cache-Control', ''))
+        response.close()
+
+    def test_fingerprint_follows_content(self):
+        import tempfile
+        from listweb.fingerprint import compute_manifest
+
+        with tempfile.TemporaryDirectory() as directory:
+            with open(os.path.join(directory, 'a.css'), 'w') as f:
+                f.write('a{}')
+            first = compute_manifest(directory)['a.css']
+            with open(os.path.join(directory, 'a.css'), 'w') as f:
+                f.write('a{color:red}')
+            self.assertNotEqual(compute_manifest(directory)['a.css'], first)
+
+    def test_precompressed_static_files(self):
+        import gzip
+        import tempfile
+        from listweb.compress import precompress
+
+        with tempfile.TemporaryDirectory() as directory:
+            with open(os.path.join(directory, 'a.css'), 'w') as f:
+                f.write('body { color: red; }\n' * 50)
+            with open(os.path.join(directory, 'tiny.css'), 'w') as f:
+                f.write('a{}')
+            precompress(directory, echo=lambda message: None)
+            with open(os.path.join(directory, 'a.css.gz'), 'rb') as f:
+                self.assertEqual(gzip.decompress(f.read()), b'body { color: red; }\n' * 50)
+            self.assertFalse(os.path.exists(os.path.join(directory, 'tiny.css.gz')))
+
+        style = os.path.join(app.static_folder, 'style.css')
+        with open(style, 'rb') as f:
+            original = f.read()
+        with open(style + '.gz', 'wb') as f:
+            f.write(gzip.compress(original))
+        try:
+            response = self.client.get('/static/style.css', headers={'Accept-Encoding': 'gzip'})
+            self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+            self.assertEqual(response.mimetype, 'text/css')
+            self.assertIn('Accept-Encoding', response.headers['Vary'])
+            self.assertEqual(gzip.decompress(response.get_data()), original)
+            response.close()
+
+            response = self.client.get('/static/style.css')
+            self.assertNotIn('Content-Encoding', response.headers)
+            self.assertEqual(response.get_data(), original)
+            response.close()
+        finally:
+            os.remove(style + '.gz')
+
+    def test_dynamic_gzip(self):
+        import gzip
+
+        response = self.client.get('/watchlist', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Test Movie Title', gzip.decompress(response.get_data()).decode('utf-8'))
+
+        response = self.client.get('/watchlist')
+        self.assertNotIn('Content-Encoding', response.headers)
+
+    def test_sqlite_engine_tuning(self):
+        import tempfile
+        from sqlalchemy.engine.url import make_url
+        from sqlalchemy.pool import QueuePool
+
+        with tempfile.TemporaryDirectory() as directory:
+            url = make_url('sqlite:///' + os.path.join(directory, 'tuned.db'))
+            url, options = db.apply_driver_hacks(app, url, {})
+            self.assertIs(options['poolclass'], QueuePool)
+            self.assertEqual(options['pool_size'], app.config['SQLITE_POOL_SIZE'])
+            self.assertFalse(options['connect_args']['check_same_thread'])
+
+            engine = db.create_engine(url, options)
+            try:
+                with engine.connect() as connection:
+                    pragma = lambda name: connection.exec_driver_sql('PRAGMA %s' % name).scalar()
+                    self.assertEqual(pragma('journal_mode'), 'wal')
+                    self.assertEqual(pragma('synchronous'), 1)  # NORMAL
+                    self.assertEqual(pragma('busy_timeout'), app.config['SQLITE_BUSY_TIMEOUT'])
+                    self.assertEqual(pragma('cache_size'), app.config['SQLITE_CACHE_SIZE'])
+                    self.assertEqual(pragma('temp_store'), 2)  # MEMORY
+                    self.assertEqual(pragma('foreign_keys'), 1)
+            finally:
+                engine.dispose()
+
+    def test_search(self):
+        db.session.add_all([Movie(title='这个杀手不太冷', user_id=1), Movie(title='Leon', user_id=1)])
+        db.session.commit()
+
+        data = self.client.get('/search?q=杀手').get_data(as_text=True)
+        self.assertIn('1 movies in the', data)
+        self.assertIn('这个杀手不太冷', data)
+
+        data = self.client.get('/search?q=le').get_data(as_text=True)
+        self.assertIn('Leon', data)
+        self.assertNotIn('这个杀手不太冷', data)
+
+        data = self.client.get('/search?q=test title').get_data(as_text=True)
+        self.assertIn('Test Movie Title', data)
+
+        movie = Movie.query.filter_by(title='Leon').first()
+        movie.title = 'Matilda'
+        db.session.commit()
+        self.assertNotIn('Matilda', self.client.get('/search?q=leon').get_data(as_text=True))
+        self.assertIn('Matilda', self.client.get('/search?q=mati').get_data(as_text=True))
+
+        db.session.delete(movie)
+        db.session.commit()
+        self.assertNotIn('Matilda', self.client.get('/search?q=mati').get_data(as_text=True))
+
+    def test_search_scoped_to_owner(self):
+        from listweb.search import search
+        other = User(name='Other', username='other')
+        db.session.add(other)
+        db.session.commit()
+        db.session.add(Movie(title='Test Movie Other', user_id=other.id))
+        db.session.commit()
+        self.assertEqual([m.title for m in search('test movie', 1)['movie']], ['Test Movie Title'])
+        self.assertEqual([m.title for m in search('test movie', other.id)['movie']], ['Test Movie Other'])
+        self.assertEqual(search('"', 1)['movie'], [])
+        # 关键词不会匹配到 owner 列里的 u<用户 id>
+        self.assertEqual(search('u', 1)['movie'], [])
+        self.assertEqual(search('u1', 1)['movie'], [])
+        self.assertEqual([m.title for m in search('u', other.id)['movie']], [])
+
+    def test_reindex_command(self):
+        db.session.execute(db.text('DELETE FROM search_index'))
+        db.session.commit()
+        self.assertNotIn('Test Movie Title', self.client.get('/search?q=test').get_data(as_text=True))
+        result = self.runner.invoke(reindex)
+        self.assertIn('Indexed 1 items.', result.output)
+        self.assertIn('Test Movie Title', self.client.get('/search?q=test').get_data(as_text=True))
+
+    def test_trie(self):
+        from listweb.suggest import Trie
+        trie = Trie()
+        for title in ['Matrix', 'matrix reloaded', 'Mad Max', '黑客帝国', '黑客帝国2', 'Matrix']:
+            trie.insert(title)
+        self.assertEqual(trie.complete('ma'), ['Mad Max', 'Matrix', 'matrix reloaded'])
+        self.assertEqual(trie.complete('ma', limit=2), ['Mad Max', 'Matrix'])
+        self.assertEqual(trie.complete('黑客'), ['黑客帝国', '黑客帝国2'])
+        self.assertEqual(trie.complete('x'), [])
+        trie.remove('Matrix')
+        self.assertIn('Matrix', trie.complete('mat'))
+        trie.remove('Matrix')
+        trie.remove('matrix reloaded')
+        self.assertEqual(trie.complete('mat'), [])
+        self.assertEqual(trie.root.children['m'].children.keys(), {'a'})
+        self.assertEqual(trie.size, 3)
+
+    def test_suggest_endpoint(self):
+        response = self.client.get('/suggest?list=movie&q=test')
+        self.assertEqual(response.get_json(), {'suggestions': ['Test Movie Title']})
+        self.assertEqual(self.client.get('/suggest?list=todo&q=a').status_code, 400)
+
+        self.login()
+        self.client.post('/watchlist', data=dict(title='Testament'))
+        self.assertEqual(self.client.get('/suggest?list=movie&q=TEST').get_json()['suggestions'],
+                         ['Test Movie Title', 'Testament'])
+        self.client.post('/movie/edit/1', data=dict(title='Renamed'))
+        self.assertEqual(self.client.get('/suggest?list=movie&q=test').get_json()['suggestions'],
+                         ['Testament'])
+        self.client.post('/movie/delete/1')
+        self.assertEqual(self.client.get('/suggest?list=movie&q=ren').get_json()['suggestions'], [])
+
+        # 不经过视图、直接通过会话提交的写入同样会同步到前缀树
+        db.session.add(Movie(title='Test From Elsewhere', user_id=1))
+        db.session.commit()
+        self.assertIn('Test From Elsewhere',
+                      self.client.get('/suggest?list=movie&q=test').get_json()['suggestions'])
+
+    def test_suggest_capacity(self):
+        from listweb.suggest import get_index
+        self.addCleanup(app.config.update, SUGGEST_MAX_TITLES=app.config['SUGGEST_MAX_TITLES'])
+        app.config['SUGGEST_MAX_TITLES'] = 2
+        with app.app_context():
+            built = get_index('movie', 1)
+            self.assertEqual(built.trie.size, 1)
+        # 提交后增量收录的标题同样受上限约束，淘汰最早收录的
+        for title in ('Test Second', 'Test Third'):
+            db.session.add(Movie(title=title, user_id=1))
+            db.session.commit()
+        with app.app_context():
+            index = get_index('movie', 1)
+            self.assertIs(index, built)  # 增量更新，没有重建
+            self.assertEqual(index.trie.size, 2)
+            self.assertEqual(index.trie.complete('test'), ['Test Second', 'Test Third'])
+
+    def test_api_requires_auth(self):
+        response = self.client.get('/api/v1/movies')
+        self.assertEqual(response.status_code, 401)
+        self.assertIn('Basic', response.headers['WWW-Authenticate'])
+        headers = {'Authorization': 'Basic dGVzdDp3cm9uZw=='}  # test:wrong
+        self.assertEqual(self.client.get('/api/v1/movies', headers=headers).status_code, 401)
+        headers = {'Authorization': 'Basic dGVzdDoxMjM='}  # test:123
+        response = self.client.get('/api/v1/movies', headers=headers)
+        self.assertEqual(response.get_json()['items'], [{'id': 1, 'title': 'Test Movie Title'}])
+        # 页面不接受 Basic 认证
+        self.assertNotIn('Logout', self.client.get('/', headers=headers).get_data(as_text=True))
+
+        # 改密码后，缓存里校验过的旧密码立即失效
+        user = User.query.first()
+        user.set_password('456')
+        db.session.commit()
+        self.assertEqual(self.client.get('/api/v1/movies', headers=headers).status_code, 401)
+        headers = {'Authorization': 'Basic dGVzdDo0NTY='}  # test:456
+        self.assertEqual(self.client.get('/api/v1/movies', headers=headers).status_code, 200)
+
+    def test_api_crud(self):
+        self.login()
+        response = self.client.post('/api/v1/todos', json={'title': 'Write', 'ddl': 'Friday'})
+        self.assertEqual(response.status_code, 201)
+        todo_id = response.get_json()['id']
+        self.assertEqual(self.client.post('/api/v1/todos', json={'title': 'No ddl'}).status_code, 400)
+        response = self.client.patch('/api/v1/todos/%d' % todo_id, json={'ddl': 'Monday'})
+        self.assertEqual(response.get_json(), {'id': todo_id, 'title': 'Write', 'ddl': 'Monday'})
+        self.assertEqual(self.client.delete('/api/v1/todos/%d' % todo_id).status_code, 204)
+        self.assertEqual(self.client.get('/api/v1/todos/%d' % todo_id).status_code, 404)
+
+    def test_api_pagination_and_fields(self):
+        for i in range(5):
+            db.session.add(Movie(title='Movie %d' % i, user_id=1))
+        db.session.commit()
+        self.login()
+        data = self.client.get('/api/v1/movies?per_page=4&fields=id').get_json()
+        self.assertEqual(data['items'], [{'id': 1}, {'id': 2}, {'id': 3}, {'id': 4}])
+        self.assertEqual(data['total'], 6)
+        data = self.client.get('/api/v1/movies?per_page=4&after=%d' % data['next']).get_json()
+        self.assertEqual([item['id'] for item in data['items']], [5, 6])
+        self.assertIsNone(data['next'])
+        self.assertEqual(self.client.get('/api/v1/movies?fields=secret').status_code, 400)
+
+    def test_api_batch(self):
+        self.login()
+        response = self.client.post('/api/v1/movies/batch', json={
+            'create': [{'title': 'New 1'}, {'title': 'New 2'}],
+            'update': [{'id': 1, 'title': 'Updated'}],
+        })
+        data = response.get_json()
+        self.assertEqual(data['updated'], [1])
+        self.assertEqual(len(data['created']), 2)
+        self.assertEqual(Movie.query.get(1).title, 'Updated')
+
+        # 任一操作不合法时整批拒绝，什么都不改
+        response = self.client.post('/api/v1/movies/batch', json={
+            'create': [{'title': 'Good'}, {'title': ''}],
+            'delete': [1],
+        })
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()['errors'][0]['index'], 1)
+        response = self.client.post('/api/v1/movies/batch', json={'delete': [1, 999]})
+        self.assertEqual(response.get_json()['errors'][0]['ids'], [999])
+        self.assertEqual(Movie.query.count(), 3)
+
+        response = self.client.post('/api/v1/movies/batch', json={'delete': data['created']})
+        self.assertEqual(response.get_json()['deleted'], sorted(data['created']))
+        self.assertEqual(Movie.query.count(), 1)
+        self.assertIn('Updated', self.client.get('/search?q=upd').get_data(as_text=True))
+
+    def test_api_changes(self):
+        self.login()
+        data = self.client.get('/api/v1/changes').get_json()
+        self.assertEqual(data['changes'], [{'cursor': 1, 'kind': 'movie', 'id': 1, 'op': 'upsert',
+                                            'item': {'id': 1, 'title': 'Test Movie Title'}}])
+        cursor = data['cursor']
+
+        self.client.post('/api/v1/todos', json={'title': 'Write', 'ddl': 'Friday'})
+        self.client.patch('/api/v1/movies/1', json={'title': 'Renamed'})
+        self.client.patch('/api/v1/movies/1', json={'title': 'Renamed Again'})
+        data = self.client.get('/api/v1/changes?since=%d&limit=2' % cursor).get_json()
+        self.assertEqual([change['kind'] for change in data['changes']], ['todo', 'movie'])
+        self.assertTrue(data['more'])
+        data = self.client.get('/api/v1/changes?since=%d' % cursor).get_json()
+        # 同一条目的多次修改只返回最新状态
+        self.assertEqual(data['changes'][-1]['item']['title'], 'Renamed Again')
+        self.assertEqual(len(data['changes']), 2)
+        self.assertFalse(data['more'])
+
+        cursor = data['cursor']
+        self.client.delete('/api/v1/movies/1')
+        data = self.client.get('/api/v1/changes?since=%d' % cursor).get_json()
+        self.assertEqual(data['changes'], [{'cursor': cursor + 1, 'kind': 'movie', 'id': 1,
+                                            'op': 'delete', 'item': None}])
+        self.assertEqual(self.client.get('/api/v1/changes?since=%d' % data['cursor']).get_json()['changes'], [])
+
+    def test_compact_changes_command(self):
+        from listweb.models import Change
+        self.login()
+        self.client.patch('/api/v1/movies/1', json={'title': 'Renamed'})
+        self.client.delete('/api/v1/movies/1')
+        self.assertEqual(Change.query.count(), 3)
+        result = self.runner.invoke(args=['compact-changes'])
+        self.assertIn('Removed 2 change rows.', result.output)
+        self.assertEqual(self.client.get('/api/v1/changes').get_json()['changes'][0]['op'], 'delete')
+
+        result = self.runner.invoke(args=['compact-changes', '--days', '-1'])
+        self.assertIn('Removed 1 change rows.', result.output)
+        response = self.client.get('/api/v1/changes?since=2')
+        self.assertEqual(response.status_code, 410)
+        cursor = response.get_json()['cursor']
+        self.assertEqual(cursor, 3)
+        self.assertEqual(self.client.get('/api/v1/changes?since=%d' % cursor).get_json()['changes'], [])
+
+    def test_api_export(self):
+        from listweb.models import Todo
+        db.session.add_all([Movie(title='电影 %d' % i, user_id=1) for i in range(250)])
+        db.session.add(Todo(title='Write', ddl='Friday', user_id=1))
+        db.session.commit()
+        self.login()
+        response = self.client.get('/api/v1/export?kinds=movie,todo')
+        self.assertTrue(response.is_streamed)
+        lines = response.get_data(as_text=True).splitlines()
+        self.assertEqual(len(lines), 252)
+        self.assertIn('"title": "电影 0"', lines[1])
+        self.assertIn('"ddl": "Friday"', lines[-1])
+
+        data = self.client.get('/api/v1/export?format=csv').get_data(as_text=True)
+        lines = data.splitlines()
+        self.assertEqual(lines[0], 'kind,id,user_id,title,ddl')
+        self.assertEqual(lines[1], 'movie,1,1,Test Movie Title,')
+        self.assertEqual(len(lines), 253)
+        self.assertEqual(self.client.get('/api/v1/export?format=xml').status_code, 400)
+
+    def test_export_command(self):
+        result = self.runner.invoke(args=['export', '--format', 'csv'])
+        self.assertEqual(result.output.splitlines(), ['kind,id,user_id,title,ddl', 'movie,1,1,Test Movie Title,'])
+        result = self.runner.invoke(args=['export', '--user', 'nobody'])
+        self.assertIn('No such user', result.output)
+
+    def test_import_command(self):
+        from listweb.models import Book, Todo
+        import tempfile
+        fd, path = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(fd, 'w', encoding='utf-8-sig') as f:
+            f.write('kind,title,ddl\n'
+                    'movie,Test Movie Title,\n'  # 已存在
+                    'movie,Matilda,\n'
+                    'movie,Matilda,\n'  # 文件内重复
+                    'book,%s,\n'
+                    'todo,Write,Friday\n'
+                    'todo,No ddl,\n' % ('x' * 61))
+        self.addCleanup(os.remove, path)
+        result = self.runner.invoke(args=['import', path, '--user', 'test'])
+        self.assertIn('Imported 2 items, skipped 2 duplicates and 2 invalid rows', result.output)
+        self.assertIn('Line 5: Invalid title', result.output)
+        self.assertEqual(Movie.query.count(), 2)
+        self.assertEqual(Book.query.count(), 0)
+        self.assertEqual(Todo.query.filter_by(title='Write').first().ddl, 'Friday')
+        # 批量写入同样进入全文索引、前缀树和变更记录
+        self.assertIn('Matilda', self.client.get('/search?q=mati').get_data(as_text=True))
+        self.assertEqual(self.client.get('/suggest?list=movie&q=mat').get_json()['suggestions'], ['Matilda'])
+        self.login()
+        kinds = [change['kind'] for change in self.client.get('/api/v1/changes').get_json()['changes']]
+        self.assertEqual(kinds, ['movie', 'movie', 'todo'])
+
+    def test_import_concurrent_insert(self):
+        # 其他进程恰好在导入的第一条 INSERT 之前写入了一部电影，它不能被当作导入的条目重复索引和记录
+        import tempfile
+        from listweb import create_app
+        from listweb.importer import import_items
+        from listweb.models import Change
+        fd, path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        self.write_from_other_process(path, 'First Movie')
+        other = create_app({'TESTING': True, 'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + path, 'SLOWLOG_FILE': None})
+        db.session.remove()  # 会话在创建时绑定程序，丢掉 setUp 里绑定默认程序的会话
+        self.addCleanup(db.session.remove)
+        with other.app_context():
+            inserted = []
+
+            def write_concurrently(conn, cursor, statement, parameters, context, executemany):
+                if statement.startswith('INSERT INTO movie') and not inserted:
+                    inserted.append(True)
+                    self.write_from_other_process(path, 'Concurrent Movie')
+
+            db.event.listen(db.engine, 'before_cursor_execute', write_concurrently)
+            self.addCleanup(db.event.remove, db.engine, 'before_cursor_execute', write_concurrently)
+            user = User.query.filter_by(username='test').first()
+            result = import_items(user.id, [(1, 'movie', {'title': 'Imported A'}), (2, 'movie', {'title': 'Imported B'})])
+            self.assertEqual(result.created, 2)
+            concurrent = Movie.query.filter_by(title='Concurrent Movie').one()
+            self.assertEqual(Change.query.filter_by(kind='movie', item_id=concurrent.id).count(), 1)
+            imported = [movie.id for movie in Movie.query.filter(Movie.title.like('Imported%'))]
+            self.assertEqual(Change.query.filter(Change.item_id.in_(imported)).count(), 2)
+
+    def test_api_import(self):
+        import io
+        self.login()
+        self.client.get('/watchlist')  # 缓存页面和总数，导入后应失效
+        douban = '标题,个人评分\n肖申克的救赎 / The Shawshank Redemption,5\n霸王别姬,5\n'
+        response = self.client.post('/api/v1/import', data={
+            'file': (io.BytesIO(douban.encode('utf-8-sig')), 'douban.csv')})
+        self.assertEqual(response.get_json()['created'], 2)
+        self.assertIn('肖申克的救赎', self.client.get('/watchlist').get_data(as_text=True))
+        self.assertIn('3 movies in the watchlist', self.client.get('/watchlist').get_data(as_text=True))
+
+        ndjson = '{"title": "Book A"}\nnot json\n'
+        response = self.client.post('/api/v1/import?kind=book', data={
+            'file': (io.BytesIO(ndjson.encode('utf-8')), 'books.ndjson')})
+        data = response.get_json()
+        self.assertEqual((data['created'], data['invalid']), (1, 1))
+        self.assertEqual(self.client.post('/api/v1/import').status_code, 400)
+
+        # 超过大小限制的上传在解析之前就被拒绝，不知道大小的分块上传也不接受
+        app.config.update(IMPORT_MAX_SIZE=16, MAX_CONTENT_LENGTH=16)
+        self.addCleanup(app.config.update, IMPORT_MAX_SIZE=16 * 1024 * 1024, MAX_CONTENT_LENGTH=16 * 1024 * 1024)
+        response = self.client.post('/api/v1/import', data={
+            'file': (io.BytesIO(ndjson.encode('utf-8')), 'books.ndjson')})
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(response.get_json()['error'], 'File too large.')
+        response = self.client.post('/api/v1/import', input_stream=io.BytesIO(ndjson.encode('utf-8')),
+                                    content_type='multipart/form-data; boundary=x',
+                                    headers={'Transfer-Encoding': 'chunked'},
+                                    environ_overrides={'wsgi.input_terminated': True})
+        self.assertEqual(response.status_code, 411)
+        self.assertEqual(self.client.post('/watchlist', data={'title': 'x' * 32}).status_code, 413)
+
+    def test_query_budget(self):
+        from listweb.querystats import query_budget, QueryBudgetExceeded
+        for i in range(30):
+            db.session.add(Movie(title='Movie %d' % i, user_id=1))
+        db.session.commit()
+        self.login()
+        # 各页面的查询条数不随条目数增长
+        for path in ['/', '/watchlist', '/readlist', '/todolist', '/search?q=movie', '/api/v1/movies']:
+            with query_budget(3):
+                self.client.get(path)
+        with self.assertRaises(QueryBudgetExceeded) as cm:
+            with query_budget(1):
+                Movie.query.filter_by(id=1).first()
+                Movie.query.filter_by(id=2).first()
+        self.assertIn('2x SELECT', str(cm.exception))
+
+    def test_query_stats_logging(self):
+        from flask import Response
+        from listweb.querystats import check_request
+        app.config.update(SQL_QUERY_BUDGET=3, SQL_QUERY_HEADER=True)
+        self.addCleanup(app.config.update, SQL_QUERY_BUDGET=10, SQL_QUERY_HEADER=False)
+        with app.test_request_context('/watchlist'):
+            for i in range(6):
+                Movie.query.filter_by(id=i).first()
+            with self.assertLogs(app.logger, 'WARNING') as logs:
+                response = check_request(Response())
+        self.assertEqual(response.headers['X-Query-Count'], '6')
+        self.assertIn('ran 6 queries (budget 3)', logs.output[0])
+        self.assertIn('Probable N+1 on GET /watchlist, statement ran 6 times: SELECT', logs.output[1])
+
+    def test_server_timing(self):
+        import json
+        self.addCleanup(app.config.update, TIMING_SAMPLE_RATE=app.config['TIMING_SAMPLE_RATE'],
+                        TIMING_HEADER=app.config['TIMING_HEADER'])
+        app.config.update(TIMING_SAMPLE_RATE=1.0, TIMING_HEADER=True)
+        response = self.client.get('/watchlist?after=0')
+        timing = response.headers['Server-Timing']
+        self.assertRegex(timing, r'db;dur=[\d.]+;desc="\d+ queries"')
+        self.assertIn('render;dur=', timing)
+        self.assertTrue(timing.split(', ')[-1].startswith('total;dur='))
+
+        with self.assertLogs('listweb.timing', 'INFO') as logs:
+            response = self.client.post('/login', data=dict(username='test', password='123'))
+        self.assertIn('hash;dur=', response.headers['Server-Timing'])
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertEqual((record['method'], record['endpoint'], record['status']), ('POST', 'auth.login', 302))
+        self.assertIn('hash_ms', record)
+        self.assertIn('auth;dur=', self.client.get('/todolist').headers['Server-Timing'])
+        self.assertIn('static;dur=', self.client.get('/static/style.css').headers['Server-Timing'])
+
+        app.config['TIMING_SAMPLE_RATE'] = 0
+        self.assertNotIn('Server-Timing', self.client.get('/watchlist').headers)
+
+    def test_server_timing_admin_only(self):
+        # 默认只有管理员能看到 Server-Timing，匿名用户看不到其中校验密码的耗时
+        self.addCleanup(app.config.update, TIMING_SAMPLE_RATE=app.config['TIMING_SAMPLE_RATE'])
+        app.config['TIMING_SAMPLE_RATE'] = 1.0
+        self.assertIsNone(app.config['TIMING_HEADER'])
+        self.assertNotIn('Server-Timing', self.client.get('/watchlist').headers)
+        response = self.client.post('/login', data=dict(username='test', password='456'))
+        self.assertNotIn('Server-Timing', response.headers)
+        self.login()
+        self.assertIn('Server-Timing', self.client.get('/watchlist').headers)
+
+    def test_metrics(self):
+        import re
+
+        def sample(text, line):
+            match = re.search('^%s (\\S+)$' % re.escape(line), text, re.M)
+            return float(match.group(1)) if match else 0
+
+        app.config['METRICS_PUBLIC'] = True
+        self.addCleanup(app.config.update, METRICS_PUBLIC=False)
+        before = self.client.get('/metrics').get_data(as_text=True)
+        self.client.get('/watchlist')
+        self.client.get('/watchlist')
+        self.client.post('/login', data=dict(username='test', password='wrong'))
+        response = self.client.get('/metrics')
+        self.assertTrue(response.content_type.startswith('text/plain; version=0.0.4'))
+        text = response.get_data(as_text=True)
+        line = 'listweb_http_requests_total{endpoint="lists.watchlist",method="GET",status="200"}'
+        self.assertEqual(sample(text, line) - sample(before, line), 2)
+        line = 'listweb_cache_requests_total{cache="page",result="hit"}'
+        self.assertEqual(sample(text, line) - sample(before, line), 1)
+        line = 'listweb_login_attempts_total{result="failure"}'
+        self.assertEqual(sample(text, line) - sample(before, line), 1)
+        self.assertIn('listweb_http_request_duration_seconds_bucket{endpoint="lists.watchlist",le="+Inf"}', text)
+        self.assertIn('# TYPE listweb_http_request_duration_seconds histogram', text)
+        self.assertIn('listweb_list_items{list="movie"} 1', text)
+        self.assertIn('listweb_users 1', text)
+
+    def test_metrics_multiprocess(self):
+        import pickle
+        import shutil
+        import tempfile
+        from listweb import metrics
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        metrics.flush(directory)
+        # 模拟另一个 worker 写下的计数
+        with open(os.path.join(directory, 'metrics-999999.pickle'), 'wb') as f:
+            pickle.dump({'listweb_login_attempts_total': {('success',): 5}}, f)
+        local = metrics.collect()['listweb_login_attempts_total'].get(('success',), 0)
+        merged = metrics.collect(directory)['listweb_login_attempts_total'][('success',)]
+        self.assertEqual(merged, local + 5)
+
+        app.config.update(METRICS_DIR=directory, METRICS_PUBLIC=True)
+        self.addCleanup(app.config.update, METRICS_DIR=None, METRICS_PUBLIC=False)
+        text = self.client.get('/metrics').get_data(as_text=True)
+        self.assertIn('listweb_login_attempts_total{result="success"} %d' % (local + 5), text)
+
+        # 回收退出的 worker 后它的计数并入合计，文件删掉，同一个进程号的新进程从零开始
+        metrics.mark_dead(directory, 999999)
+        self.assertFalse(os.path.exists(os.path.join(directory, 'metrics-999999.pickle')))
+        with open(os.path.join(directory, 'metrics-999999.pickle'), 'wb') as f:
+            pickle.dump({'listweb_login_attempts_total': {('success',): 2}}, f)
+        merged = metrics.collect(directory)['listweb_login_attempts_total'][('success',)]
+        self.assertEqual(merged, local + 7)
+
+        metrics.clear(directory)
+        self.assertEqual(os.listdir(directory), [])
+
+    def test_metrics_admin_only(self):
+        self.assertFalse(app.config['METRICS_PUBLIC'])
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        self.login()
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+    def test_request_profiling(self):
+        app.config['PROFILER_ENABLED'] = True
+        self.addCleanup(app.config.update, PROFILER_ENABLED=False)
+        other = User(name='Other', username='other')
+        other.set_password('789')
+        db.session.add(other)
+        db.session.commit()
+        # 未登录或不是管理员时忽略剖析参数
+        self.assertIn('Test Movie Title', self.client.get('/watchlist?_profile=1').get_data(as_text=True))
+        self.client.post('/login', data=dict(username='other', password='789'))
+        self.assertNotIn('cumulative', self.client.get('/watchlist?_profile=1').get_data(as_text=True))
+        self.assertEqual(self.client.get('/admin/profile/stacks').status_code, 403)
+
+        self.client.get('/logout')
+        self.login()
+        response = self.client.get('/watchlist', headers={'X-Profile': '1'})
+        self.assertEqual(response.headers['X-Profiled-Status'], '200')
+        self.assertIn('Ordered by: cumulative time', response.get_data(as_text=True))
+
+    def test_stack_sampler(self):
+        import threading
+        from listweb import profiler
+        profiler.reset_samples()
+        self.addCleanup(profiler.reset_samples)
+        done = threading.Event()
+
+        def busy_view():
+            done.wait(5)
+
+        worker = threading.Thread(target=busy_view)
+        worker.start()
+        with profiler._lock:
+            profiler._active[worker.ident] = 'watchlist'
+        sampler = profiler.Sampler(0.01, 100)
+        sampler.sample()
+        sampler.sample()
+        done.set()
+        worker.join()
+        with profiler._lock:
+            profiler._active.pop(worker.ident)
+        lines = profiler.collapsed_stacks('watchlist').splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertRegex(lines[0], r'test_watchlist\.py:\d+:busy_view;')
+        self.assertTrue(lines[0].endswith(' 2'))
+        self.assertTrue(profiler.collapsed_stacks().startswith('watchlist;'))
+
+        app.config.update(PROFILER_ENABLED=True)
+        self.addCleanup(app.config.update, PROFILER_ENABLED=False)
+        self.login()
+        self.assertIn('busy_view', self.client.get('/admin/profile/stacks?reset=1').get_data(as_text=True))
+        self.assertEqual(self.client.get('/admin/profile/stacks').get_data(as_text=True), '')
+
+    def test_slowlog(self):
+        import tempfile
+        from listweb import slowlog
+        path = os.path.join(tempfile.mkdtemp(), 'slowlog.jsonl')
+        app.config.update(SLOWLOG_THRESHOLD_MS=0, SLOWLOG_FILE=path)
+        self.addCleanup(app.config.update, SLOWLOG_THRESHOLD_MS=100, SLOWLOG_FILE=None)
+        self.addCleanup(slowlog.clear, path)
+        slowlog.clear(path)
+        with app.app_context():
+            for i in range(3):
+                Movie.query.filter_by(title='Title %d' % i).all()  # title 上没有索引
+            Movie.query.filter_by(user_id=1).all()
+        groups = {group['statement']: group for group in slowlog.summarize(slowlog.recent())}
+        scan = [group for statement, group in groups.items() if 'movie.title = ?' in statement][0]
+        self.assertEqual(scan['count'], 3)
+        self.assertTrue(scan['scan'])
+        self.assertEqual(scan['plan'], ['SCAN movie'])
+        search = [group for statement, group in groups.items() if 'movie.user_id = ?' in statement][0]
+        self.assertFalse(search['scan'])
+        self.assertIn('USING INDEX ix_movie_user_id_id', search['plan'][0])
+
+        result = self.runner.invoke(args=['slowlog', '--scans'])
+        self.assertIn('3x', result.output)
+        self.assertIn('FULL SCAN', result.output)
+        self.assertIn("last: - ('Title 2',", result.output)
+        self.assertNotIn('movie.user_id = ?', result.output)
+
+        self.login()
+        self.assertIn('full table scan', self.client.get('/admin/slowlog').get_data(as_text=True))
+        self.runner.invoke(args=['slowlog', '--clear'])
+        self.assertFalse(os.path.exists(path))
+
+    def test_create_app(self):
+        import subprocess
+        import sys
+        from listweb import create_app
+        other = create_app({'TESTING': True, 'LIST_PAGE_SIZE': 5})
+        self.assertIsNot(other, app)
+        self.assertEqual(other.config['LIST_PAGE_SIZE'], 5)
+        endpoints = {rule.endpoint for rule in other.url_map.iter_rules()}
+        self.assertLessEqual({'lists.watchlist', 'auth.login', 'settings.settings', 'api.api_list', 'metrics'},
+                             endpoints)
+        self.assertIn('initdb', other.cli.commands)
+
+        # 视图模块和按需使用的钩子模块在第一次用到时才导入，生产服务器只在 flask serve 时导入
+        deferred = ('listweb.views', 'listweb.auth', 'listweb.api', 'listweb.profiler', 'listweb.slowlog',
+                    'listweb.assets', 'listweb.fingerprint', 'listweb.compress', 'listweb.serve', 'cProfile')
+        code = ('import sys; from listweb import create_app; create_app(); '
+                'print(sorted(m for m in %r if m in sys.modules))' % (deferred,))
+        output = subprocess.check_output([sys.executable, '-c', code], cwd=os.path.dirname(os.path.abspath(__file__)))
+        self.assertEqual(output.strip(), b'[]')
+
+    def test_prefork_server(self):
+        import pickle
+        import shutil
+        import signal
+        import subprocess
+        import sys
+        import tempfile
+        import urllib.request
+        from listweb import create_app
+        from listweb.serve import warm
+        fd, path = tempfile.mkstemp(suffix='.db')
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        metrics_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, metrics_dir)
+        other = create_app({'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + path})
+        with other.app_context():
+            db.create_all()
+        views, templates = warm(other)
+        self.assertGreater(views, 20)
+        self.assertIn('listweb.views', sys.modules)
+        self.assertGreater(templates, 10)
+
+        server = subprocess.Popen([sys.executable, '-m', 'listweb.serve', '--bind', '127.0.0.1:0', '--workers', '2'],
+                                  cwd=os.path.dirname(os.path.abspath(__file__)),
+                                  env=dict(os.environ, DATABASE_FILE=path, METRICS_DIR=metrics_dir),
+                                  stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, universal_newlines=True)
+        self.addCleanup(server.kill)
+
+        def listening():
+            for line in server.stdout:
+                if line.startswith('Listening on '):
+                    return line.split()[2]
+
+        url = listening()
+        for _ in range(6):
+            self.assertEqual(urllib.request.urlopen(url + '/').status, 200)
+        server.send_signal(signal.SIGHUP)  # 平滑重启后仍在同一个地址上
+        self.assertEqual(listening(), url)
+        self.assertEqual(urllib.request.urlopen(url + '/readlist').status, 200)
+        server.terminate()
+        self.assertEqual(server.wait(10), 0)
+        server.stdout.close()
+
+        # worker 退出前把还没写出的计数补上，所有请求都算进了汇总
+        requests = 0
+        for name in os.listdir(metrics_dir):
+            with open(os.path.join(metrics_dir, name), 'rb') as f:
+                requests += sum(pickle.load(f).get('listweb_http_requests_total', {}).values())
+        self.assertEqual(requests, 7)
+
+    def test_compile_templates(self):
+        import shutil
+        import tempfile
+        from listweb import create_app
+        from listweb.templating import compile_templates
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        count = compile_templates(create_app({'TEMPLATE_CACHE_DIR': directory}))
+        self.assertEqual(count, len(os.listdir(directory)))
+        self.assertGreater(count, 10)
+
+        # 另一个进程（新的程序实例）直接读取字节码，不再编译
+        other = create_app({'TEMPLATE_CACHE_DIR': directory})
+
+        def compile(*args, **kwargs):
+            raise AssertionError('template compiled again')
+
+        other.jinja_env.compile = compile
+        self.assertTrue(hasattr(other.jinja_env.get_template('_macros.html').module, 'render_pager'))
+        other.jinja_env.get_template('watchlist.html')
+
+        with self.assertRaises(RuntimeError):
+            compile_templates(create_app({'TEMPLATE_CACHE_DIR': None}))
+
     def test_forge_command(self):
         result = self.runner.invoke(forge)
         self.assertIn('Done.', result.output)
         self.assertNotEqual(Movie.query.count(), 0)
 
+    def test_forge_bulk(self):
+        from listweb.models import Book, Todo
+        result = self.runner.invoke(forge, ['--users', '3', '--movies', '500', '--todos', '50', '--seed', '7'])
+        self.assertIn('Inserted 3 users, 500 movies, 0 books and 50 todos', result.output)
+        self.assertEqual((User.query.count(), Movie.query.count(), Book.query.count(), Todo.query.count()),
+                         (3, 500, 0, 50))
+        titles = [m.title for m in Movie.query.order_by(Movie.id).limit(20)]
+        self.runner.invoke(forge, ['--users', '3', '--movies', '500', '--todos', '50', '--seed', '7'])
+        self.assertEqual([m.title for m in Movie.query.order_by(Movie.id).limit(20)], titles)
+
+        self.client.post('/login', data=dict(username='user2', password='password'))
+        self.assertEqual(self.client.get('/api/v1/movies').get_json()['total'],
+                         Movie.query.filter_by(user_id=2).count())
+        self.assertEqual(len(self.client.get('/api/v1/changes?limit=1000').get_json()['changes']),
+                         Movie.query.filter_by(user_id=2).count() + Todo.query.filter_by(user_id=2).count())
+        self.assertIn('The ', self.client.get('/search?q=the').get_data(as_text=True))
+
+    def test_bench_command(self):
+        import json
+        import tempfile
+        from benchmarks.runner import compare, percentile
+        self.assertEqual(percentile([1, 2, 3, 4], 50), 2)
+        self.assertEqual(percentile(list(range(1, 101)), 99), 99)
+
+        fd, path = tempfile.mkstemp(suffix='.json')
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        result = self.runner.invoke(args=['bench', '--drivers', 'client', '--requests', '3', '--output', path])
+        self.assertEqual(result.exit_code, 0, repr(result.exception))
+        with open(path) as f:
+            results = json.load(f)
+        scenarios = results['results']['small']['client']
+        self.assertEqual(set(scenarios), {'index', 'watchlist', 'readlist', 'todolist', 'login', 'add', 'edit',
+                                          'delete'})
+        self.assertTrue(all(summary['errors'] == 0 and summary['requests'] == 3 for summary in scenarios.values()))
+        self.assertEqual(compare(results, results), [])
+        scenarios['index']['p95_ms'] *= 2
+        self.assertEqual(compare(results, json.loads(json.dumps(results).replace('"p95_ms"', '"x"'))), [])
+        self.assertEqual(len(compare({'results': {'small': {'client': {'index': {'p95_ms': 10}}}}},
+                                     {'results': {'small': {'client': {'index': {'p95_ms': 5}}}}})), 1)
+
     def test_initdb_command(self):
         result = self.runner.invoke(initdb)
         self.assertIn('Initialized database.', result.output)